@@ -1,17 +1,48 @@
 """
 数据库连接和初始化
 """
-from sqlalchemy import create_engine
+import logging
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import config
 
+logger = logging.getLogger(__name__)
+
 # 创建数据库引擎
 engine = create_engine(
     config.DATABASE_URL,
     connect_args={"check_same_thread": False} if "sqlite" in config.DATABASE_URL else {}
 )
 
+
+def sqlite_pragmas() -> dict:
+    """tuned 配置下每个SQLite连接设置的参数"""
+    return {
+        # 先设置忙等待，后面切换日志模式时遇到其他连接持有锁也会等待
+        "busy_timeout": config.SQLITE_BUSY_TIMEOUT_MS,
+        # WAL：读不阻塞写、写不阻塞读（日志模式保存在数据库文件中）
+        "journal_mode": "WAL",
+        # WAL模式下NORMAL只在检查点时同步，断电可能丢失最近的事务但不会损坏数据库
+        "synchronous": "NORMAL",
+        # 负数表示以KB为单位
+        "cache_size": -config.SQLITE_CACHE_SIZE_KB,
+        "mmap_size": config.SQLITE_MMAP_SIZE,
+    }
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in sqlite_pragmas().items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+    finally:
+        cursor.close()
+
+
+if engine.dialect.name == "sqlite" and config.SQLITE_PROFILE == "tuned":
+    event.listen(engine, "connect", _apply_sqlite_pragmas)
+
 # 创建会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -30,7 +61,9 @@ def get_db():
 
 def init_db():
     """初始化数据库表"""
-    from app.models import Teacher, Template, Task, Questionnaire, QuestionnaireResponse
+    from app.models import (
+        Teacher, Template, Task, TaskTeacher, Questionnaire, QuestionnaireTeacher, QuestionnaireResponse, ExportJob
+    )
     from sqlalchemy import inspect, text
     
     # 创建所有表
@@ -97,6 +130,70 @@ def init_db():
                 except Exception as e:
                     print(f"更新 placeholder_positions NULL值时出错: {e}")
     
+    # 检查tasks表的导出相关列
+    if 'tasks' in inspector.get_table_names():
+        columns = [col['name'] for col in inspector.get_columns('tasks')]
+        task_columns = {
+            'render_fingerprints': "TEXT",
+            'stage_timings': "TEXT",
+            'export_manifest': "TEXT",
+            'progress_total': "INTEGER",
+            'progress_processed': "INTEGER",
+            'progress_failed': "INTEGER",
+            'started_at': "DATETIME",
+            'cancel_requested': "BOOLEAN DEFAULT 0",
+            'output_format': "VARCHAR(20) DEFAULT 'zip'",
+        }
+        
+        with engine.connect() as conn:
+            for column_name, column_type in task_columns.items():
+                if column_name not in columns:
+                    try:
+                        conn.execute(text(f"ALTER TABLE tasks ADD COLUMN {column_name} {column_type}"))
+                        conn.commit()
+                        print(f"已添加 {column_name} 列")
+                    except Exception as e:
+                        print(f"添加 {column_name} 列时出错（可能已存在）: {e}")
+    
+    # 检查export_jobs表的调度、去重相关列
+    if 'export_jobs' in inspector.get_table_names():
+        columns = [col['name'] for col in inspector.get_columns('export_jobs')]
+        job_columns = {
+            'priority': "INTEGER DEFAULT 10",
+            'dedup_key': "VARCHAR(64)",
+            'parent_job_id': "INTEGER",
+            'kind': "VARCHAR(20) DEFAULT 'export'",
+        }
+        
+        with engine.connect() as conn:
+            for column_name, column_type in job_columns.items():
+                if column_name not in columns:
+                    try:
+                        conn.execute(text(f"ALTER TABLE export_jobs ADD COLUMN {column_name} {column_type}"))
+                        conn.commit()
+                        print(f"已添加 {column_name} 列")
+                    except Exception as e:
+                        print(f"添加 {column_name} 列时出错（可能已存在）: {e}")
+    
+    # 已有表上新增的索引（create_all 不会为已存在的表创建索引）
+    for index in QuestionnaireResponse.__table__.indexes:
+        try:
+            index.create(bind=engine, checkfirst=True)
+        except Exception as e:
+            print(f"创建索引 {index.name} 时出错: {e}")
+    
+    # 由teacher_ids回填task_teachers、questionnaire_teachers关联表（只处理还没有关联记录的任务/问卷）
+    from app.services.membership import backfill_task_teachers, backfill_questionnaire_teachers
+    for label, backfill in (("任务", backfill_task_teachers), ("问卷", backfill_questionnaire_teachers)):
+        db = SessionLocal()
+        try:
+            backfill(db)
+        except Exception as e:
+            db.rollback()
+            logger.exception("回填%s教师关联时出错: %s", label, e)
+        finally:
+            db.close()
+    
     print("数据库初始化完成！")
 
 
@@ -9,6 +9,10 @@ from sqlalchemy.orm import Session
 from pathlib import Path
 import secrets
 import config
+from app.utils.logging_setup import setup_logging
+
+# 应用日志通过队列异步输出
+setup_logging()
 
 # 创建FastAPI应用
 app = FastAPI(
@@ -499,9 +503,29 @@ async def startup_event():
     """启动时初始化数据库"""
     from app.database import init_db
     init_db()
+    if config.PDF_FONT_WARMUP:
+        # 预先查找并注册中文字体，避免第一次导出时扫描字体目录
+        from app.services.font_registry import warm_up
+        warm_up()
+    if config.EXPORT_EMBEDDED_WORKER:
+        # 在Web进程内执行导出作业（也可以关闭后单独运行 python -m app.worker）
+        from app.services.job_queue import ExportWorker
+        app.state.export_worker = ExportWorker()
+        app.state.export_worker.start()
     print("系统启动完成！")
 
 
+@app.on_event("shutdown")
+def shutdown_event():
+    """停止内嵌的导出工作线程（正在执行的作业在租约到期后由其他工作进程接管），并停止写队列"""
+    export_worker = getattr(app.state, "export_worker", None)
+    if export_worker is not None:
+        export_worker.stop(timeout=0)
+    # 写完写队列中已排队的写操作
+    from app.services.write_queue import write_queue
+    write_queue.stop(timeout=10)
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
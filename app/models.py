@@ -1,7 +1,7 @@
 """
 数据库模型定义
 """
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Boolean, JSON
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Boolean, JSON, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.database import Base
@@ -56,15 +56,39 @@ class Task(Base):
     name = Column(String(200), nullable=False, comment="任务名称")
     template_id = Column(Integer, ForeignKey("templates.id"), nullable=False)
     teacher_ids = Column(JSON, default=[], comment="需要填写的教师ID列表")
-    status = Column(String(20), default="pending", comment="状态：pending/completed")
-    export_path = Column(String(500), comment="导出文件路径（ZIP）")
+    status = Column(String(20), default="pending", comment="状态：pending/processing/completed/failed/cancelled")
+    export_path = Column(String(500), comment="导出文件路径（ZIP或合并PDF）")
+    output_format = Column(String(20), default="zip", comment="导出格式：zip（每位教师一个文件）/pdf（合并为一个可直接打印的PDF）")
     created_by = Column(String(100), comment="创建人")
     created_at = Column(DateTime, default=datetime.now)
     completed_at = Column(DateTime, comment="完成时间")
+    render_fingerprints = Column(JSON, comment="每位教师的渲染指纹（{teacher_id: {fingerprint, entry}}），用于增量导出")
+    stage_timings = Column(JSON, comment="最近一次导出各阶段耗时（{阶段: {seconds, count}}）")
+    export_manifest = Column(JSON, comment="每位教师的导出结果（{teacher_id: {name, entry, status: ok/failed, error}}）")
+    progress_total = Column(Integer, comment="导出进度：本次导出的教师数")
+    progress_processed = Column(Integer, comment="导出进度：已处理成功的教师数")
+    progress_failed = Column(Integer, comment="导出进度：处理失败的教师数")
+    started_at = Column(DateTime, comment="导出开始时间")
+    cancel_requested = Column(Boolean, default=False, comment="是否已请求取消导出")
     
     # 关联关系
     template = relationship("Template", back_populates="tasks")
-    # 注意：Task和Teacher之间通过teacher_ids JSON字段关联，不是外键关系
+    # 注意：Task和Teacher之间通过teacher_ids JSON字段关联，不是外键关系；
+    # 按教师查询任务使用 task_teachers 关联表（与 teacher_ids 同时写入），删除任务时一并删除
+    teacher_links = relationship("TaskTeacher", cascade="all, delete-orphan")
+
+
+class TaskTeacher(Base):
+    """任务-教师关联表（由 tasks.teacher_ids 生成，用于按教师查询任务）"""
+    __tablename__ = "task_teachers"
+    
+    task_id = Column(Integer, ForeignKey("tasks.id"), primary_key=True)
+    # 与 teacher_ids 一致，不设外键（删除教师不影响任务记录）
+    teacher_id = Column(Integer, primary_key=True)
+    
+    __table_args__ = (
+        Index("ix_task_teachers_teacher_task", "teacher_id", "task_id"),
+    )
 
 
 class Questionnaire(Base):
@@ -84,6 +108,21 @@ class Questionnaire(Base):
     
     # 关联关系
     responses = relationship("QuestionnaireResponse", back_populates="questionnaire")
+    # 成员检查和按教师查询使用 questionnaire_teachers 关联表（与 teacher_ids 同时写入）
+    teacher_links = relationship("QuestionnaireTeacher", cascade="all, delete-orphan")
+
+
+class QuestionnaireTeacher(Base):
+    """问卷-教师关联表（由 questionnaires.teacher_ids 生成，用于成员检查和催填名单）"""
+    __tablename__ = "questionnaire_teachers"
+    
+    questionnaire_id = Column(Integer, ForeignKey("questionnaires.id"), primary_key=True)
+    # 与 teacher_ids 一致，不设外键
+    teacher_id = Column(Integer, primary_key=True)
+    
+    __table_args__ = (
+        Index("ix_questionnaire_teachers_teacher_questionnaire", "teacher_id", "questionnaire_id"),
+    )
 
 
 class QuestionnaireResponse(Base):
@@ -105,4 +144,31 @@ class QuestionnaireResponse(Base):
     # 关联关系
     questionnaire = relationship("Questionnaire", back_populates="responses")
     teacher = relationship("Teacher", back_populates="questionnaire_responses")
+    
+    __table_args__ = (
+        # 按问卷+教师查找回答（身份验证、确认、提交、催填名单）
+        Index("ix_questionnaire_responses_questionnaire_teacher", "questionnaire_id", "teacher_id"),
+    )
+
+
 
+class ExportJob(Base):
+    """导出作业表（持久化的导出队列，由导出工作进程领取执行）"""
+    __tablename__ = "export_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    task_id = Column(Integer, ForeignKey("tasks.id"), nullable=False, index=True)
+    teacher_ids = Column(JSON, default=[], comment="本次导出的教师ID列表")
+    kind = Column(String(20), default="export", comment="作业类型：export（导出）/retry（只重新导出失败的教师，追加到已有的ZIP）")
+    status = Column(String(20), default="queued", index=True, comment="状态：queued/running/attached/done/failed/cancelled")
+    priority = Column(Integer, default=10, comment="优先级（数值越小越先执行）")
+    dedup_key = Column(String(64), index=True, comment="导出内容键（模板版本 + 教师ID + 数据版本），相同的导出只执行一次")
+    parent_job_id = Column(Integer, comment="附加到的作业ID（相同导出正在执行或已完成时，直接使用其结果）")
+    attempts = Column(Integer, default=0, comment="已领取执行的次数")
+    lease_owner = Column(String(100), comment="持有租约的工作进程")
+    lease_expires_at = Column(DateTime, comment="租约到期时间（工作进程通过心跳续期）")
+    heartbeat_at = Column(DateTime, comment="最近一次心跳时间")
+    error = Column(Text, comment="失败原因")
+    created_at = Column(DateTime, default=datetime.now)
+    started_at = Column(DateTime, comment="开始执行时间")
+    finished_at = Column(DateTime, comment="结束时间")
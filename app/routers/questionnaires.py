@@ -10,6 +10,11 @@ from datetime import datetime
 import secrets
 from app.database import get_db
 from app.models import Questionnaire, QuestionnaireResponse, Teacher
+from app.services.write_queue import run_write
+from app.services.membership import (
+    set_questionnaire_teachers, is_questionnaire_teacher, resolve_share_token, share_token_cache,
+    pending_teacher_ids
+)
 
 router = APIRouter(prefix="/api/questionnaires", tags=["问卷系统"])
 
@@ -120,12 +125,13 @@ def create_questionnaire(questionnaire: QuestionnaireCreate, db: Session = Depen
         title=questionnaire.title,
         description=questionnaire.description,
         fields=fields_data,
-        teacher_ids=questionnaire.teacher_ids,
         deadline=questionnaire.deadline,
         created_by=questionnaire.created_by,
         status="active",
         share_token=share_token
     )
+    # 同时写入 teacher_ids 和问卷-教师关联表
+    set_questionnaire_teachers(db_questionnaire, questionnaire.teacher_ids)
     db.add(db_questionnaire)
     db.commit()
     db.refresh(db_questionnaire)
@@ -143,51 +149,52 @@ def submit_response(response: QuestionnaireResponseCreate, db: Session = Depends
     if questionnaire.status != "active":
         raise HTTPException(status_code=400, detail="问卷已关闭")
     
-    # 检查是否已提交
-    existing = db.query(QuestionnaireResponse).filter(
-        QuestionnaireResponse.questionnaire_id == response.questionnaire_id,
-        QuestionnaireResponse.teacher_id == response.teacher_id
-    ).first()
-    
-    if existing:
-        # 更新已有回答
-        existing.answers = response.answers
-        existing.submitted_at = datetime.now()
-        existing.status = "pending"
-    else:
-        # 创建新回答
-        existing = QuestionnaireResponse(
-            questionnaire_id=response.questionnaire_id,
-            teacher_id=response.teacher_id,
-            answers=response.answers,
-            status="pending"
+    def save_response(session: Session) -> QuestionnaireResponseResponse:
+        # 检查是否已提交
+        existing = session.query(QuestionnaireResponse).filter(
+            QuestionnaireResponse.questionnaire_id == response.questionnaire_id,
+            QuestionnaireResponse.teacher_id == response.teacher_id
+        ).first()
+        
+        if existing:
+            # 更新已有回答
+            existing.answers = response.answers
+            existing.submitted_at = datetime.now()
+            existing.status = "pending"
+        else:
+            # 创建新回答
+            existing = QuestionnaireResponse(
+                questionnaire_id=response.questionnaire_id,
+                teacher_id=response.teacher_id,
+                answers=response.answers,
+                status="pending"
+            )
+            session.add(existing)
+        session.flush()
+        
+        # 自动合并到教师数据（无需审核）
+        teacher = session.query(Teacher).filter(Teacher.id == response.teacher_id).first()
+        if teacher:
+            if not teacher.extra_data:
+                teacher.extra_data = {}
+            teacher.extra_data.update(existing.answers)
+            teacher.updated_at = datetime.now()
+        
+        return QuestionnaireResponseResponse(
+            id=existing.id,
+            questionnaire_id=existing.questionnaire_id,
+            teacher_id=existing.teacher_id,
+            teacher_name=teacher.name if teacher else "",
+            answers=existing.answers,
+            status=existing.status,
+            reviewed_by=existing.reviewed_by,
+            reviewed_at=existing.reviewed_at,
+            review_comment=existing.review_comment,
+            submitted_at=existing.submitted_at
         )
-        db.add(existing)
-    
-    db.commit()
-    db.refresh(existing)
-    
-    # 自动合并到教师数据（无需审核）
-    teacher = db.query(Teacher).filter(Teacher.id == response.teacher_id).first()
-    if teacher:
-        if not teacher.extra_data:
-            teacher.extra_data = {}
-        teacher.extra_data.update(existing.answers)
-        teacher.updated_at = datetime.now()
-        db.commit()
     
-    return QuestionnaireResponseResponse(
-        id=existing.id,
-        questionnaire_id=existing.questionnaire_id,
-        teacher_id=existing.teacher_id,
-        teacher_name=teacher.name if teacher else "",
-        answers=existing.answers,
-        status=existing.status,
-        reviewed_by=existing.reviewed_by,
-        reviewed_at=existing.reviewed_at,
-        review_comment=existing.review_comment,
-        submitted_at=existing.submitted_at
-    )
+    # 保存回答和合并教师数据在同一个短写事务中完成（启用写队列时由写线程执行）
+    return run_write(save_response, db)
 
 
 @router.get("/responses/{response_id}", response_model=QuestionnaireResponseResponse)
@@ -317,9 +324,34 @@ def close_questionnaire(questionnaire_id: int, db: Session = Depends(get_db)):
     
     questionnaire.status = "closed"
     db.commit()
+    share_token_cache.invalidate(questionnaire.share_token)
     return {"message": "问卷已关闭"}
 
 
+@router.get("/{questionnaire_id}/pending-teachers")
+def get_pending_teachers(questionnaire_id: int, db: Session = Depends(get_db)):
+    """催填名单：问卷中还没有提交或确认的教师"""
+    questionnaire = db.query(Questionnaire).filter(Questionnaire.id == questionnaire_id).first()
+    if not questionnaire:
+        raise HTTPException(status_code=404, detail="问卷不存在")
+    
+    teacher_ids = pending_teacher_ids(db, questionnaire_id)
+    teachers = db.query(Teacher).filter(Teacher.id.in_(teacher_ids)).order_by(Teacher.id).all() if teacher_ids else []
+    return {
+        "questionnaire_id": questionnaire_id,
+        "total": len(teachers),
+        "teachers": [
+            {
+                "id": teacher.id,
+                "name": teacher.name,
+                "phone": teacher.phone,
+                "department": teacher.department
+            }
+            for teacher in teachers
+        ]
+    }
+
+
 @router.get("/{questionnaire_id}/share-link")
 def get_share_link(questionnaire_id: int, db: Session = Depends(get_db)):
     """获取问卷分享链接"""
@@ -346,8 +378,8 @@ def get_share_link(questionnaire_id: int, db: Session = Depends(get_db)):
 @router.post("/confirm/{share_token}/auth")
 def authenticate_teacher(share_token: str, auth: TeacherAuth, db: Session = Depends(get_db)):
     """教师身份验证（通过身份证号和手机号）"""
-    # 查找问卷
-    questionnaire = db.query(Questionnaire).filter(Questionnaire.share_token == share_token).first()
+    # 查找问卷（分享链接解析结果有缓存）
+    questionnaire = resolve_share_token(db, share_token)
     if not questionnaire:
         raise HTTPException(status_code=404, detail="问卷不存在或链接无效")
     
@@ -361,9 +393,7 @@ def authenticate_teacher(share_token: str, auth: TeacherAuth, db: Session = Depe
         raise HTTPException(status_code=401, detail="身份证号或手机号不正确")
     
     # 检查教师是否在问卷的教师列表中
-    # 确保teacher_ids是整数列表进行比较
-    q_teacher_ids = [int(tid) for tid in questionnaire.teacher_ids if tid is not None] if questionnaire.teacher_ids else []
-    if teacher.id not in q_teacher_ids:
+    if not is_questionnaire_teacher(db, questionnaire.id, teacher.id):
         raise HTTPException(status_code=403, detail="您不在本次问卷的教师列表中")
     
     # 查找或创建问卷回答
@@ -401,7 +431,7 @@ def authenticate_teacher(share_token: str, auth: TeacherAuth, db: Session = Depe
 def confirm_response(share_token: str, auth: TeacherAuth, confirm: ConfirmRequest, db: Session = Depends(get_db)):
     """确认或拒绝问卷信息"""
     # 验证身份
-    questionnaire = db.query(Questionnaire).filter(Questionnaire.share_token == share_token).first()
+    questionnaire = resolve_share_token(db, share_token)
     if not questionnaire:
         raise HTTPException(status_code=404, detail="问卷不存在或链接无效")
     
@@ -410,9 +440,7 @@ def confirm_response(share_token: str, auth: TeacherAuth, confirm: ConfirmReques
         Teacher.phone == auth.phone
     ).first()
     
-    # 确保teacher_ids是整数列表进行比较
-    q_teacher_ids = [int(tid) for tid in questionnaire.teacher_ids if tid is not None] if questionnaire.teacher_ids else []
-    if not teacher or teacher.id not in q_teacher_ids:
+    if not teacher or not is_questionnaire_teacher(db, questionnaire.id, teacher.id):
         raise HTTPException(status_code=401, detail="身份验证失败")
     
     # 查找回答
@@ -425,12 +453,19 @@ def confirm_response(share_token: str, auth: TeacherAuth, confirm: ConfirmReques
         raise HTTPException(status_code=404, detail="未找到您的问卷回答")
     
     # 更新确认状态
-    response.confirmed_status = "confirmed" if confirm.confirmed else "rejected"
-    response.confirmed_at = datetime.now()
-    db.commit()
+    response_id = response.id
+    confirmed_status = "confirmed" if confirm.confirmed else "rejected"
+    
+    def save_confirmation(session: Session):
+        session.query(QuestionnaireResponse).filter(QuestionnaireResponse.id == response_id).update({
+            QuestionnaireResponse.confirmed_status: confirmed_status,
+            QuestionnaireResponse.confirmed_at: datetime.now(),
+        }, synchronize_session=False)
+    
+    run_write(save_confirmation, db)
     
     return {
         "message": "确认成功" if confirm.confirmed else "已标记为信息有误",
-        "confirmed_status": response.confirmed_status
+        "confirmed_status": confirmed_status
     }
 
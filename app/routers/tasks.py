@@ -1,24 +1,42 @@
 """
 填报任务API
 """
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Request
+import logging
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import List, Optional, Dict, Any
 from pydantic import BaseModel
 from datetime import datetime
 from pathlib import Path
 from app.database import get_db
-from app.models import Task, Template
-from app.services.export_service import batch_export
+from app.models import Task, TaskTeacher, Template
+from app.services.export_service import (
+    build_teacher_data, prepare_export_jobs, stream_export_zip, stream_merged_pdf, export_dedup_key
+)
+from app.services.export_progress import progress_snapshot
+from app.services.membership import (
+    set_task_teachers, teacher_tasks_query, is_task_teacher, task_questionnaire, completed_task_teacher_ids
+)
+from app.services.job_queue import (
+    enqueue_export, enqueue_retry, cancel_queued_job, ensure_queue_capacity, delete_task_jobs, export_teacher_ids
+)
+from app.services.export_scheduler import (
+    ExportBusy, export_scheduler, job_priority, PRIORITY_INTERACTIVE
+)
+import config
 
 router = APIRouter(prefix="/api/tasks", tags=["填报任务"])
 
+logger = logging.getLogger(__name__)
+
 
 class TaskCreate(BaseModel):
     name: str
     template_id: int
     teacher_ids: List[int]
     created_by: Optional[str] = None
+    # 导出格式：zip（每位教师一个文件）/pdf（按教师顺序合并为一个PDF，仅PDF模板）
+    output_format: str = "zip"
 
 
 class TaskResponse(BaseModel):
@@ -31,11 +49,19 @@ class TaskResponse(BaseModel):
     created_by: Optional[str]
     created_at: datetime
     completed_at: Optional[datetime]
+    output_format: Optional[str] = None
+    stage_timings: Optional[Dict[str, Any]] = None
+    progress_failed: Optional[int] = None
 
     class Config:
         from_attributes = True
 
 
+def _too_busy(e: ExportBusy) -> HTTPException:
+    """导出繁忙时返回429，并通过Retry-After告知客户端多久后重试"""
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
 @router.get("/", response_model=List[TaskResponse])
 def get_tasks(db: Session = Depends(get_db)):
     """获取任务列表"""
@@ -80,23 +106,8 @@ def get_task_detail(task_id: int, db: Session = Depends(get_db)):
     # 找出未知字段（不在可用字段列表中的字段，且不是额外占位符）
     unknown_fields = used_field_names - available_field_names - set(extra_placeholders)
     
-    # 检查是否有关联的问卷（通过任务ID或教师ID匹配）
-    from app.models import Questionnaire
-    questionnaire = None
-    if task.teacher_ids:
-        # 确保teacher_ids是整数列表
-        task_teacher_ids = [int(tid) for tid in task.teacher_ids if tid is not None]
-        
-        # 查找包含这些教师的问卷
-        questionnaires = db.query(Questionnaire).all()
-        for q in questionnaires:
-            if q.teacher_ids:
-                # 确保问卷的teacher_ids也是整数列表
-                q_teacher_ids = [int(tid) for tid in q.teacher_ids if tid is not None]
-                # 检查是否有交集
-                if set(q_teacher_ids) & set(task_teacher_ids):
-                    questionnaire = q
-                    break
+    # 检查是否有关联的问卷（与任务有共同教师的问卷，通过关联表索引查询）
+    questionnaire = task_questionnaire(db, task.id)
     
     return {
         "task": {
@@ -123,69 +134,71 @@ def get_task_detail(task_id: int, db: Session = Depends(get_db)):
 
 
 @router.post("/", response_model=TaskResponse)
-def create_task(task: TaskCreate, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+def create_task(task: TaskCreate, db: Session = Depends(get_db)):
     """创建填报任务并开始批量导出"""
     # 检查模板是否存在
     template = db.query(Template).filter(Template.id == task.template_id).first()
     if not template:
         raise HTTPException(status_code=404, detail="模板不存在")
     
+    if task.output_format not in ("zip", "pdf"):
+        raise HTTPException(status_code=400, detail="导出格式只能是zip或pdf")
+    if task.output_format == "pdf" and template.file_type != '.pdf':
+        raise HTTPException(status_code=400, detail="只有PDF模板可以合并导出为一个PDF")
+    
     # 检查是否有额外占位符
     placeholder_positions = template.placeholder_positions or []
     extra_placeholders = [pos.get("field_name") for pos in placeholder_positions if pos.get("is_extra")]
     has_extra_placeholders = len(extra_placeholders) > 0
     
+    # 导出队列已满时不创建任务
+    dedup_key = None
+    if not has_extra_placeholders:
+        try:
+            ensure_queue_capacity(db)
+        except ExportBusy as e:
+            raise _too_busy(e)
+        # 导出内容键需要读取模板文件，在写入任务之前计算
+        dedup_key = export_dedup_key(task.template_id, task.teacher_ids, db, task.output_format)
+    
     # 创建任务记录
     db_task = Task(
         name=task.name,
         template_id=task.template_id,
-        teacher_ids=task.teacher_ids,
         created_by=task.created_by,
+        output_format=task.output_format,
         status="pending" if has_extra_placeholders else "processing"  # 有额外占位符时，状态为pending，等待问卷
     )
+    # 同时写入 teacher_ids 和任务-教师关联表
+    set_task_teachers(db_task, task.teacher_ids)
     db.add(db_task)
-    db.commit()
-    db.refresh(db_task)
     
     # 如果有额外占位符，不直接导出，等待问卷完成
     if has_extra_placeholders:
         # 不执行导出任务，返回任务信息，提示需要发起问卷
+        db.commit()
+        db.refresh(db_task)
         return db_task
     
-    # 后台执行导出任务
-    def export_task():
-        from app.database import SessionLocal
-        db_session = SessionLocal()
-        try:
-            export_path = batch_export(
-                template_id=task.template_id,
-                teacher_ids=task.teacher_ids,
-                db=db_session,
-                task_name=task.name
-            )
-            # 更新任务状态
-            task_record = db_session.query(Task).filter(Task.id == db_task.id).first()
-            if task_record:
-                task_record.export_path = export_path
-                task_record.status = "completed"
-                task_record.completed_at = datetime.now()
-                db_session.commit()
-        except Exception as e:
-            task_record = db_session.query(Task).filter(Task.id == db_task.id).first()
-            if task_record:
-                task_record.status = "failed"
-                db_session.commit()
-            print(f"导出任务失败: {e}")
-        finally:
-            db_session.close()
-    
-    background_tasks.add_task(export_task)
+    # 加入导出作业队列，由导出工作进程执行（相同内容的导出正在进行或已完成时直接共用结果）
+    # 任务和作业在同一个事务中提交，入队失败时不会留下没有作业的"processing"任务
+    try:
+        db.flush()
+        enqueue_export(db, db_task.id, task.teacher_ids, dedup_key=dedup_key)
+        db.commit()
+    except ExportBusy as e:
+        db.rollback()
+        raise _too_busy(e)
+    except Exception:
+        db.rollback()
+        raise
+    db.refresh(db_task)
     
     return db_task
 
 
 @router.post("/{task_id}/complete-export")
-def complete_task_export(task_id: int, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+def complete_task_export(task_id: int, db: Session = Depends(get_db)):
     """完成任务导出（当所有问卷填写完成后，手动触发导出）"""
     task = db.query(Task).filter(Task.id == task_id).first()
     if not task:
@@ -194,137 +207,169 @@ def complete_task_export(task_id: int, background_tasks: BackgroundTasks, db: Se
     if task.status != "pending":
         raise HTTPException(status_code=400, detail="任务状态不正确，只有pending状态的任务才能完成导出")
     
+    try:
+        ensure_queue_capacity(db)
+    except ExportBusy as e:
+        raise _too_busy(e)
+    
     # 检查是否所有教师都已填写问卷
-    from app.models import Questionnaire, QuestionnaireResponse
-    questionnaire = None
-    if task.teacher_ids:
-        task_teacher_ids = [int(tid) for tid in task.teacher_ids if tid is not None]
-        questionnaires = db.query(Questionnaire).all()
-        for q in questionnaires:
-            if q.teacher_ids:
-                q_teacher_ids = [int(tid) for tid in q.teacher_ids if tid is not None]
-                if set(q_teacher_ids) & set(task_teacher_ids):
-                    questionnaire = q
-                    break
+    questionnaire = task_questionnaire(db, task.id)
     
     # 检查哪些教师已填写或确认（不再强制要求所有教师都填写）
     submitted_teacher_ids = []
-    missing_teachers = set()
     
     if questionnaire:
-        responses = db.query(QuestionnaireResponse).filter(
-            QuestionnaireResponse.questionnaire_id == questionnaire.id
-        ).all()
-        
-        # 已提交或已确认的教师ID
-        response_teacher_ids = set([
-            r.teacher_id for r in responses 
-            if r.submitted_at or r.confirmed_status == 'confirmed'
-        ])
-        task_teacher_ids_set = set([int(tid) for tid in task.teacher_ids if tid is not None])
-        
         # 只导出已填写或已确认教师的文件（如果没有，则导出空文件）
-        submitted_teacher_ids = list(response_teacher_ids & task_teacher_ids_set)
-        missing_teachers = task_teacher_ids_set - response_teacher_ids
+        submitted_teacher_ids = completed_task_teacher_ids(db, questionnaire.id, task.id)
+        missing_count = db.query(TaskTeacher).filter(TaskTeacher.task_id == task.id).count() - len(submitted_teacher_ids)
         
         if len(submitted_teacher_ids) == 0:
-            print(f"[导出任务] 警告：没有教师完成填写或确认，将导出空的ZIP文件")
-            submitted_teacher_ids = []  # 空列表，导出时将生成空的ZIP文件
+            logger.warning("任务 %d 没有教师完成填写或确认，将导出空的ZIP文件", task.id)
         
-        if missing_teachers and len(submitted_teacher_ids) > 0:
-            print(f"[导出任务] 警告：有 {len(missing_teachers)} 位教师未完成填写或确认，将只导出已填写教师的文件")
+        if missing_count and len(submitted_teacher_ids) > 0:
+            logger.warning("任务 %d 有 %d 位教师未完成填写或确认，将只导出已填写教师的文件", task.id, missing_count)
     else:
         # 如果没有问卷，直接导出空文件
-        print(f"[导出任务] 警告：未找到关联的问卷，将导出空的ZIP文件")
+        logger.warning("任务 %d 未找到关联的问卷，将导出空的ZIP文件", task.id)
         submitted_teacher_ids = []
     
-    # 更新任务状态为processing，开始导出
-    task.status = "processing"
+    # 更新任务状态为processing，并加入导出作业队列（只导出已填写教师的文件，没有时导出空的ZIP文件）
+    # 状态和作业在同一个事务中提交，入队失败时任务仍为pending
+    try:
+        dedup_key = export_dedup_key(task.template_id, submitted_teacher_ids, db, task.output_format or "zip")
+        task.status = "processing"
+        task.cancel_requested = False
+        enqueue_export(db, task.id, submitted_teacher_ids, dedup_key=dedup_key)
+        db.commit()
+    except ExportBusy as e:
+        db.rollback()
+        raise _too_busy(e)
+    except Exception:
+        db.rollback()
+        raise
+    
+    return {"message": "导出任务已启动，正在后台处理中"}
+
+
+@router.get("/{task_id}/progress")
+def get_task_progress(task_id: int, db: Session = Depends(get_db)):
+    """获取导出进度：已处理/失败数量、吞吐量（教师/秒）和预计剩余时间（秒）"""
+    task = db.query(Task).filter(Task.id == task_id).first()
+    if not task:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return progress_snapshot(task)
+
+
+@router.post("/{task_id}/cancel")
+def cancel_task_export(task_id: int, db: Session = Depends(get_db)):
+    """
+    取消导出
+    正在导出的任务在处理完当前教师后停止，并删除已生成的部分文件
+    """
+    task = db.query(Task).filter(Task.id == task_id).first()
+    if not task:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    
+    if task.status != "processing":
+        raise HTTPException(status_code=400, detail="只有正在导出的任务才能取消")
+    
+    # 作业还在排队时直接取消
+    if cancel_queued_job(db, task.id):
+        task.status = "cancelled"
+        db.commit()
+        return {"message": "导出已取消"}
+    
+    task.cancel_requested = True
     db.commit()
+    return {"message": "已请求取消，当前教师处理完成后停止导出"}
+
+
+@router.post("/{task_id}/retry-failed")
+def retry_failed_export(task_id: int, db: Session = Depends(get_db)):
+    """只重新导出失败的教师，生成的文件追加到已有的导出ZIP中（加入导出作业队列，由导出工作进程执行）"""
+    task = db.query(Task).filter(Task.id == task_id).first()
+    if not task:
+        raise HTTPException(status_code=404, detail="任务不存在")
     
-    # 后台执行导出任务
-    def export_task():
-        from app.database import SessionLocal
-        import traceback
-        db_session = SessionLocal()
-        try:
-            print(f"[导出任务] 开始导出任务 {task.id}: {task.name}")
-            if len(submitted_teacher_ids) == 0:
-                print(f"[导出任务] 没有教师完成填写，将创建空的ZIP文件")
-                # 创建空的ZIP文件
-                from datetime import datetime
-                import zipfile
-                from pathlib import Path
-                import config
-                
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                task_name_clean = task.name.replace(" ", "_") if task.name else "export"
-                zip_filename = f"{task_name_clean}_{timestamp}.zip"
-                zip_path = config.EXPORT_DIR / zip_filename
-                
-                # 创建空的ZIP文件
-                with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                    # 添加一个说明文件
-                    zipf.writestr("README.txt", f"此任务没有教师完成填写。\n任务名称: {task.name}\n导出时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-                
-                export_path = str(zip_path)
-            else:
-                print(f"[导出任务] 将导出 {len(submitted_teacher_ids)} 位已填写教师的文件")
-                # 使用已填写教师的ID列表，而不是所有教师
-                export_path = batch_export(
-                    template_id=task.template_id,
-                    teacher_ids=submitted_teacher_ids,  # 只导出已填写教师的文件
-                    db=db_session,
-                    task_name=task.name
-                )
-            print(f"[导出任务] 导出完成，文件路径: {export_path}")
-            print(f"[导出任务] 完成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-            
-            # 更新任务状态
-            print(f"[导出任务] 准备更新任务状态...")
-            task_record = db_session.query(Task).filter(Task.id == task.id).first()
-            if task_record:
-                task_record.export_path = export_path
-                task_record.status = "completed"
-                task_record.completed_at = datetime.now()
-                db_session.commit()
-                print(f"[导出任务] ✓ 任务状态已更新为completed")
-                print(f"[导出任务] 导出文件路径: {export_path}")
-            else:
-                print(f"[导出任务] ⚠ 警告：找不到任务记录 {task.id}")
-        except Exception as e:
-            error_trace = traceback.format_exc()
-            print(f"[导出任务] 导出任务失败: {e}\n{error_trace}")
-            
-            task_record = db_session.query(Task).filter(Task.id == task.id).first()
-            if task_record:
-                task_record.status = "failed"
-                db_session.commit()
-                print(f"[导出任务] 任务状态已更新为failed，错误信息: {str(e)}")
-                print(f"[导出任务] 错误堆栈: {error_trace}")
-        finally:
-            db_session.close()
-    
-    background_tasks.add_task(export_task)
+    if task.status != "completed" or not task.export_path or not Path(task.export_path).exists():
+        raise HTTPException(status_code=400, detail="任务尚未完成或导出文件不存在")
     
-    return {"message": "导出任务已启动，正在后台处理中"}
+    if task.output_format == "pdf":
+        raise HTTPException(status_code=400, detail="合并PDF不支持只重试失败的教师，请重新创建导出任务")
+    
+    failed_ids = [int(teacher_id) for teacher_id, item in (task.export_manifest or {}).items() if item.get("status") != "ok"]
+    if not failed_ids:
+        return {"message": "没有失败的教师", "job_id": None, "retried": 0}
+    
+    try:
+        job = enqueue_retry(db, task.id, failed_ids)
+    except ExportBusy as e:
+        raise _too_busy(e)
+    
+    return {
+        "message": f"已加入导出队列，将重新导出 {len(failed_ids)} 位失败的教师",
+        "job_id": job.id,
+        "retried": len(failed_ids)
+    }
 
 
 @router.get("/{task_id}/download")
-def download_task_export(task_id: int, db: Session = Depends(get_db)):
-    """下载任务导出文件"""
+def download_task_export(task_id: int, stream: bool = False, db: Session = Depends(get_db)):
+    """
+    下载任务导出文件
+    任务已完成时返回导出的ZIP（或合并PDF）；stream=true 或任务较小且尚未完成时，边渲染边返回，无需等待后台导出
+    """
     task = db.query(Task).filter(Task.id == task_id).first()
     if not task:
         raise HTTPException(status_code=404, detail="任务不存在")
     
-    if not task.export_path or task.status != "completed":
+    if task.export_path and task.status == "completed" and Path(task.export_path).exists():
+        from fastapi.responses import FileResponse
+        return FileResponse(
+            task.export_path,
+            filename=Path(task.export_path).name,
+            media_type="application/pdf" if Path(task.export_path).suffix == '.pdf' else "application/zip"
+        )
+    
+    # 与后台导出相同的教师（完成问卷后导出的任务只包含已填写或确认的教师）
+    teacher_ids = export_teacher_ids(db, task.id)
+    if teacher_ids is None:
+        teacher_ids = [int(tid) for tid in task.teacher_ids if tid is not None] if task.teacher_ids else []
+    small_task = len(teacher_ids) <= config.STREAM_DOWNLOAD_MAX_TEACHERS
+    # 等待问卷的任务只能在完成导出后下载
+    if task.status == "pending" or not teacher_ids or not (stream or small_task):
         raise HTTPException(status_code=400, detail="任务尚未完成或导出文件不存在")
     
-    from fastapi.responses import FileResponse
-    return FileResponse(
-        task.export_path,
-        filename=Path(task.export_path).name,
-        media_type="application/zip"
+    try:
+        jobs = prepare_export_jobs(task.template_id, teacher_ids, db)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    
+    # 流式下载在Web进程内渲染，与其他导出共用调度名额；没有空闲名额时返回429
+    priority = job_priority(len(jobs))
+    try:
+        export_scheduler.ensure_available(priority)
+    except ExportBusy as e:
+        raise _too_busy(e)
+    
+    merged = task.output_format == "pdf"
+    
+    def scheduled_stream():
+        with export_scheduler.slot(priority):
+            if merged:
+                yield from stream_merged_pdf(jobs, teacher_ids)
+            else:
+                yield from stream_export_zip(jobs)
+    
+    from fastapi.responses import StreamingResponse
+    from urllib.parse import quote
+    task_name_clean = task.name.replace(" ", "_") if task.name else "export"
+    ext = ".pdf" if merged else ".zip"
+    download_filename = f"{task_name_clean}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{ext}"
+    return StreamingResponse(
+        scheduled_stream(),
+        media_type="application/pdf" if merged else "application/zip",
+        headers={"Content-Disposition": f"attachment; filename*=utf-8''{quote(download_filename)}"}
     )
 
 
@@ -338,8 +383,12 @@ def delete_task(task_id: int, db: Session = Depends(get_db)):
         if not task:
             raise HTTPException(status_code=404, detail="任务不存在")
         
-        # 删除导出文件（如果存在）
-        if task.export_path:
+        # 删除导出文件（如果存在，且没有其他任务共用同一个导出文件）
+        shared = task.export_path and db.query(Task).filter(
+            Task.id != task.id,
+            Task.export_path == task.export_path
+        ).first() is not None
+        if task.export_path and not shared:
             export_path = Path(task.export_path)
             if export_path.exists():
                 try:
@@ -348,6 +397,8 @@ def delete_task(task_id: int, db: Session = Depends(get_db)):
                     # 记录错误但不阻止删除任务记录
                     print(f"删除导出文件失败: {e}")
         
+        # 删除任务的导出作业（否则排队中的作业仍会被领取执行）
+        delete_task_jobs(db, task.id)
         db.delete(task)
         db.commit()
         return {"message": "删除成功"}
@@ -377,17 +428,8 @@ def query_teacher_tasks(query: TeacherQuery, db: Session = Depends(get_db)):
     if not teacher:
         return {"teacher_id": None, "tasks": []}
     
-    # 查找包含该教师的任务
-    # 注意：teacher_ids是JSON字段，需要特殊处理
-    # 由于SQLAlchemy的JSON字段contains方法可能不准确，我们查询所有任务然后过滤
-    all_tasks = db.query(Task).order_by(Task.created_at.desc()).all()
-    tasks = []
-    for task in all_tasks:
-        if task.teacher_ids:
-            # 确保teacher_ids是整数列表
-            task_teacher_ids = [int(tid) for tid in task.teacher_ids if tid is not None]
-            if teacher.id in task_teacher_ids:
-                tasks.append(task)
+    # 查找包含该教师的任务（通过task_teachers关联表索引查询）
+    tasks = teacher_tasks_query(db, teacher.id).all()
     
     return {
         "teacher_id": teacher.id,
@@ -425,13 +467,7 @@ def get_my_tasks(
         raise HTTPException(status_code=404, detail="教师不存在")
     
     # 查找包含该教师的任务
-    all_tasks = db.query(Task).order_by(Task.created_at.desc()).all()
-    tasks = []
-    for task in all_tasks:
-        if task.teacher_ids:
-            task_teacher_ids = [int(tid) for tid in task.teacher_ids if tid is not None]
-            if teacher_id in task_teacher_ids:
-                tasks.append(task)
+    tasks = teacher_tasks_query(db, teacher_id).all()
     
     return {
         "teacher_id": teacher_id,
@@ -461,8 +497,10 @@ def download_teacher_file(
     from fastapi.responses import FileResponse
     from app.models import Teacher, Template
     from app.services.template_processor import process_template
+    from app.services.render_fingerprint import render_fingerprint
+    from app.services.artifact_store import artifact_store
     from app.main import verify_teacher_session
-    import tempfile
+    from io import BytesIO
     
     # 如果提供了token，验证token并确保teacher_id匹配
     token = request.headers.get("X-Teacher-Token") or request.cookies.get("teacher_token")
@@ -479,9 +517,7 @@ def download_teacher_file(
         raise HTTPException(status_code=404, detail="任务不存在")
     
     # 检查教师是否在任务中
-    # 确保teacher_ids是整数列表进行比较
-    task_teacher_ids = [int(tid) for tid in task.teacher_ids if tid is not None] if task.teacher_ids else []
-    if teacher_id not in task_teacher_ids:
+    if not is_task_teacher(db, task.id, teacher_id):
         raise HTTPException(status_code=403, detail="您无权访问此文件")
     
     # 获取教师信息
@@ -495,50 +531,53 @@ def download_teacher_file(
         raise HTTPException(status_code=404, detail="模板不存在")
     
     # 准备数据
-    # 修复手机号格式（如果是浮点数，转换为整数字符串）
-    phone = teacher.phone
-    if phone and '.' in str(phone):
-        try:
-            phone = str(int(float(phone)))
-        except (ValueError, TypeError):
-            pass
-    
-    teacher_data = {
-        'name': teacher.name,
-        'sex': teacher.sex,
-        'id_number': teacher.id_number,
-        'phone': phone,
-        'email': teacher.email,
-        'department': teacher.department,
-        'position': teacher.position,
-        'title': teacher.title,
-        'extra_data': teacher.extra_data or {}
-    }
+    teacher_data = build_teacher_data(teacher)
     
-    # 生成临时文件
-    temp_dir = Path(tempfile.gettempdir())
     ext = Path(template.file_path).suffix
     output_filename = f"{teacher.name}_{teacher.id}{ext}"
-    output_path = temp_dir / output_filename
+    placeholder_positions = None
+    if template.file_type == '.pdf':
+        placeholder_positions = template.placeholder_positions or []
+    
+    media_type = "application/pdf" if ext == '.pdf' else "application/octet-stream"
+    
+    # 相同的模板和字段值已经渲染过时直接返回存储中的文件
+    use_store = config.ARTIFACT_STORE_ENABLED
+    fingerprint = render_fingerprint(template.file_path, placeholder_positions, teacher_data) if use_store else None
+    output_path = artifact_store.get(fingerprint, ext) if use_store else None
+    if output_path is not None:
+        return FileResponse(output_path, filename=output_filename, media_type=media_type)
     
-    # 填充模板
+    # 填充模板（交互式请求，优先于批量导出获得渲染名额）
     try:
-        placeholder_positions = None
-        if template.file_type == '.pdf':
-            placeholder_positions = template.placeholder_positions or []
-        
-        process_template(
-            template.file_path,
-            teacher_data,
-            str(output_path),
-            placeholder_positions=placeholder_positions
-        )
+        with export_scheduler.slot(PRIORITY_INTERACTIVE, timeout=config.EXPORT_INTERACTIVE_WAIT_SECONDS):
+            buffer = BytesIO()
+            process_template(
+                template.file_path,
+                teacher_data,
+                buffer,
+                placeholder_positions=placeholder_positions,
+                template_id=template.id
+            )
+    except ExportBusy as e:
+        raise _too_busy(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"生成文件失败: {str(e)}")
+    content = buffer.getvalue()
     
-    # 返回文件
-    return FileResponse(
-        output_path,
-        filename=output_filename,
-        media_type="application/pdf" if ext == '.pdf' else "application/octet-stream"
+    if use_store:
+        # 与批量导出相同：保存到渲染结果存储，超出容量上限时淘汰最久未使用的文件
+        try:
+            artifact_store.put(fingerprint, ext, content)
+            artifact_store.evict()
+        except Exception as e:
+            logger.warning("保存渲染结果失败: %s", e, exc_info=True)
+    
+    # 直接返回内存中的文件（不依赖存储中的文件是否被淘汰）
+    from fastapi.responses import Response
+    from urllib.parse import quote
+    return Response(
+        content,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename*=utf-8''{quote(output_filename)}"}
     )
\ No newline at end of file
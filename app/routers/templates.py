@@ -1,7 +1,7 @@
 """
 模板管理API
 """
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Request
 from sqlalchemy.orm import Session
 from typing import List, Optional, Dict, Any
 from pydantic import BaseModel
@@ -12,6 +12,7 @@ import shutil
 from app.database import get_db
 from app.models import Template
 from app.services.file_handler import extract_placeholders
+from app.services.template_cache import invalidate_template
 import sys
 from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
@@ -362,6 +363,8 @@ def update_template_content(
         placeholders = extract_placeholders(str(file_path))
         template.placeholders = placeholders
         db.commit()
+        # 模板文件已修改，清除缓存
+        invalidate_template(template_id, str(file_path))
         
         return {"message": "保存成功", "placeholders": placeholders}
     
@@ -394,7 +397,7 @@ def get_pdf_file(template_id: int, db: Session = Depends(get_db)):
 
 
 @router.get("/{template_id}/pdf-preview/{page}")
-def get_pdf_preview(template_id: int, page: int, db: Session = Depends(get_db)):
+def get_pdf_preview(template_id: int, page: int, request: Request, dpi: Optional[int] = None, db: Session = Depends(get_db)):
     """获取PDF页面的预览图片（备用方案，如果PDF.js不可用）"""
     template = db.query(Template).filter(Template.id == template_id).first()
     if not template:
@@ -407,10 +410,25 @@ def get_pdf_preview(template_id: int, page: int, db: Session = Depends(get_db)):
     if template.file_type != '.pdf':
         raise HTTPException(status_code=400, detail="此模板不是PDF文件")
     
+    dpi = min(max(dpi or config.PREVIEW_DPI, 36), 300)
+    
+    # 预览图片按模板内容哈希缓存，内容未变时浏览器可直接使用本地缓存
+    from app.services.preview_cache import preview_cache
+    etag = f'"{preview_cache.make_key(str(file_path), page, dpi)}"'
+    cache_headers = {
+        "ETag": etag,
+        "Cache-Control": f"private, max-age={config.PREVIEW_HTTP_MAX_AGE}, must-revalidate"
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=cache_headers)
+    
     try:
+        preview_image, _ = preview_cache.get_or_create(str(file_path), page, dpi)
+        return Response(content=preview_image, media_type="image/png", headers=cache_headers)
+    except ImportError:
+        # 没有安装pdf2image时返回提示图片（不缓存）
         from app.services.pdf_handler import get_pdf_preview
-        preview_image = get_pdf_preview(str(file_path), page)
-        return Response(content=preview_image, media_type="image/png")
+        return Response(content=get_pdf_preview(str(file_path), page, dpi), media_type="image/png")
     except Exception as e:
         # 即使预览失败，也返回一个占位图片，避免前端报错
         from io import BytesIO
@@ -465,6 +483,9 @@ def update_placeholder_positions(
     db.commit()
     db.refresh(template)
     
+    # 占位符位置已修改，清除模板缓存
+    invalidate_template(template_id, template.file_path)
+    
     return {"message": "保存成功", "placeholders": placeholders}
 
 
@@ -499,6 +520,7 @@ def delete_template(template_id: int, db: Session = Depends(get_db)):
     """删除模板，同时删除关联的任务"""
     import os
     from app.models import Task
+    from app.services.job_queue import delete_task_jobs
     
     template = db.query(Template).filter(Template.id == template_id).first()
     if not template:
@@ -520,6 +542,7 @@ def delete_template(template_id: int, db: Session = Depends(get_db)):
                     print(f"删除任务导出文件失败: {e}")
         
         deleted_tasks.append(task.name)
+        delete_task_jobs(db, task.id)
         db.delete(task)
     
     # 删除模板文件
@@ -532,6 +555,7 @@ def delete_template(template_id: int, db: Session = Depends(get_db)):
     # 删除模板记录
     db.delete(template)
     db.commit()
+    invalidate_template(template_id, template.file_path)
     
     message = "删除成功"
     if deleted_tasks:
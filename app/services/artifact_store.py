@@ -0,0 +1,87 @@
+"""
+渲染结果存储（按内容寻址）
+每位教师渲染出的文件按渲染指纹（模板版本 + 实际填入的字段值）保存一份，
+不同任务、单个下载都先查这里，相同的输出只渲染、只保存一次
+"""
+import os
+import threading
+from typing import Optional
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+import config
+
+
+class ArtifactStore:
+    """按键保存文件的目录：<root>/<键前两位>/<键><扩展名>"""
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    def path_for(self, key: str, ext: str) -> Path:
+        return self.root / key[:2] / f"{key}{ext}"
+
+    def get(self, key: str, ext: str) -> Optional[Path]:
+        """返回已保存文件的路径，不存在时返回None"""
+        path = self.path_for(key, ext)
+        if not path.exists():
+            return None
+        # 更新修改时间，作为淘汰依据
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return path
+
+    def read(self, key: str, ext: str) -> Optional[bytes]:
+        path = self.get(key, ext)
+        if path is None:
+            return None
+        try:
+            return path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, ext: str, content: bytes) -> Path:
+        """保存文件（已存在时不重复写入）"""
+        path = self.path_for(key, ext)
+        if path.exists():
+            return path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 先写临时文件再改名，其他进程不会读到写了一半的文件
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(content)
+        os.replace(tmp_path, path)
+        return path
+
+    def evict(self):
+        """总大小超过上限时，删除最久未使用的文件"""
+        if self.max_bytes <= 0:
+            return
+        entries = []
+        total = 0
+        for path in self.root.glob("*/*"):
+            if path.suffix == ".tmp":
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+                total -= size
+            except FileNotFoundError:
+                pass
+
+
+artifact_store = ArtifactStore(config.ARTIFACT_DIR, config.ARTIFACT_STORE_MAX_BYTES)
@@ -0,0 +1,159 @@
+"""
+纯文本占位符的快速绘制
+页面上的占位符都是文本时，不再经过reportlab canvas、序列化、PdfReader重新解析和合并，
+直接生成文本绘制指令（BT ... Tj ET），作为追加的内容流写入模板页面（增量更新输出时使用）。
+只支持不嵌入字形的字体（reportlab内置的CID中文字体和标准Type1字体）；
+TrueType字体需要按用到的字形生成子集，图片/签名字段需要canvas绘制，这些页面仍走canvas
+"""
+import re
+import logging
+import threading
+from io import BytesIO
+from typing import Dict, Any, Optional, Tuple, NamedTuple
+
+try:
+    from reportlab.pdfgen import canvas
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.cidfonts import CIDFont
+    from PyPDF2 import PdfReader
+    from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, StreamObject
+    PDF_LIBRARIES_AVAILABLE = True
+except ImportError:
+    PDF_LIBRARIES_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+class TextRun(NamedTuple):
+    """一段已编码的文本"""
+    font_name: str
+    font_size: float
+    x: float
+    y: float
+    # PDF字符串的编码结果（十六进制字符串中的字节）
+    encoded: bytes
+
+
+class DirectText(NamedTuple):
+    """一页要直接写入内容流的文本"""
+    runs: Tuple[TextRun, ...]
+
+
+class _DirectFont(NamedTuple):
+    """可直接引用的字体：字体字典（全部为直接对象）和文本编码方式"""
+    font_dict: "DictionaryObject"
+    codec: str
+
+
+_lock = threading.Lock()
+# 字体名 -> _DirectFont，不支持直接绘制的字体为None
+_fonts: Dict[str, Optional[_DirectFont]] = {}
+
+
+def _to_direct(obj):
+    """把对象及其引用的对象复制为直接对象；遇到流对象（嵌入字形）时返回None"""
+    if isinstance(obj, IndirectObject):
+        return _to_direct(obj.get_object())
+    if isinstance(obj, StreamObject):
+        return None
+    if isinstance(obj, DictionaryObject):
+        copy = DictionaryObject()
+        for key, value in obj.items():
+            value = _to_direct(value)
+            if value is None:
+                return None
+            copy[NameObject(key)] = value
+        return copy
+    if isinstance(obj, ArrayObject):
+        items = [_to_direct(value) for value in obj]
+        if any(value is None for value in items):
+            return None
+        return ArrayObject(items)
+    return obj
+
+
+def _build_direct_font(font_name: str) -> Optional[_DirectFont]:
+    """用reportlab生成一次字体字典，之后直接引用"""
+    font = pdfmetrics.getFont(font_name)
+    if isinstance(font, CIDFont):
+        encoding_name = getattr(font, "encodingName", "")
+        if not encoding_name.endswith("UCS2-H"):
+            return None
+        codec = "utf-16-be"
+    elif getattr(font.face, "builtIn", False) and font.encoding.name == "WinAnsiEncoding":
+        codec = "cp1252"
+    else:
+        return None
+
+    packet = BytesIO()
+    can = canvas.Canvas(packet)
+    can.setFont(font_name, 12)
+    can.drawString(0, 0, "A")
+    can.save()
+    page = PdfReader(BytesIO(packet.getvalue())).pages[0]
+    # reportlab先设置默认字体，最后一个 Tf 才是这里使用的字体
+    used = re.findall(rb"/(\S+) [\d.]+ Tf", page.get_contents().get_data())
+    if not used:
+        return None
+    font_dict = _to_direct(page["/Resources"]["/Font"].raw_get("/" + used[-1].decode()))
+    if font_dict is None:
+        return None
+    # /Name 为reportlab的资源名，写入其他页面时不需要
+    font_dict.pop("/Name", None)
+    return _DirectFont(font_dict, codec)
+
+
+def get_direct_font(font_name: str) -> Optional[_DirectFont]:
+    """获取可直接绘制的字体，字体不支持时返回None"""
+    if font_name not in _fonts:
+        with _lock:
+            if font_name not in _fonts:
+                try:
+                    _fonts[font_name] = _build_direct_font(font_name)
+                except Exception as e:
+                    logger.warning("字体 %s 不能直接绘制文本，使用canvas: %s", font_name, e)
+                    _fonts[font_name] = None
+    return _fonts[font_name]
+
+
+def build_direct_text(ops, data: Dict[str, Any]) -> Optional[DirectText]:
+    """
+    生成一页的直接绘制文本；页面中有图片字段、字体不支持或文字无法编码时返回None（改用canvas）
+    取值和空值处理与canvas绘制一致
+    """
+    runs = []
+    for op in ops:
+        value = op.get_value(data)
+        if value is None:
+            value = ""
+        if isinstance(value, str) and value.startswith("data:image"):
+            return None
+        value = str(value)
+        if not value:
+            continue
+        font = get_direct_font(op.font_name)
+        if font is None:
+            return None
+        try:
+            encoded = value.encode(font.codec)
+        except UnicodeEncodeError:
+            return None
+        runs.append(TextRun(op.font_name, op.font_size, op.x, op.y, encoded))
+    return DirectText(tuple(runs))
+
+
+def _number(value: float) -> str:
+    """PDF数字（去掉多余的小数位）"""
+    text = f"{float(value):.4f}".rstrip("0").rstrip(".")
+    return text if text not in ("", "-0") else "0"
+
+
+def text_operators(direct_text: DirectText, resource_names: Dict[str, str]) -> bytes:
+    """生成文本绘制指令，resource_names 为 {字体名: 页面资源中的字体名}"""
+    lines = []
+    for run in direct_text.runs:
+        lines.append(
+            f"BT {resource_names[run.font_name]} {_number(run.font_size)} Tf "
+            f"1 0 0 1 {_number(run.x)} {_number(run.y)} Tm <{run.encoded.hex()}> Tj ET"
+        )
+    return ("\n".join(lines) + "\n").encode("ascii")
@@ -0,0 +1,299 @@
+"""
+PDF绘制计划
+把模板的占位符位置编译成不可变的绘制计划：按页分组、字体已解析、字段取值函数已生成；
+常量字段预先绘制并合并到模板页面上，渲染每位教师时只绘制随教师变化的字段。
+绘制计划随模板缓存保存，占位符位置变化时（模板缓存重建）重新编译
+"""
+import base64
+import logging
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Dict, Any, List, Set, Tuple, Callable, Optional
+
+try:
+    from reportlab.pdfgen import canvas
+    from reportlab.pdfbase import pdfmetrics
+    from PyPDF2 import PdfReader, PageObject
+    PDF_LIBRARIES_AVAILABLE = True
+except ImportError:
+    PDF_LIBRARIES_AVAILABLE = False
+
+try:
+    from PIL import Image as PILImage
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+FALLBACK_FONT_NAME = "Helvetica"
+
+
+def field_accessor(field_name: str) -> Callable[[Dict[str, Any]], Any]:
+    """
+    生成字段取值函数：先取主字段，为空时再取 extra_data 中的同名字段
+    （与原先逐个占位符判断的取值规则一致）
+    """
+    def get_value(data: Dict[str, Any]) -> Any:
+        value = data.get(field_name, "")
+        if not value:
+            extra_data = data.get("extra_data")
+            if isinstance(extra_data, dict):
+                value = extra_data.get(field_name, "")
+        return value
+    return get_value
+
+
+def constant_accessor(value: Any) -> Callable[[Dict[str, Any]], Any]:
+    """常量字段的取值函数"""
+    return lambda data: value
+
+
+@dataclass(frozen=True)
+class DrawOp:
+    """一个占位符的绘制操作"""
+    field_name: str
+    x: float
+    y: float
+    font_name: str
+    font_size: float
+    get_value: Callable[[Dict[str, Any]], Any]
+
+
+@dataclass(frozen=True)
+class PagePlan:
+    """一页的绘制计划"""
+    page_num: int
+    width: float
+    height: float
+    # 需要为每位教师绘制的字段（常量已合并到 base_page 中时只有随教师变化的字段）
+    ops: Tuple[DrawOp, ...]
+    # 合并了常量字段的模板页面；没有常量字段时为None，直接使用模板页面
+    base_page: Optional["PageObject"]
+
+
+@dataclass(frozen=True)
+class DrawPlan:
+    """整个模板的绘制计划"""
+    pages: Tuple[PagePlan, ...]
+    font_name: str
+
+    @property
+    def num_pages(self) -> int:
+        return len(self.pages)
+
+
+def _resolve_font(font_name: str) -> str:
+    """字体在reportlab中不可用时使用Helvetica（与绘制时setFont失败的处理一致）"""
+    try:
+        pdfmetrics.getFont(font_name)
+        return font_name
+    except Exception:
+        logger.warning("字体不可用，使用 %s 代替: %s", FALLBACK_FONT_NAME, font_name)
+        return FALLBACK_FONT_NAME
+
+
+def _compile_op(pos: Dict[str, Any], default_font_name: str, resolved_fonts: Dict[str, str]) -> Tuple[DrawOp, bool]:
+    """编译一个占位符，返回 (绘制操作, 是否为常量)"""
+    field_name = pos.get("field_name", "")
+    font_name = pos.get("font_name", default_font_name)
+    if font_name not in resolved_fonts:
+        resolved_fonts[font_name] = _resolve_font(font_name)
+
+    constant_value = pos.get("constant_value") if pos.get("is_constant") else None
+    is_constant = bool(constant_value)
+    op = DrawOp(
+        field_name=field_name,
+        x=pos.get("x", 0),
+        y=pos.get("y", 0),
+        font_name=resolved_fonts[font_name],
+        font_size=pos.get("font_size", 12),
+        get_value=constant_accessor(constant_value) if is_constant else field_accessor(field_name),
+    )
+    return op, is_constant
+
+
+def compile_draw_plan(cached_template, text_positions: List[Dict[str, Any]], default_font_name: str,
+                      merge_constants: bool = True) -> DrawPlan:
+    """
+    编译绘制计划（需在持有 cached_template.lock 时调用，会读取模板页面）
+    merge_constants 为False时常量字段和其他字段一起绘制到每位教师的覆盖层中（增量更新输出不改动模板页面）
+    超出模板页数的占位符被忽略
+    """
+    ops_by_page: Dict[int, List[DrawOp]] = {}
+    constants_by_page: Dict[int, List[DrawOp]] = {}
+    resolved_fonts: Dict[str, str] = {}
+    for pos in text_positions:
+        page_num = pos.get("page", 0)
+        op, is_constant = _compile_op(pos, default_font_name, resolved_fonts)
+        target = constants_by_page if is_constant and merge_constants else ops_by_page
+        target.setdefault(page_num, []).append(op)
+
+    pages = []
+    for page_num in range(cached_template.num_pages):
+        width, height = cached_template.page_sizes[page_num]
+        base_page = None
+        if page_num in constants_by_page:
+            # 常量字段只绘制一次，合并到模板页面的副本上
+            base_page = cached_template.copy_page(page_num)
+            base_page.merge_page(render_overlay(constants_by_page[page_num], {}, width, height))
+        pages.append(PagePlan(
+            page_num=page_num,
+            width=width,
+            height=height,
+            ops=tuple(ops_by_page.get(page_num, ())),
+            base_page=base_page,
+        ))
+    return DrawPlan(pages=tuple(pages), font_name=default_font_name)
+
+
+def _draw_image(can, op: DrawOp, image_data: bytes):
+    """绘制签名等图片，图片大小按字体大小缩放"""
+    try:
+        img = PILImage.open(BytesIO(image_data))
+
+        # 根据字体大小计算合适的图片尺寸
+        # 中文字符宽度大约是字体大小的1倍（等宽字体）
+        # 假设签名区域应该和2-3个中文字符的宽度差不多
+        # 使用字体大小的2.5倍作为目标宽度，高度按比例缩放
+        target_width = op.font_size * 2.5  # 约2-3个字的宽度
+        target_height = op.font_size * 1.0  # 高度约为字体大小，保持签名的手写感
+
+        img_width, img_height = img.size
+
+        # 计算缩放比例，保持宽高比，以宽度为主
+        width_ratio = target_width / img_width
+        height_ratio = target_height / img_height
+        # 使用较小的比例，确保图片不会超出目标区域
+        ratio = min(width_ratio, height_ratio)
+
+        # 如果图片比目标尺寸小，不放大（保持原始清晰度）
+        if ratio > 1.0:
+            ratio = 1.0
+
+        img_width = int(img_width * ratio)
+        img_height = int(img_height * ratio)
+
+        # 确保不超过目标尺寸
+        if img_width > target_width:
+            img_width = int(target_width)
+        if img_height > target_height:
+            img_height = int(target_height)
+
+        if ratio < 1.0:
+            img = img.resize((img_width, img_height), PILImage.Resampling.LANCZOS)
+
+        # 将PIL图片转换为reportlab可用的格式
+        img_buffer = BytesIO()
+        # 优化：如果图片已经是PNG格式且尺寸合适，直接使用
+        if img.format == 'PNG' and img_width <= target_width and img_height <= target_height:
+            # 直接保存，不重新编码
+            img.save(img_buffer, format='PNG', optimize=True)
+        else:
+            # 转换为PNG并优化
+            img.save(img_buffer, format='PNG', optimize=True, compress_level=6)
+        img_buffer.seek(0)
+
+        # 使用reportlab添加图片
+        # 注意：保存的坐标y已经是PDF坐标系（左下角为原点，Y向上）
+        # reportlab的Canvas也是左下角为原点，所以直接使用y
+        from reportlab.lib.utils import ImageReader
+        can.drawImage(ImageReader(img_buffer), op.x, op.y - img_height,
+                      width=img_width, height=img_height)
+        logger.debug("图片添加成功 (字段: %s), 尺寸: %d x %d", op.field_name, img_width, img_height)
+
+        # 清理内存
+        img.close()
+        img_buffer.close()
+    except Exception as e:
+        logger.warning("添加图片失败 (字段: %s): %s", op.field_name, e, exc_info=True)
+        # 如果图片处理失败，跳过这个字段，继续处理其他字段
+
+
+def draw_ops(can, ops: Tuple[DrawOp, ...], data: Dict[str, Any]):
+    """在canvas的当前页上绘制一组占位符"""
+    for op in ops:
+        value = op.get_value(data)
+        if value is None:
+            value = ""
+
+        # 检查是否是图片数据（base64格式）
+        image_data = None
+        if isinstance(value, str) and value.startswith("data:image"):
+            try:
+                # 格式: data:image/png;base64,xxxxx
+                header, encoded = value.split(',', 1)
+                image_data = base64.b64decode(encoded)
+            except Exception as e:
+                logger.warning("解析base64图片失败 (字段: %s): %s", op.field_name, e)
+
+        if image_data and PIL_AVAILABLE:
+            _draw_image(can, op, image_data)
+            continue
+
+        # 添加文本（使用UTF-8编码确保中文正确显示）
+        value = str(value)
+        try:
+            can.setFont(op.font_name, op.font_size)
+            # 注意：保存的坐标y已经是PDF坐标系（左下角为原点，Y向上）
+            # reportlab的Canvas也是左下角为原点，所以直接使用y
+            can.drawString(op.x, op.y, value)
+        except Exception as e:
+            logger.warning("添加文本失败 (字段: %s, 值: %s): %s", op.field_name, value[:20], e)
+            # 如果字体不支持，尝试使用默认字体
+            try:
+                can.setFont(FALLBACK_FONT_NAME, op.font_size)
+                can.drawString(op.x, op.y, value)
+            except Exception:
+                pass
+
+
+def render_overlay(ops: Tuple[DrawOp, ...], data: Dict[str, Any], width: float, height: float) -> "PageObject":
+    """把一页的占位符绘制到单独的覆盖层PDF，返回覆盖层页面"""
+    packet = BytesIO()
+    can = canvas.Canvas(packet, pagesize=(width, height))
+    draw_ops(can, ops, data)
+    can.save()
+    packet.seek(0)
+    return PdfReader(packet).pages[0]
+
+
+def render_overlay_document(plan: DrawPlan, data_list: List[Dict[str, Any]],
+                            skip_pages: Optional[List[Set[int]]] = None) -> Tuple[Optional[bytes], List[List[int]]]:
+    """
+    把一批教师的覆盖层依次绘制为同一个canvas的连续页面，只保存一次
+    返回 (覆盖层PDF内容, 每位教师依次绘制的页码)；没有可变字段的页面、skip_pages 中该教师已另行处理的页面不绘制，
+    没有任何页面要绘制时PDF内容为None
+    """
+    variable_pages = [page_plan for page_plan in plan.pages if page_plan.ops]
+    layout = [
+        [page_plan for page_plan in variable_pages
+         if skip_pages is None or page_plan.page_num not in skip_pages[index]]
+        for index in range(len(data_list))
+    ]
+    page_nums = [[page_plan.page_num for page_plan in page_plans] for page_plans in layout]
+    if not any(layout):
+        return None, page_nums
+
+    packet = BytesIO()
+    can = canvas.Canvas(packet)
+    for data, page_plans in zip(data_list, layout):
+        for page_plan in page_plans:
+            can.setPageSize((page_plan.width, page_plan.height))
+            draw_ops(can, page_plan.ops, data)
+            can.showPage()
+    can.save()
+    return packet.getvalue(), page_nums
+
+
+def render_overlay_batch(plan: DrawPlan, data_list: List[Dict[str, Any]],
+                         skip_pages: Optional[List[Set[int]]] = None) -> List[Dict[int, "PageObject"]]:
+    """
+    一批教师的覆盖层绘制在同一个canvas中（见 render_overlay_document），只解析一次
+    返回每位教师的 {页码: 覆盖层页面}
+    """
+    document, page_nums = render_overlay_document(plan, data_list, skip_pages)
+    if document is None:
+        return [{} for _ in data_list]
+    pages = iter(PdfReader(BytesIO(document)).pages)
+    return [{page_num: next(pages) for page_num in teacher_pages} for teacher_pages in page_nums]
@@ -0,0 +1,115 @@
+"""
+导出进度和取消
+批量导出时把已处理、失败的教师数写回任务记录（按时间间隔节流），
+同时检查任务是否被请求取消，在两位教师之间停止导出
+"""
+import time
+from datetime import datetime
+from typing import Optional, Dict, Any
+from sqlalchemy.orm import Session
+from app.models import Task
+from app.services.write_queue import run_write
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+import config
+
+
+class ExportCancelled(Exception):
+    """导出任务已被取消"""
+
+
+class ExportProgress:
+    """
+    记录一次批量导出的进度
+    task_id 为空时（如未关联任务的导出）只在内存中计数，不写数据库也不检查取消
+    """
+
+    def __init__(self, db: Session, task_id: Optional[int], total: int):
+        self.db = db
+        self.task_id = task_id
+        self.total = total
+        self.processed = 0
+        self.failed = 0
+        self._last_flush = 0.0
+        if task_id is not None:
+            task = db.query(Task).filter(Task.id == task_id).first()
+            if task:
+                task.progress_total = total
+                task.progress_processed = 0
+                task.progress_failed = 0
+                task.started_at = datetime.now()
+                db.commit()
+        self._last_flush = time.monotonic()
+
+    def advance(self, success: bool = True):
+        """完成一位教师（成功或失败）后调用"""
+        if success:
+            self.processed += 1
+        else:
+            self.failed += 1
+        if time.monotonic() - self._last_flush >= config.EXPORT_PROGRESS_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """把计数写回任务记录，并检查是否已请求取消"""
+        self._last_flush = time.monotonic()
+        if self.task_id is None:
+            return
+        task_id, processed, failed = self.task_id, self.processed, self.failed
+
+        def update_progress(session: Session):
+            session.query(Task).filter(Task.id == task_id).update({
+                Task.progress_processed: processed,
+                Task.progress_failed: failed,
+            }, synchronize_session=False)
+
+        # 进度更新是频繁的短写事务，启用写队列时与其他写操作合并提交
+        run_write(update_progress, self.db)
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        """任务被请求取消或已被删除时抛出 ExportCancelled"""
+        if self.task_id is None:
+            return
+        row = self.db.query(Task.cancel_requested).filter(Task.id == self.task_id).first()
+        if row is None:
+            raise ExportCancelled(f"导出任务 {self.task_id} 已删除")
+        if row.cancel_requested:
+            raise ExportCancelled(f"导出任务 {self.task_id} 已取消")
+
+
+def progress_snapshot(task: Task) -> Dict[str, Any]:
+    """根据任务记录计算进度、吞吐量和预计剩余时间"""
+    total = task.progress_total or 0
+    processed = task.progress_processed or 0
+    failed = task.progress_failed or 0
+    done = processed + failed
+    if task.status == "completed":
+        percent = 100.0
+    else:
+        percent = round(done * 100.0 / total, 1) if total else 0.0
+
+    throughput = None
+    eta_seconds = None
+    elapsed_seconds = None
+    if task.started_at:
+        end = task.completed_at if task.status == "completed" and task.completed_at else datetime.now()
+        elapsed_seconds = max((end - task.started_at).total_seconds(), 0.0)
+        if elapsed_seconds > 0 and done:
+            throughput = round(done / elapsed_seconds, 2)
+            if task.status == "processing":
+                eta_seconds = round((total - done) / throughput, 1) if throughput else None
+
+    return {
+        "task_id": task.id,
+        "status": task.status,
+        "total": total,
+        "processed": processed,
+        "failed": failed,
+        "percent": percent,
+        "throughput": throughput,
+        "elapsed_seconds": round(elapsed_seconds, 1) if elapsed_seconds is not None else None,
+        "eta_seconds": eta_seconds,
+        "cancel_requested": bool(task.cancel_requested),
+    }
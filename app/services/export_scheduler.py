@@ -0,0 +1,132 @@
+"""
+导出调度
+限制同一进程内同时进行的渲染/导出数量，并按优先级放行：
+单个教师下载等交互式请求优先于批量ZIP导出，批量导出不能占满全部名额；
+等待的请求过多或等待超时时抛出 ExportBusy，接口返回429和Retry-After。
+名额只在本进程内有效：独立的导出工作进程与Web进程各自计算，多进程间的作业并发由导出作业队列
+（每个工作进程最多同时执行 EXPORT_JOB_CONCURRENCY 个作业）限制
+"""
+import heapq
+import itertools
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+import config
+
+# 优先级（数值越小越优先）
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 10
+
+
+class ExportBusy(Exception):
+    """导出繁忙，retry_after 为建议的重试等待秒数"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def job_priority(teacher_count: int) -> int:
+    """教师数较少的导出按交互式优先级处理"""
+    if teacher_count <= config.EXPORT_SMALL_JOB_TEACHERS:
+        return PRIORITY_INTERACTIVE
+    return PRIORITY_BULK
+
+
+class ExportScheduler:
+    """
+    带优先级的并发名额
+    capacity 为总名额，其中 reserved_interactive 个只留给交互式请求；
+    名额释放时，等待中优先级最高（同优先级先到先得）且可以运行的请求先获得名额
+    """
+
+    def __init__(self, capacity: int, reserved_interactive: int, max_waiting: int):
+        self.capacity = max(1, capacity)
+        self.bulk_capacity = max(1, self.capacity - max(0, reserved_interactive))
+        self.max_waiting = max_waiting
+        self._cond = threading.Condition()
+        self._running = 0
+        self._running_bulk = 0
+        self._waiting = []
+        self._counter = itertools.count()
+        # 每个优先级最近的平均占用时长（秒），用于估算Retry-After
+        self._avg_hold = {PRIORITY_INTERACTIVE: 1.0, PRIORITY_BULK: 30.0}
+
+    def _can_run(self, priority: int) -> bool:
+        if self._running >= self.capacity:
+            return False
+        if priority >= PRIORITY_BULK and self._running_bulk >= self.bulk_capacity:
+            return False
+        return True
+
+    def _is_next(self, ticket) -> bool:
+        """ticket 是否为可以运行的等待者中排在最前面的"""
+        priority = ticket[0]
+        if not self._can_run(priority):
+            return False
+        return all(other >= ticket or not self._can_run(other[0]) for other in self._waiting)
+
+    def retry_after(self, priority: int) -> int:
+        """估算重试等待时间：排在前面的等待者数量 × 平均占用时长 / 名额数"""
+        ahead = sum(1 for ticket in self._waiting if ticket[0] <= priority) + 1
+        capacity = self.bulk_capacity if priority >= PRIORITY_BULK else self.capacity
+        seconds = self._avg_hold.get(priority, self._avg_hold[PRIORITY_BULK]) * ahead / capacity
+        return max(1, min(int(math.ceil(seconds)), 300))
+
+    def ensure_available(self, priority: int):
+        """当前没有空闲名额时抛出 ExportBusy（不占用名额，用于流式响应开始前的检查）"""
+        with self._cond:
+            if not self._can_run(priority) or any(ticket[0] <= priority for ticket in self._waiting):
+                raise ExportBusy("导出繁忙，请稍后重试", self.retry_after(priority))
+
+    @contextmanager
+    def slot(self, priority: int, timeout: Optional[float] = None):
+        """
+        获取一个名额，代码块结束后释放
+        timeout 为 None 时一直等待；为 0 时拿不到名额立即抛出 ExportBusy
+        """
+        with self._cond:
+            if len(self._waiting) >= self.max_waiting and not self._can_run(priority):
+                raise ExportBusy("导出请求过多，请稍后重试", self.retry_after(priority))
+            ticket = (priority, next(self._counter))
+            heapq.heappush(self._waiting, ticket)
+            deadline = None if timeout is None else time.monotonic() + timeout
+            try:
+                while not self._is_next(ticket):
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise ExportBusy("导出繁忙，请稍后重试", self.retry_after(priority))
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                # 其他等待者可能因为队列变化而可以运行
+                self._cond.notify_all()
+            self._running += 1
+            if priority >= PRIORITY_BULK:
+                self._running_bulk += 1
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            held = time.monotonic() - started
+            with self._cond:
+                self._running -= 1
+                if priority >= PRIORITY_BULK:
+                    self._running_bulk -= 1
+                previous = self._avg_hold.get(priority, held)
+                self._avg_hold[priority] = previous * 0.8 + held * 0.2
+                self._cond.notify_all()
+
+
+export_scheduler = ExportScheduler(
+    config.EXPORT_MAX_CONCURRENT,
+    config.EXPORT_INTERACTIVE_RESERVED,
+    config.EXPORT_MAX_WAITING
+)
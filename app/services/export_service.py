@@ -2,21 +2,308 @@
 批量导出服务
 """
 import os
-import shutil
+import time
+import logging
 import zipfile
+from io import BytesIO, RawIOBase
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any
+from collections import deque
+from itertools import islice
+from typing import List, Dict, Any, Optional, Tuple, Iterator
 from datetime import datetime
 from sqlalchemy.orm import Session
-from app.models import Teacher, Template
+from app.models import Teacher, Template, Task
 from app.services.template_processor import process_template
+from app.services.render_fingerprint import render_fingerprint, template_version
+from app.utils.hashing import json_hash
+from app.services.artifact_store import artifact_store
+from app.services.export_progress import ExportProgress
+from app.utils.stage_timer import StageTimer, collect_stages, stage
 import sys
 from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 import config
 
+logger = logging.getLogger(__name__)
 
-def batch_export(template_id: int, teacher_ids: List[int], db: Session, task_name: str = None) -> str:
+
+def build_teacher_data(teacher: Teacher) -> Dict[str, Any]:
+    """将教师记录转换为模板填充使用的数据字典"""
+    # 修复手机号格式（如果是浮点数，转换为整数字符串）
+    phone = teacher.phone
+    if phone and '.' in str(phone):
+        try:
+            phone = str(int(float(phone)))
+        except (ValueError, TypeError):
+            pass
+    
+    return {
+        'name': teacher.name,
+        'sex': teacher.sex,
+        'id_number': teacher.id_number,
+        'phone': phone,
+        'email': teacher.email,
+        'department': teacher.department,
+        'position': teacher.position,
+        'title': teacher.title,
+        'extra_data': teacher.extra_data or {}
+    }
+
+
+def _init_export_worker(template_path: str, placeholder_positions: Optional[List[Dict[str, Any]]], template_id: int):
+    """导出工作进程初始化：配置日志，预先注册字体并解析模板"""
+    from app.utils.logging_setup import setup_logging
+    setup_logging()
+    from app.services.font_registry import warm_up
+    warm_up()
+    if placeholder_positions:
+        from app.services.template_cache import get_pdf_template
+        get_pdf_template(template_path, placeholder_positions, template_id)
+    elif Path(template_path).suffix.lower() in ('.docx', '.xlsx'):
+        from app.services.office_template import get_office_template
+        get_office_template(template_path)
+
+
+def _render_teacher(template_path: str, placeholder_positions: Optional[List[Dict[str, Any]]], template_id: int,
+                    teacher_name: str, teacher_id: int, teacher_data: Dict[str, Any],
+                    output_filename: str) -> Tuple[bool, str, bytes, Dict[str, Dict[str, float]]]:
+    """
+    渲染单个教师的文件到内存（串行导出和工作进程共用）
+    返回 (是否成功, 错误信息, 文件内容, 各阶段耗时)
+    """
+    with collect_stages() as timer:
+        try:
+            output = BytesIO()
+            process_template(
+                template_path,
+                teacher_data,
+                output,
+                placeholder_positions=placeholder_positions,
+                template_id=template_id
+            )
+            logger.debug("教师 %s 的表格处理完成: %s", teacher_name, output_filename)
+            return True, "", output.getvalue(), timer.as_dict()
+        except Exception as e:
+            logger.exception("处理教师 %s (ID: %s) 的表格时出错: %s", teacher_name, teacher_id, e)
+            return False, str(e), b"", timer.as_dict()
+
+
+def _render_chunk(chunk: List[tuple]) -> List[Tuple[bool, str, bytes, Dict[str, Dict[str, float]]]]:
+    """
+    渲染一批教师（参数与 _render_teacher 相同），返回与输入顺序一致的渲染结果
+    PDF模板整批绘制覆盖层，Word/Excel模板整批共用同一个替换计划；整批失败时逐个重新渲染，以便定位出错的教师
+    """
+    if len(chunk) == 1:
+        return [_render_teacher(*chunk[0])]
+    
+    template_path, placeholder_positions, template_id = chunk[0][:3]
+    data_list = [args[5] for args in chunk]
+    with collect_stages() as timer:
+        try:
+            if Path(template_path).suffix.lower() == '.pdf':
+                from app.services.pdf_engine import get_pdf_engine
+                contents = get_pdf_engine().fill_batch(
+                    template_path,
+                    placeholder_positions,
+                    data_list,
+                    template_id=template_id
+                )
+            else:
+                from app.services.template_processor import fill_office_template_batch
+                contents = fill_office_template_batch(template_path, data_list)
+        except Exception as e:
+            logger.warning("批量渲染 %d 位教师失败，改为逐个渲染: %s", len(chunk), e)
+            contents = None
+    if contents is None:
+        return [_render_teacher(*args) for args in chunk]
+    # 整批的阶段耗时记在第一位教师上，合计时不会重复计算
+    timings = timer.as_dict()
+    return [(True, "", content, timings if index == 0 else {}) for index, content in enumerate(contents)]
+
+
+def _chunk_jobs(jobs: List[Tuple[str, tuple]]) -> List[List[Tuple[str, tuple]]]:
+    """把渲染任务按 EXPORT_RENDER_BATCH_SIZE 分批（有占位符位置的PDF模板和docx/xlsx模板批量渲染）"""
+    if not jobs:
+        return []
+    template_path, placeholder_positions = jobs[0][1][:2]
+    batch_size = config.EXPORT_RENDER_BATCH_SIZE
+    ext = Path(template_path).suffix.lower()
+    if batch_size <= 1 or not ((ext == '.pdf' and placeholder_positions) or ext in ('.docx', '.xlsx')):
+        batch_size = 1
+    return [jobs[start:start + batch_size] for start in range(0, len(jobs), batch_size)]
+
+
+def _export_worker_count(job_count: int) -> int:
+    """根据配置和教师数量决定导出进程数（1表示串行）"""
+    workers = config.EXPORT_WORKERS
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    if job_count < config.EXPORT_PARALLEL_MIN_TEACHERS:
+        return 1
+    return max(1, min(workers, job_count))
+
+
+def _write_zip_entry(zipf: zipfile.ZipFile, arcname: str, content: bytes):
+    """写入一个ZIP条目（修改时间为写入时间）"""
+    info = zipfile.ZipInfo(arcname, date_time=datetime.now().timetuple()[:6])
+    info.compress_type = zipfile.ZIP_DEFLATED
+    zipf.writestr(info, content)
+
+
+def iter_render_results(jobs: List[Tuple[str, tuple]], parallel: bool = True) -> Iterator[Tuple[str, Tuple[bool, str, bytes, Dict[str, Dict[str, float]]]]]:
+    """
+    按教师顺序渲染并逐个返回 (输出文件名, 渲染结果)
+    PDF和Word/Excel模板按批渲染；教师较多时把各批分发到进程池并行渲染，结果仍按原顺序返回，串行和并行的输出一致
+    parallel=False 时始终在当前进程中串行渲染（Web进程内渲染时使用）
+    """
+    total_teachers = len(jobs)
+    chunks = _chunk_jobs(jobs)
+    worker_count = _export_worker_count(total_teachers) if parallel else 1
+    if worker_count <= 1:
+        index = 0
+        for chunk in chunks:
+            for output_filename, args in chunk:
+                index += 1
+                logger.debug("处理教师 %d/%d: %s (ID: %s)", index, total_teachers, args[3], args[4])
+            for (output_filename, _), result in zip(chunk, _render_chunk([args for _, args in chunk])):
+                yield output_filename, result
+        return
+    
+    template_path, placeholder_positions, template_id = jobs[0][1][:3]
+    logger.info("并行导出 %d 位教师（%d 批），进程数: %d", total_teachers, len(chunks), worker_count)
+    # 使用spawn启动工作进程，避免继承Web进程中的数据库连接和线程锁
+    with ProcessPoolExecutor(
+        max_workers=worker_count,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_export_worker,
+        initargs=(template_path, placeholder_positions, template_id)
+    ) as executor:
+        # 限制同时在途的批数，已渲染但尚未写入ZIP的文件不会无限堆积在内存中
+        window = worker_count * 2
+        pending = deque()
+        chunk_iter = iter(chunks)
+        for chunk in islice(chunk_iter, window):
+            pending.append((chunk, executor.submit(_render_chunk, [args for _, args in chunk])))
+        index = 0
+        try:
+            while pending:
+                chunk, future = pending.popleft()
+                next_chunk = next(chunk_iter, None)
+                if next_chunk is not None:
+                    pending.append((next_chunk, executor.submit(_render_chunk, [args for _, args in next_chunk])))
+                results = future.result()
+                for (output_filename, _), result in zip(chunk, results):
+                    index += 1
+                    logger.debug("已完成 %d/%d", index, total_teachers)
+                    yield output_filename, result
+        finally:
+            # 提前结束（如导出被取消）时，尚未开始的渲染不再执行
+            for _, future in pending:
+                future.cancel()
+
+
+def prepare_export_jobs(template_id: int, teacher_ids: List[int], db: Session) -> List[Tuple[str, tuple]]:
+    """
+    从数据库取出模板和教师数据，生成每位教师的渲染参数
+    返回 [(输出文件名, 渲染参数)]
+    """
+    with stage("db_fetch"):
+        # 获取模板
+        template = db.query(Template).filter(Template.id == template_id).first()
+        if not template:
+            raise ValueError("模板不存在")
+        
+        # 获取教师数据
+        teachers = db.query(Teacher).filter(Teacher.id.in_(teacher_ids)).all()
+    if not teachers:
+        raise ValueError("没有找到教师数据")
+    
+    # 如果是PDF，需要传递占位符位置信息
+    placeholder_positions = None
+    if template.file_type == '.pdf':
+        placeholder_positions = template.placeholder_positions or []
+        logger.debug("PDF模板，占位符数量: %d", len(placeholder_positions))
+    
+    # 准备每个教师的渲染参数（工作进程无法访问数据库会话，在这里先取出数据）
+    ext = Path(template.file_path).suffix
+    jobs = []
+    for teacher in teachers:
+        teacher_data = build_teacher_data(teacher)
+        
+        # 生成输出文件名
+        output_filename = f"{teacher.name}_{teacher.id}{ext}"
+        jobs.append((output_filename, (
+            template.file_path,
+            placeholder_positions,
+            template.id,
+            teacher.name,
+            teacher.id,
+            teacher_data,
+            output_filename
+        )))
+    return jobs
+
+
+def export_dedup_key(template_id: int, teacher_ids: List[int], db: Session,
+                     output_format: str = "zip") -> Optional[str]:
+    """
+    导出内容键：模板版本 + 排序后的教师ID + 数据版本（每位教师的文件名和渲染指纹）
+    键相同的两次导出生成的ZIP内容相同；模板、模板文件或教师不存在时返回None（不去重）
+    合并PDF的页面顺序与 teacher_ids 顺序一致，键中使用原始顺序
+    """
+    if not teacher_ids:
+        return None
+    try:
+        jobs = prepare_export_jobs(template_id, sorted(set(int(tid) for tid in teacher_ids)), db)
+    except ValueError:
+        return None
+    template_path, placeholder_positions = jobs[0][1][:2]
+    try:
+        version = template_version(template_path, placeholder_positions)
+    except OSError:
+        return None
+    data_version = json_hash([
+        (output_filename, render_fingerprint(template_path, placeholder_positions, args[5], version))
+        for output_filename, args in sorted(jobs, key=lambda job: job[1][4])
+    ])
+    key = {
+        "template_version": version,
+        "teacher_ids": sorted(args[4] for _, args in jobs),
+        "data_version": data_version,
+    }
+    if output_format == "pdf":
+        key["output_format"] = output_format
+        key["teacher_order"] = [int(tid) for tid in teacher_ids]
+    return json_hash(key)
+
+
+def _previous_render_index(db: Session, template_id: int, exclude_task_id: Optional[int] = None) -> Dict[str, Tuple[str, str]]:
+    """
+    收集同一模板最近几次导出中已渲染的文件
+    返回 {渲染指纹: (ZIP路径, ZIP条目名)}，越新的导出优先
+    """
+    query = db.query(Task).filter(
+        Task.template_id == template_id,
+        Task.status == "completed",
+        Task.export_path.isnot(None)
+    )
+    if exclude_task_id is not None:
+        query = query.filter(Task.id != exclude_task_id)
+    previous_tasks = query.order_by(Task.completed_at.desc()).limit(config.EXPORT_INCREMENTAL_LOOKBACK).all()
+    
+    index = {}
+    for previous_task in previous_tasks:
+        if not previous_task.render_fingerprints or not Path(previous_task.export_path).exists():
+            continue
+        for info in previous_task.render_fingerprints.values():
+            index.setdefault(info["fingerprint"], (previous_task.export_path, info["entry"]))
+    return index
+
+
+def batch_export(template_id: int, teacher_ids: List[int], db: Session, task_name: str = None,
+                 task_id: int = None, incremental: bool = False, output_format: str = "zip") -> str:
     """
     批量导出填好的表格
     
@@ -25,112 +312,398 @@ def batch_export(template_id: int, teacher_ids: List[int], db: Session, task_nam
         teacher_ids: 教师ID列表
         db: 数据库会话
         task_name: 任务名称（用于生成文件名）
+        task_id: 任务ID（可选，提供时记录导出进度、支持取消，并把每位教师的渲染指纹保存到任务记录中）
+        incremental: 增量导出，数据未变化的教师直接复用之前导出的文件
+        output_format: 导出格式，zip 为每位教师一个文件的ZIP，pdf 为按 teacher_ids 顺序合并的单个PDF（仅PDF模板）
     
     Returns:
-        导出文件的ZIP路径
+        导出文件的路径（ZIP或合并PDF）
+    
+    Raises:
+        ExportCancelled: 导出过程中任务被取消（已生成的部分文件会被删除）
     """
-    # 获取模板
-    template = db.query(Template).filter(Template.id == template_id).first()
-    if not template:
-        raise ValueError("模板不存在")
+    started = time.perf_counter()
+    with collect_stages() as timer:
+        if output_format == "pdf":
+            zip_path, file_count, rendered, manifest = _batch_export_merged_pdf(
+                template_id, teacher_ids, db, task_name, task_id
+            )
+        else:
+            zip_path, file_count, rendered, manifest = _batch_export_zip(
+                template_id, teacher_ids, db, task_name, task_id, incremental, timer
+            )
+    timer.add("total", time.perf_counter() - started)
+    stage_timings = timer.as_dict()
     
-    # 获取教师数据
-    teachers = db.query(Teacher).filter(Teacher.id.in_(teacher_ids)).all()
-    if not teachers:
-        raise ValueError("没有找到教师数据")
+    failed_count = sum(1 for item in manifest.values() if item["status"] != "ok")
+    
+    # 保存渲染指纹（供之后的增量导出使用）、每位教师的导出结果和各阶段耗时
+    if task_id is not None:
+        task_record = db.query(Task).filter(Task.id == task_id).first()
+        if task_record:
+            task_record.render_fingerprints = rendered
+            task_record.export_manifest = manifest
+            task_record.stage_timings = stage_timings
+            # 最终进度与结果清单一致（数据库中已不存在的教师也计为失败）
+            task_record.progress_total = len(manifest)
+            task_record.progress_processed = len(manifest) - failed_count
+            task_record.progress_failed = failed_count
+            db.commit()
+    
+    if failed_count:
+        logger.warning("批量导出有 %d 位教师失败，可通过 retry-failed 只重新导出这些教师", failed_count)
+    logger.info("批量导出完成: %s, 包含 %d 个文件, 耗时 %.2f 秒", zip_path, file_count, stage_timings["total"]["seconds"])
+    logger.info("各阶段耗时: %s", ", ".join(
+        f"{name}={item['seconds']:.3f}s" for name, item in stage_timings.items() if name != "total"
+    ))
+    return str(zip_path)
+
+
+def _batch_export_zip(template_id: int, teacher_ids: List[int], db: Session, task_name: Optional[str],
+                      task_id: Optional[int], incremental: bool,
+                      timer: StageTimer) -> Tuple[Path, int, Dict[str, Dict[str, str]], Dict[str, Dict[str, Any]]]:
+    """
+    生成导出ZIP（batch_export 的主体）
+    返回 (ZIP路径, 文件数量, {教师ID: 渲染指纹和ZIP条目名}, 每位教师的导出结果清单)
+    """
+    jobs = prepare_export_jobs(template_id, teacher_ids, db)
+    manifest = _missing_teachers_manifest(teacher_ids, jobs)
     
-    # 创建临时目录
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     task_name_clean = task_name.replace(" ", "_") if task_name else "export"
-    temp_dir = config.EXPORT_DIR / f"{task_name_clean}_{timestamp}"
-    temp_dir.mkdir(parents=True, exist_ok=True)
     
-    # 处理每个教师的表格
-    total_teachers = len(teachers)
-    for index, teacher in enumerate(teachers, 1):
-        print(f"[批量导出] 处理教师 {index}/{total_teachers}: {teacher.name} (ID: {teacher.id})")
-        try:
-            # 准备数据
-            # 修复手机号格式（如果是浮点数，转换为整数字符串）
-            phone = teacher.phone
-            if phone and '.' in str(phone):
-                try:
-                    phone = str(int(float(phone)))
-                except (ValueError, TypeError):
-                    pass
-            
-            teacher_data = {
-                'name': teacher.name,
-                'sex': teacher.sex,
-                'id_number': teacher.id_number,
-                'phone': phone,
-                'email': teacher.email,
-                'department': teacher.department,
-                'position': teacher.position,
-                'title': teacher.title,
-                'extra_data': teacher.extra_data or {}
-            }
-            
-            # 检查是否有签名字段（base64图片）
-            has_signature = False
-            if teacher_data.get('extra_data'):
-                for key, value in teacher_data['extra_data'].items():
-                    if isinstance(value, str) and value.startswith('data:image'):
-                        has_signature = True
-                        print(f"[批量导出] 检测到签名字段: {key}, 数据长度: {len(value)}")
-                        break
-            
-            # 生成输出文件名
-            ext = Path(template.file_path).suffix
-            output_filename = f"{teacher.name}_{teacher.id}{ext}"
-            output_path = temp_dir / output_filename
-            
-            # 填充模板
-            print(f"[批量导出] 开始处理模板: {template.file_path}")
-            print(f"[批量导出] 教师数据: 姓名={teacher.name}, ID={teacher.id}")
-            # 如果是PDF，需要传递占位符位置信息
-            placeholder_positions = None
-            if template.file_type == '.pdf':
-                placeholder_positions = template.placeholder_positions or []
-                print(f"[批量导出] PDF模板，占位符数量: {len(placeholder_positions)}")
-                if placeholder_positions:
-                    print(f"[批量导出] 占位符示例: {placeholder_positions[0] if len(placeholder_positions) > 0 else '无'}")
-            
-            print(f"[批量导出] 调用 process_template...")
-            process_template(
-                template.file_path, 
-                teacher_data, 
-                str(output_path),
-                placeholder_positions=placeholder_positions
-            )
-            print(f"[批量导出] ✓ 教师 {teacher.name} 的表格处理完成: {output_path}")
-        except Exception as e:
-            print(f"[批量导出] ❌ 处理教师 {teacher.name} (ID: {teacher.id}) 的表格时出错: {e}")
-            import traceback
-            error_trace = traceback.format_exc()
-            print(f"[批量导出] 错误堆栈:\n{error_trace}")
-            continue
+    # 计算每位教师的渲染指纹（模板版本 + 实际填入的字段值）
+    template_path, placeholder_positions = jobs[0][1][:2]
+    with stage("fingerprint"):
+        version = template_version(template_path, placeholder_positions)
+        fingerprints = [render_fingerprint(template_path, placeholder_positions, args[5], version) for _, args in jobs]
+    
+    # 已渲染过的输出：先查渲染结果存储，增量导出时再查之前的导出ZIP
+    ext = Path(template_path).suffix
+    use_store = config.ARTIFACT_STORE_ENABLED
+    with stage("reuse_lookup"):
+        stored = set(fp for fp in fingerprints if use_store and artifact_store.get(fp, ext) is not None)
+        previous_index = _previous_render_index(db, template_id, task_id) if incremental else {}
+    render_jobs = [
+        job for job, fingerprint in zip(jobs, fingerprints)
+        if fingerprint not in stored and fingerprint not in previous_index
+    ]
+    logger.info("复用已渲染的文件 %d 个，需要渲染 %d 个", len(jobs) - len(render_jobs), len(render_jobs))
     
-    # 打包成ZIP
-    print(f"[批量导出] 开始打包ZIP文件...")
+    progress = ExportProgress(db, task_id, len(jobs))
+    progress.check_cancelled()
+    
+    # 每个教师的文件渲染到内存后直接写入ZIP条目，不再经过临时目录
     zip_filename = f"{task_name_clean}_{timestamp}.zip"
     zip_path = config.EXPORT_DIR / zip_filename
     
     file_count = 0
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for file_path in temp_dir.iterdir():
-            if file_path.is_file():
-                zipf.write(file_path, file_path.name)
-                file_count += 1
-                print(f"[批量导出] 添加到ZIP: {file_path.name}")
+    rendered = {}
+    previous_zips = {}
+    render_results = iter_render_results(render_jobs)
+    try:
+        # allowZip64：文件数量或总大小超出普通ZIP限制时自动写入ZIP64记录
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zipf:
+            for (output_filename, args), fingerprint in zip(jobs, fingerprints):
+                if fingerprint in stored:
+                    with stage("reuse_read"):
+                        content = artifact_store.read(fingerprint, ext)
+                    success = content is not None
+                    error = ""
+                    if not success:
+                        # 查找后被淘汰，就地重新渲染
+                        success, error, content, timings = _render_teacher(*args)
+                        timer.merge(timings)
+                elif fingerprint in previous_index:
+                    previous_path, previous_entry = previous_index[fingerprint]
+                    with stage("reuse_read"):
+                        if previous_path not in previous_zips:
+                            previous_zips[previous_path] = zipfile.ZipFile(previous_path)
+                        success, error, content = True, "", previous_zips[previous_path].read(previous_entry)
+                else:
+                    # 工作进程中各阶段的耗时随结果一起返回（并行时为各进程耗时之和）
+                    _, (success, error, content, timings) = next(render_results)
+                    timer.merge(timings)
+                manifest[str(args[4])] = _manifest_item(args[3], output_filename, success, error)
+                if success:
+                    if use_store:
+                        with stage("artifact_store"):
+                            artifact_store.put(fingerprint, ext, content)
+                    with stage("zip"):
+                        _write_zip_entry(zipf, output_filename, content)
+                    rendered[str(args[4])] = {"fingerprint": fingerprint, "entry": output_filename}
+                    file_count += 1
+                    logger.debug("添加到ZIP: %s", output_filename)
+                # 写回进度，任务被取消时在这里停止
+                progress.advance(success)
+        progress.flush()
+    except BaseException:
+        # 取消或出错时删除写了一半的ZIP
+        zip_path.unlink(missing_ok=True)
+        raise
+    finally:
+        render_results.close()
+        for previous_zip in previous_zips.values():
+            previous_zip.close()
+    if use_store:
+        with stage("artifact_store"):
+            artifact_store.evict()
+    return zip_path, file_count, rendered, manifest
+
+
+def _ordered_jobs(jobs: List[Tuple[str, tuple]], teacher_ids: List[int]) -> List[Tuple[str, tuple]]:
+    """按 teacher_ids 的顺序排列渲染任务（数据库查询结果不保证顺序）"""
+    order = {}
+    for index, teacher_id in enumerate(teacher_ids):
+        order.setdefault(int(teacher_id), index)
+    return sorted(jobs, key=lambda job: order.get(job[1][4], len(order)))
+
+
+def iter_merged_pdf(jobs: List[Tuple[str, tuple]], output) -> Iterator[Tuple[tuple, bool, str, str]]:
+    """
+    把各教师的页面按顺序写入一个合并PDF，每写完一位教师返回 (渲染参数, 是否成功, 错误信息, 页码范围)
+    模板页面（含常量字段）只写一次，覆盖层按批绘制；迭代结束时PDF写入完成
+    """
+    from app.services.template_cache import get_pdf_template
+    from app.services.font_registry import get_default_font_name
+    from app.services.draw_plan import render_overlay_batch
+    from app.services.merged_pdf import MergedPdfWriter
     
-    print(f"[批量导出] ZIP打包完成: {zip_path}, 包含 {file_count} 个文件")
+    template_path, placeholder_positions, template_id = jobs[0][1][:3]
+    if Path(template_path).suffix.lower() != '.pdf' or not placeholder_positions:
+        raise ValueError("合并PDF只支持已设置占位符位置的PDF模板")
     
-    # 清理临时目录
-    print(f"[批量导出] 清理临时目录: {temp_dir}")
-    shutil.rmtree(temp_dir)
-    print(f"[批量导出] 临时目录已清理")
+    with stage("template_load"):
+        cached_template = get_pdf_template(template_path, placeholder_positions, template_id)
+    with stage("font_setup"):
+        default_font_name = get_default_font_name()
     
-    print(f"[批量导出] ✓ 批量导出完成，ZIP文件: {zip_path}")
+    writer = MergedPdfWriter(output)
+    with stage("draw_plan"), cached_template.lock:
+        draw_plan = cached_template.get_draw_plan(default_font_name)
+        template_memo = {}
+        backgrounds = [
+            writer.add_background(
+                page_plan.base_page if page_plan.base_page is not None
+                else cached_template.reader.pages[page_plan.page_num],
+                template_memo
+            )
+            for page_plan in draw_plan.pages
+        ]
+    
+    batch_size = max(1, config.EXPORT_RENDER_BATCH_SIZE)
+    for start in range(0, len(jobs), batch_size):
+        chunk = jobs[start:start + batch_size]
+        with stage("overlay_draw"):
+            try:
+                overlays_list = render_overlay_batch(draw_plan, [args[5] for _, args in chunk])
+            except Exception as e:
+                logger.warning("批量绘制 %d 位教师失败，改为逐个绘制: %s", len(chunk), e)
+                overlays_list = None
+        # 同一批覆盖层来自同一个PDF，共用的字体只写一次
+        overlay_memo = {}
+        for index, (output_filename, args) in enumerate(chunk):
+            page_count = writer.page_count
+            try:
+                if overlays_list is not None:
+                    overlays = overlays_list[index]
+                else:
+                    with stage("overlay_draw"):
+                        overlays = render_overlay_batch(draw_plan, [args[5]])[0]
+                with stage("merge"):
+                    for page_plan, background in zip(draw_plan.pages, backgrounds):
+                        writer.add_page(background, overlays.get(page_plan.page_num), overlay_memo)
+            except Exception as e:
+                logger.exception("处理教师 %s (ID: %s) 的页面时出错: %s", args[3], args[4], e)
+                # 撤销该教师已写入的部分页面，合并PDF中不留下不完整的教师
+                writer.remove_pages_after(page_count)
+                yield args, False, str(e), ""
+                continue
+            yield args, True, "", f"第{page_count + 1}-{writer.page_count}页"
+    
+    with stage("write"):
+        writer.close()
+
+
+def _batch_export_merged_pdf(template_id: int, teacher_ids: List[int], db: Session, task_name: Optional[str],
+                             task_id: Optional[int]) -> Tuple[Path, int, Dict[str, Dict[str, str]], Dict[str, Dict[str, Any]]]:
+    """
+    生成按 teacher_ids 顺序合并的单个PDF（batch_export 的 pdf 格式）
+    返回值与 _batch_export_zip 相同；合并PDF不能按教师复用，不记录渲染指纹
+    """
+    jobs = _ordered_jobs(prepare_export_jobs(template_id, teacher_ids, db), teacher_ids)
+    manifest = _missing_teachers_manifest(teacher_ids, jobs)
+    
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    task_name_clean = task_name.replace(" ", "_") if task_name else "export"
+    pdf_path = config.EXPORT_DIR / f"{task_name_clean}_{timestamp}.pdf"
+    
+    progress = ExportProgress(db, task_id, len(jobs))
+    progress.check_cancelled()
+    
+    file_count = 0
+    try:
+        with open(pdf_path, 'wb') as output:
+            for args, success, error, pages in iter_merged_pdf(jobs, output):
+                manifest[str(args[4])] = _manifest_item(args[3], pages, success, error)
+                if success:
+                    file_count += 1
+                # 写回进度，任务被取消时在这里停止
+                progress.advance(success)
+        progress.flush()
+    except BaseException:
+        # 取消或出错时删除写了一半的PDF
+        pdf_path.unlink(missing_ok=True)
+        raise
+    return pdf_path, file_count, {}, manifest
+
+
+def _manifest_item(teacher_name: str, entry: str, success: bool, error: str = "") -> Dict[str, Any]:
+    """导出结果清单中的一项"""
+    return {
+        "name": teacher_name,
+        "entry": entry,
+        "status": "ok" if success else "failed",
+        "error": "" if success else (error or "未知错误"),
+    }
+
+
+def _missing_teachers_manifest(teacher_ids: List[int], jobs: List[Tuple[str, tuple]]) -> Dict[str, Dict[str, Any]]:
+    """数据库中已不存在的教师记为失败（重试时同样无法导出，但不会被静默遗漏）"""
+    found_ids = set(args[4] for _, args in jobs)
+    return {
+        str(teacher_id): {"name": "", "entry": "", "status": "failed", "error": "教师不存在"}
+        for teacher_id in teacher_ids if int(teacher_id) not in found_ids
+    }
+
+
+def retry_failed_teachers(task: Task, db: Session) -> Dict[str, int]:
+    """
+    只重新导出任务清单中失败的教师，并把生成的文件追加到已有的ZIP中（由重试作业执行）
+    追加在副本上进行，完成后替换原文件；共用同一个导出文件的任务（相同导出被复用）一起更新结果清单和进度
+    返回 {"retried": 重试人数, "succeeded": 新加入ZIP的人数, "failed": 仍失败人数}
+    """
+    manifest = dict(task.export_manifest or {})
+    failed_ids = [int(teacher_id) for teacher_id, item in manifest.items() if item.get("status") != "ok"]
+    if not failed_ids:
+        return {"retried": 0, "succeeded": 0, "failed": 0}
+    
+    zip_path = Path(task.export_path)
+    if not zip_path.exists():
+        raise ValueError("导出文件不存在")
+    
+    try:
+        jobs = prepare_export_jobs(task.template_id, failed_ids, db)
+    except ValueError:
+        jobs = []
+    
+    rendered = dict(task.render_fingerprints or {})
+    succeeded = 0
+    if jobs:
+        import shutil
+        template_path, placeholder_positions = jobs[0][1][:2]
+        version = template_version(template_path, placeholder_positions)
+        ext = Path(template_path).suffix
+        use_store = config.ARTIFACT_STORE_ENABLED
+        tmp_path = zip_path.with_name(f"{zip_path.name}.{os.getpid()}.retry.tmp")
+        shutil.copyfile(zip_path, tmp_path)
+        try:
+            with zipfile.ZipFile(tmp_path, 'a', zipfile.ZIP_DEFLATED, allowZip64=True) as zipf:
+                existing_entries = set(zipf.namelist())
+                for (output_filename, args), (_, (success, error, content, _)) in zip(jobs, iter_render_results(jobs)):
+                    teacher_key = str(args[4])
+                    if success:
+                        fingerprint = render_fingerprint(template_path, placeholder_positions, args[5], version)
+                        if use_store:
+                            artifact_store.put(fingerprint, ext, content)
+                        # 已在ZIP中的条目不重复写入，也不计入本次新增
+                        if output_filename not in existing_entries:
+                            _write_zip_entry(zipf, output_filename, content)
+                            existing_entries.add(output_filename)
+                            succeeded += 1
+                        rendered[teacher_key] = {"fingerprint": fingerprint, "entry": output_filename}
+                    manifest[teacher_key] = _manifest_item(args[3], output_filename, success, error)
+            # 原文件整体替换，正在下载旧文件的请求不受影响
+            os.replace(tmp_path, zip_path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        if use_store:
+            artifact_store.evict()
+    
+    # 进度与结果清单一致（包括已不存在的教师）
+    ok_count = sum(1 for item in manifest.values() if item.get("status") == "ok")
+    still_failed = len(manifest) - ok_count
+    sharing_tasks = db.query(Task).filter(Task.export_path == task.export_path).all()
+    for sharing_task in sharing_tasks:
+        sharing_task.export_manifest = dict(manifest)
+        sharing_task.render_fingerprints = dict(rendered)
+        sharing_task.progress_total = len(manifest)
+        sharing_task.progress_processed = ok_count
+        sharing_task.progress_failed = still_failed
+    db.commit()
+    logger.info("任务 %d 重试失败的教师 %d 位，新加入 %d 位，仍失败 %d 位（共用导出文件的任务 %d 个）",
+                task.id, len(failed_ids), succeeded, still_failed, len(sharing_tasks))
+    return {"retried": len(failed_ids), "succeeded": succeeded, "failed": still_failed}
+
+
+def create_empty_export(task_name: Optional[str]) -> str:
+    """生成只包含说明文件的ZIP（任务没有教师完成填写时使用）"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    task_name_clean = task_name.replace(" ", "_") if task_name else "export"
+    zip_path = config.EXPORT_DIR / f"{task_name_clean}_{timestamp}.zip"
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        zipf.writestr("README.txt", f"此任务没有教师完成填写。\n任务名称: {task_name}\n导出时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     return str(zip_path)
 
+
+class _ZipStreamBuffer(RawIOBase):
+    """
+    只能追加写入的缓冲区，供流式生成ZIP和合并PDF使用
+    不支持seek，zipfile会改用数据描述符写入条目，已写出的字节可以立即发送并释放
+    """
+    
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+    
+    def writable(self) -> bool:
+        return True
+    
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+    
+    def tell(self) -> int:
+        return self._position
+    
+    def drain(self) -> bytes:
+        """取出目前已写入的数据"""
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_export_zip(jobs: List[Tuple[str, tuple]]) -> Iterator[bytes]:
+    """
+    边渲染边生成ZIP数据块
+    每渲染完一位教师的文件就输出对应的ZIP条目，内存中只保留当前条目；
+    在Web进程内渲染，始终串行，不在API进程中启动进程池
+    """
+    buffer = _ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zipf:
+        for output_filename, (success, _, content, _) in iter_render_results(jobs, parallel=False):
+            if success:
+                _write_zip_entry(zipf, output_filename, content)
+                yield buffer.drain()
+    # ZIP中央目录在关闭时写入
+    yield buffer.drain()
+
+
+def stream_merged_pdf(jobs: List[Tuple[str, tuple]], teacher_ids: List[int]) -> Iterator[bytes]:
+    """边渲染边生成合并PDF的数据块，页面按 teacher_ids 的顺序排列"""
+    buffer = _ZipStreamBuffer()
+    for _ in iter_merged_pdf(_ordered_jobs(jobs, teacher_ids), buffer):
+        yield buffer.drain()
+    # 页面树和交叉引用表在最后写入
+    yield buffer.drain()
@@ -0,0 +1,143 @@
+"""
+PDF中文字体注册表
+每个进程只查找、解析、注册一次中文字体，渲染时直接使用已解析好的字体名
+"""
+import os
+import logging
+import platform
+import threading
+from typing import List, Tuple, Optional
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+import config
+
+logger = logging.getLogger(__name__)
+
+try:
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    FONT_LIBRARIES_AVAILABLE = True
+except ImportError:
+    FONT_LIBRARIES_AVAILABLE = False
+
+# 注册到reportlab中的字体名称
+CJK_TTF_FONT_NAME = "SimSun"
+CJK_CID_FONT_NAME = "STSong-Light"
+FALLBACK_FONT_NAME = "Helvetica"
+
+_lock = threading.Lock()
+_default_font_name: Optional[str] = None
+
+
+def _font_dirs() -> List[str]:
+    """当前系统的字体搜索目录（config.PDF_FONT_DIRS 优先）"""
+    system = platform.system()
+    if system == "Windows":
+        dirs = [
+            os.path.join(os.environ.get("WINDIR", "C:\\Windows"), "Fonts"),
+            os.path.join(os.environ.get("LOCALAPPDATA", ""), "Microsoft", "Windows", "Fonts"),
+        ]
+    elif system == "Linux":
+        dirs = ["/usr/share/fonts", "/usr/local/share/fonts", os.path.expanduser("~/.fonts")]
+    elif system == "Darwin":  # macOS
+        dirs = ["/System/Library/Fonts", "/Library/Fonts", os.path.expanduser("~/Library/Fonts")]
+    else:
+        dirs = []
+    return list(config.PDF_FONT_DIRS) + dirs
+
+
+def find_system_fonts() -> List[Tuple[str, str]]:
+    """
+    查找系统中的中文字体
+    返回 [(字体路径, 显示名称)]，按优先级排序
+    """
+    system_fonts = []
+    if config.PDF_FONT_PATH:
+        if os.path.exists(config.PDF_FONT_PATH):
+            system_fonts.append((config.PDF_FONT_PATH, Path(config.PDF_FONT_PATH).stem))
+        else:
+            logger.warning("配置的字体文件不存在: %s", config.PDF_FONT_PATH)
+
+    system = platform.system()
+    for font_dir in _font_dirs():
+        if not os.path.exists(font_dir):
+            continue
+        if system == "Windows":
+            # 查找常见中文字体
+            for font_file in config.PDF_WINDOWS_FONT_FILES:
+                font_path = os.path.join(font_dir, font_file)
+                if os.path.exists(font_path):
+                    system_fonts.append((font_path, font_file.split(".")[0].title()))
+                    break
+        else:
+            for root, dirs, files in os.walk(font_dir):
+                for file in files:
+                    if file.lower().endswith((".ttf", ".ttc", ".otf")):
+                        if any(keyword in file.lower() for keyword in config.PDF_FONT_KEYWORDS):
+                            system_fonts.append((os.path.join(root, file), "ChineseFont"))
+                            break
+                if system == "Darwin":
+                    # macOS只查找字体目录的第一层
+                    break
+    return system_fonts
+
+
+def _register_cid_font() -> str:
+    """注册reportlab内置的中文字体，失败时退回Helvetica"""
+    try:
+        from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+        pdfmetrics.registerFont(UnicodeCIDFont(CJK_CID_FONT_NAME))
+        logger.info("使用reportlab内置中文字体: %s", CJK_CID_FONT_NAME)
+        return CJK_CID_FONT_NAME
+    except Exception as e:
+        logger.warning("无法加载中文字体: %s", e)
+        # 最后使用Helvetica，但中文会显示为方块
+        logger.warning("未找到中文字体，中文可能显示异常")
+        return FALLBACK_FONT_NAME
+
+
+def _register_default_font() -> str:
+    """查找并注册默认中文字体，返回可直接用于 canvas.setFont 的字体名"""
+    if not FONT_LIBRARIES_AVAILABLE:
+        return FALLBACK_FONT_NAME
+
+    try:
+        # 注册找到的第一个可用中文字体
+        for font_path, font_display_name in find_system_fonts():
+            try:
+                pdfmetrics.registerFont(TTFont(CJK_TTF_FONT_NAME, font_path))
+                logger.info("已注册中文字体: %s (%s)", font_display_name, font_path)
+                return CJK_TTF_FONT_NAME
+            except Exception as e:
+                logger.warning("注册中文字体失败: %s: %s", font_path, e)
+        # 没有可用的系统字体，尝试使用reportlab内置的中文字体
+        return _register_cid_font()
+    except Exception as e:
+        logger.warning("字体设置出错: %s", e)
+        return FALLBACK_FONT_NAME
+
+
+def get_default_font_name() -> str:
+    """
+    获取默认中文字体名称
+    第一次调用时查找并注册字体，之后直接返回缓存的结果
+    """
+    global _default_font_name
+    if _default_font_name is None:
+        with _lock:
+            if _default_font_name is None:
+                _default_font_name = _register_default_font()
+    return _default_font_name
+
+
+def warm_up() -> str:
+    """预热字体注册表（应用启动或工作进程初始化时调用）"""
+    return get_default_font_name()
+
+
+def reset():
+    """清空已解析的字体（修改字体配置后调用，下次渲染时重新查找）"""
+    global _default_font_name
+    with _lock:
+        _default_font_name = None
@@ -0,0 +1,161 @@
+"""
+增量更新输出
+保留模板PDF的原始字节，在文件末尾追加增量更新：只写出有占位符的页面的新版本
+（原内容流加上覆盖层表单XObject，或直接追加的文本绘制指令）以及用到的字体等对象，其他页面不重新写出。
+每位教师的写出开销取决于占位符数量，而不是模板大小
+"""
+from typing import Dict, List, Union, BinaryIO, NamedTuple
+from app.services.pdf_object_writer import PdfObjectWriter, flate_stream
+from app.services.direct_text import DirectText, get_direct_font, text_operators
+
+try:
+    from PyPDF2 import PageObject
+    from PyPDF2.generic import ArrayObject, DictionaryObject, FloatObject, IndirectObject, NameObject, NumberObject
+    PDF_LIBRARIES_AVAILABLE = True
+except ImportError:
+    PDF_LIBRARIES_AVAILABLE = False
+
+# 覆盖层表单XObject和直接绘制文本所用字体的资源名（与页面已有的资源重名时加序号）
+OVERLAY_NAME = "/TfOverlay"
+FONT_NAME_PREFIX = "/TfFont"
+
+
+class PagePatch(NamedTuple):
+    """修改模板页面所需的信息（从模板中取出一次，之后不再访问模板的PdfReader）"""
+    idnum: int
+    generation: int
+    # 页面字典中除 /Contents 和 /Resources 外的条目
+    entries: "DictionaryObject"
+    # 原内容流的引用
+    contents: List["IndirectObject"]
+    # 资源字典中除 /XObject、/Font 外的条目
+    resources: "DictionaryObject"
+    xobjects: "DictionaryObject"
+    fonts: "DictionaryObject"
+    overlay_name: "NameObject"
+    font_prefix: str
+    width: float
+    height: float
+
+
+def build_page_patch(cached_template, page_num: int) -> PagePatch:
+    """取出模板页面的对象号、原内容流和资源（需在持有 cached_template.lock 时调用）"""
+    page = cached_template.reader.pages[page_num]
+    reference = page.indirect_reference
+
+    contents = []
+    raw_contents = page.raw_get("/Contents") if "/Contents" in page else None
+    if raw_contents is not None:
+        resolved = raw_contents.get_object()
+        contents = list(resolved) if isinstance(resolved, ArrayObject) else [raw_contents]
+
+    resources = DictionaryObject()
+    xobjects = DictionaryObject()
+    fonts = DictionaryObject()
+    if "/Resources" in page:
+        for key, value in page["/Resources"].items():
+            if key == "/XObject":
+                xobjects.update(value.get_object())
+            elif key == "/Font":
+                fonts.update(value.get_object())
+            else:
+                resources[NameObject(key)] = value
+
+    overlay_name = OVERLAY_NAME
+    index = 0
+    while overlay_name in xobjects:
+        index += 1
+        overlay_name = f"{OVERLAY_NAME}{index}"
+    font_prefix = FONT_NAME_PREFIX
+    index = 0
+    while any(str(name).startswith(font_prefix) for name in fonts):
+        index += 1
+        font_prefix = f"{FONT_NAME_PREFIX}{index}_"
+
+    entries = DictionaryObject()
+    for key in page.keys():
+        if key not in ("/Contents", "/Resources"):
+            entries[NameObject(key)] = page.raw_get(key)
+
+    width, height = cached_template.page_sizes[page_num]
+    return PagePatch(
+        idnum=reference.idnum,
+        generation=reference.generation,
+        entries=entries,
+        contents=contents,
+        resources=resources,
+        xobjects=xobjects,
+        fonts=fonts,
+        overlay_name=NameObject(overlay_name),
+        font_prefix=font_prefix,
+        width=width,
+        height=height,
+    )
+
+
+def write_incremental_update(cached_template, patches: Dict[int, PagePatch],
+                             overlays: Dict[int, Union["PageObject", DirectText]], output: BinaryIO):
+    """
+    写出模板原始字节，并追加替换 overlays 中各页的增量更新
+    patches 为这些页面的 PagePatch，overlays 为 {页码: 覆盖层页面或直接绘制的文本}
+    """
+    data = cached_template.data
+    output.write(data)
+    position = len(data)
+    if not data.endswith(b"\n"):
+        output.write(b"\n")
+        position += 1
+    if not overlays:
+        return
+
+    writer = PdfObjectWriter(output, position, cached_template.xref_size)
+    memo = {}
+    # 直接绘制文本用到的字体，每个输出文件只写一次
+    font_refs = {}
+    # 原内容流放在 q/Q 之间，原内容中未恢复的图形状态不会影响新增的内容
+    save_state = writer.add_object(flate_stream(b"q\n"))
+    for page_num in sorted(overlays):
+        overlay = overlays[page_num]
+        patch = patches[page_num]
+        xobjects = DictionaryObject(patch.xobjects)
+        fonts = DictionaryObject(patch.fonts)
+
+        if isinstance(overlay, DirectText):
+            # 文本绘制指令直接追加到页面内容流中
+            resource_names = {}
+            for run in overlay.runs:
+                if run.font_name not in resource_names:
+                    if run.font_name not in font_refs:
+                        font_refs[run.font_name] = writer.add_object(get_direct_font(run.font_name).font_dict)
+                    resource_names[run.font_name] = f"{patch.font_prefix}{len(resource_names)}"
+                    fonts[NameObject(resource_names[run.font_name])] = font_refs[run.font_name]
+            content = b"\nQ\n" + text_operators(overlay, resource_names)
+        else:
+            overlay_contents = overlay.get_contents()
+            form_entries = {
+                "/Type": NameObject("/XObject"),
+                "/Subtype": NameObject("/Form"),
+                "/BBox": ArrayObject([FloatObject(0), FloatObject(0), FloatObject(patch.width), FloatObject(patch.height)]),
+            }
+            if "/Resources" in overlay:
+                form_entries["/Resources"] = writer.import_object(overlay.raw_get("/Resources"), memo)
+            xobjects[patch.overlay_name] = writer.add_object(flate_stream(
+                overlay_contents.get_data() if overlay_contents is not None else b"", form_entries
+            ))
+            content = b"\nQ\nq " + patch.overlay_name.encode() + b" Do Q\n"
+
+        resources = DictionaryObject(patch.resources)
+        if xobjects:
+            resources[NameObject("/XObject")] = xobjects
+        if fonts:
+            resources[NameObject("/Font")] = fonts
+        page = DictionaryObject(patch.entries)
+        page[NameObject("/Resources")] = resources
+        page[NameObject("/Contents")] = ArrayObject([save_state, *patch.contents, writer.add_object(flate_stream(content))])
+        writer.replace_object(patch.idnum, patch.generation, page)
+
+    trailer = DictionaryObject()
+    for key, value in cached_template.trailer_entries.items():
+        trailer[NameObject(key)] = value
+    trailer[NameObject("/Prev")] = NumberObject(cached_template.startxref)
+    writer.write_xref(trailer)
@@ -0,0 +1,534 @@
+"""
+导出作业队列
+导出作业保存在数据库的 export_jobs 表中，工作进程（python -m app.worker，或Web进程内嵌的工作线程）
+领取作业时获得一段时间的租约，执行期间通过心跳续期；进程崩溃后租约到期，作业重新排队。
+内容相同（dedup_key 相同）的导出只执行一次：已有完成的结果时直接复用，正在执行时附加到该作业上等待结果
+"""
+import os
+import socket
+import logging
+import threading
+import traceback
+from contextlib import ExitStack
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+from app.database import SessionLocal
+from app.models import ExportJob, Task
+from app.services.export_progress import ExportCancelled
+from app.services.export_scheduler import ExportBusy, export_scheduler, job_priority
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+import config
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_JOB_STATUSES = ("queued", "running")
+# 附加到其他作业、等待其结果的作业状态
+ATTACHED_STATUS = "attached"
+# 只重新导出失败教师的作业类型
+RETRY_KIND = "retry"
+
+
+def _estimate_queue_wait(db: Session, active_jobs: int) -> int:
+    """按最近作业的平均耗时估算排队等待秒数"""
+    recent_jobs = db.query(ExportJob.started_at, ExportJob.finished_at).filter(
+        ExportJob.status == "done",
+        ExportJob.started_at.isnot(None),
+        ExportJob.finished_at.isnot(None)
+    ).order_by(ExportJob.id.desc()).limit(20).all()
+    durations = [(finished - started).total_seconds() for started, finished in recent_jobs]
+    average = sum(durations) / len(durations) if durations else 30.0
+    seconds = average * active_jobs / max(1, config.EXPORT_JOB_CONCURRENCY)
+    return max(1, min(int(seconds) + 1, 600))
+
+
+def ensure_queue_capacity(db: Session):
+    """排队中和执行中的作业已达上限时抛出 ExportBusy（创建任务等操作前先检查）"""
+    active_jobs = db.query(ExportJob).filter(ExportJob.status.in_(ACTIVE_JOB_STATUSES)).count()
+    if active_jobs >= config.EXPORT_MAX_QUEUED_JOBS:
+        raise ExportBusy("导出队列已满，请稍后重试", _estimate_queue_wait(db, active_jobs))
+
+
+def _export_succeeded(task: Task) -> bool:
+    """任务的导出结果中所有教师都成功（没有结果清单时无法确认，视为不完整）"""
+    manifest = task.export_manifest or {}
+    return bool(manifest) and all(item.get("status") == "ok" for item in manifest.values())
+
+
+def _find_finished_export(db: Session, dedup_key: str) -> Optional[ExportJob]:
+    """最近一次内容相同、已完成、没有失败教师且导出文件仍存在的作业"""
+    finished_jobs = db.query(ExportJob).join(Task, Task.id == ExportJob.task_id).filter(
+        ExportJob.dedup_key == dedup_key,
+        ExportJob.status == "done",
+        Task.status == "completed",
+        Task.export_path.isnot(None)
+    ).order_by(ExportJob.id.desc()).limit(5).all()
+    for finished_job in finished_jobs:
+        task = db.query(Task).filter(Task.id == finished_job.task_id).first()
+        # 有教师失败的导出文件不完整，不复用（否则新任务没有失败记录，无法重试）
+        if _export_succeeded(task) and Path(task.export_path).exists():
+            return finished_job
+    return None
+
+
+def _complete_from(db: Session, task: Task, source_task: Task):
+    """任务直接使用另一个任务的导出结果（共享同一个ZIP文件，以及结果清单、进度和各阶段耗时）"""
+    task.export_path = source_task.export_path
+    task.render_fingerprints = source_task.render_fingerprints
+    task.export_manifest = dict(source_task.export_manifest) if source_task.export_manifest is not None else None
+    task.progress_total = source_task.progress_total
+    task.progress_processed = source_task.progress_processed
+    task.progress_failed = source_task.progress_failed
+    task.stage_timings = source_task.stage_timings
+    task.status = "completed"
+    task.completed_at = datetime.now()
+
+
+def enqueue_export(db: Session, task_id: int, teacher_ids: List[int], dedup_key: Optional[str] = None) -> ExportJob:
+    """
+    为任务创建一个导出作业
+    - 任务已有排队中/执行中的作业时直接返回该作业（重复提交）
+    - 提供 dedup_key 时：相同内容已导出完成则直接复用其文件；正在导出则附加到该作业，完成后共享结果
+    - 否则新建排队中的作业，教师较少的作业优先执行；队列已满时抛出 ExportBusy
+    """
+    existing_job = db.query(ExportJob).filter(
+        ExportJob.task_id == task_id,
+        ExportJob.status.in_(ACTIVE_JOB_STATUSES + (ATTACHED_STATUS,))
+    ).first()
+    if existing_job:
+        return existing_job
+
+    if dedup_key:
+        finished_job = _find_finished_export(db, dedup_key)
+        if finished_job:
+            task = db.query(Task).filter(Task.id == task_id).first()
+            _complete_from(db, task, db.query(Task).filter(Task.id == finished_job.task_id).first())
+            job = ExportJob(task_id=task_id, teacher_ids=list(teacher_ids), status="done", dedup_key=dedup_key,
+                            parent_job_id=finished_job.id, finished_at=datetime.now())
+            db.add(job)
+            db.commit()
+            logger.info("任务 %d 复用作业 %d 已完成的导出文件", task_id, finished_job.id)
+            return job
+
+        primary_job = db.query(ExportJob).filter(
+            ExportJob.dedup_key == dedup_key,
+            ExportJob.status.in_(ACTIVE_JOB_STATUSES)
+        ).order_by(ExportJob.id).first()
+        if primary_job:
+            job = ExportJob(task_id=task_id, teacher_ids=list(teacher_ids), status=ATTACHED_STATUS,
+                            dedup_key=dedup_key, parent_job_id=primary_job.id, priority=primary_job.priority)
+            db.add(job)
+            db.commit()
+            logger.info("任务 %d 附加到正在执行的相同导出作业 %d", task_id, primary_job.id)
+            return job
+
+    ensure_queue_capacity(db)
+    job = ExportJob(task_id=task_id, teacher_ids=list(teacher_ids), status="queued",
+                    priority=job_priority(len(teacher_ids)), dedup_key=dedup_key)
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    logger.info("导出作业 %d 已排队（任务 %d，教师 %d 位）", job.id, task_id, len(job.teacher_ids))
+    return job
+
+
+def enqueue_retry(db: Session, task_id: int, teacher_ids: List[int]) -> ExportJob:
+    """
+    为已完成的任务创建重试作业：只重新导出失败的教师，追加到已有的导出ZIP中
+    任务已有排队中/执行中的作业时直接返回该作业；队列已满时抛出 ExportBusy
+    """
+    existing_job = get_active_job(db, task_id)
+    if existing_job:
+        return existing_job
+
+    ensure_queue_capacity(db)
+    job = ExportJob(task_id=task_id, teacher_ids=list(teacher_ids), kind=RETRY_KIND, status="queued",
+                    priority=job_priority(len(teacher_ids)))
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    logger.info("重试作业 %d 已排队（任务 %d，失败的教师 %d 位）", job.id, task_id, len(job.teacher_ids))
+    return job
+
+
+def _settle_attached_jobs(db: Session, primary_job_id: int, status: str):
+    """
+    主作业结束后处理附加在它上面的作业
+    完成：共享导出文件；失败：一起标记失败；取消：附加的任务仍需要导出，改为独立排队
+    """
+    attached_jobs = db.query(ExportJob).filter(
+        ExportJob.parent_job_id == primary_job_id,
+        ExportJob.status == ATTACHED_STATUS
+    ).all()
+    if not attached_jobs:
+        return
+    primary_job = db.query(ExportJob).filter(ExportJob.id == primary_job_id).first()
+    primary_task = db.query(Task).filter(Task.id == primary_job.task_id).first() if primary_job else None
+    now = datetime.now()
+    for attached_job in attached_jobs:
+        task = db.query(Task).filter(Task.id == attached_job.task_id).first()
+        if status == "done" and primary_task is not None and primary_task.export_path:
+            attached_job.status = "done"
+            attached_job.finished_at = now
+            if task:
+                _complete_from(db, task, primary_task)
+        elif status == "failed":
+            attached_job.status = "failed"
+            attached_job.error = f"附加的导出作业 {primary_job_id} 失败"
+            attached_job.finished_at = now
+            if task and task.status == "processing":
+                task.status = "failed"
+        else:
+            attached_job.status = "queued"
+            attached_job.parent_job_id = None
+    db.commit()
+    logger.info("作业 %d 结束（%s），已处理附加的 %d 个作业", primary_job_id, status, len(attached_jobs))
+
+
+def get_active_job(db: Session, task_id: int) -> Optional[ExportJob]:
+    """任务当前排队中或执行中的作业"""
+    return db.query(ExportJob).filter(
+        ExportJob.task_id == task_id,
+        ExportJob.status.in_(ACTIVE_JOB_STATUSES)
+    ).order_by(ExportJob.id.desc()).first()
+
+
+def export_teacher_ids(db: Session, task_id: int) -> Optional[List[int]]:
+    """
+    任务最近一次导出作业要导出的教师ID（完成问卷后导出的任务只包含已填写或确认的教师）
+    任务还没有导出作业时返回None
+    """
+    job = db.query(ExportJob).filter(
+        ExportJob.task_id == task_id,
+        or_(ExportJob.kind.is_(None), ExportJob.kind != RETRY_KIND)
+    ).order_by(ExportJob.id.desc()).first()
+    if job is None:
+        return None
+    return [int(tid) for tid in job.teacher_ids or [] if tid is not None]
+
+
+def claim_next_job(db: Session, worker_id: str) -> Optional[ExportJob]:
+    """
+    领取优先级最高、排队最早的作业
+    先查出候选作业，再以"状态仍为queued"为条件更新；其他工作进程抢先领取时更新0行，换下一个候选
+    """
+    while True:
+        candidate = db.query(ExportJob.id).filter(
+            ExportJob.status == "queued"
+        ).order_by(ExportJob.priority, ExportJob.id).first()
+        if candidate is None:
+            return None
+        now = datetime.now()
+        claimed = db.query(ExportJob).filter(
+            ExportJob.id == candidate.id,
+            ExportJob.status == "queued"
+        ).update({
+            ExportJob.status: "running",
+            ExportJob.lease_owner: worker_id,
+            ExportJob.lease_expires_at: now + timedelta(seconds=config.EXPORT_JOB_LEASE_SECONDS),
+            ExportJob.heartbeat_at: now,
+            ExportJob.started_at: now,
+            ExportJob.attempts: ExportJob.attempts + 1,
+        }, synchronize_session=False)
+        db.commit()
+        if claimed:
+            return db.query(ExportJob).filter(ExportJob.id == candidate.id).first()
+
+
+def release_job(db: Session, job_id: int, worker_id: str) -> bool:
+    """把已领取但还没有开始执行的作业放回队列（不计入领取次数），返回是否放回"""
+    released = db.query(ExportJob).filter(
+        ExportJob.id == job_id,
+        ExportJob.status == "running",
+        ExportJob.lease_owner == worker_id
+    ).update({
+        ExportJob.status: "queued",
+        ExportJob.lease_owner: None,
+        ExportJob.lease_expires_at: None,
+        ExportJob.heartbeat_at: None,
+        ExportJob.started_at: None,
+        ExportJob.attempts: ExportJob.attempts - 1,
+    }, synchronize_session=False)
+    db.commit()
+    return bool(released)
+
+
+def renew_lease(db: Session, job_id: int, worker_id: str) -> bool:
+    """心跳：延长租约，返回租约是否仍属于该工作进程"""
+    now = datetime.now()
+    renewed = db.query(ExportJob).filter(
+        ExportJob.id == job_id,
+        ExportJob.status == "running",
+        ExportJob.lease_owner == worker_id
+    ).update({
+        ExportJob.heartbeat_at: now,
+        ExportJob.lease_expires_at: now + timedelta(seconds=config.EXPORT_JOB_LEASE_SECONDS),
+    }, synchronize_session=False)
+    db.commit()
+    return bool(renewed)
+
+
+def requeue_expired_jobs(db: Session) -> int:
+    """
+    把租约已到期的执行中作业重新排队（工作进程崩溃或重启后遗留的作业）
+    已领取次数达到上限的作业标记为失败，对应任务也标记为失败
+    返回重新排队的作业数
+    """
+    now = datetime.now()
+    expired_jobs = db.query(ExportJob).filter(
+        ExportJob.status == "running",
+        or_(ExportJob.lease_expires_at.is_(None), ExportJob.lease_expires_at < now)
+    ).all()
+    requeued = 0
+    for job in expired_jobs:
+        if (job.attempts or 0) >= config.EXPORT_JOB_MAX_ATTEMPTS:
+            job.status = "failed"
+            job.error = f"工作进程 {job.lease_owner} 的租约到期，已重试 {job.attempts} 次"
+            job.finished_at = now
+            task = db.query(Task).filter(Task.id == job.task_id).first()
+            if task and task.status == "processing":
+                task.status = "failed"
+            db.commit()
+            _settle_attached_jobs(db, job.id, "failed")
+            logger.warning("导出作业 %d 多次中断，标记为失败", job.id)
+        else:
+            logger.warning("导出作业 %d 的租约已到期（%s），重新排队", job.id, job.lease_owner)
+            job.status = "queued"
+            job.lease_owner = None
+            job.lease_expires_at = None
+            requeued += 1
+    db.commit()
+    return requeued
+
+
+def cancel_queued_job(db: Session, task_id: int) -> bool:
+    """取消尚未开始执行（排队中或附加在其他作业上）的作业，返回是否取消成功"""
+    queued_job_ids = [job_id for job_id, in db.query(ExportJob.id).filter(
+        ExportJob.task_id == task_id,
+        ExportJob.status == "queued"
+    ).all()]
+    cancelled = db.query(ExportJob).filter(
+        ExportJob.task_id == task_id,
+        ExportJob.status.in_(("queued", ATTACHED_STATUS))
+    ).update({
+        ExportJob.status: "cancelled",
+        ExportJob.finished_at: datetime.now(),
+    }, synchronize_session=False)
+    db.commit()
+    for job_id in queued_job_ids:
+        _settle_attached_jobs(db, job_id, "cancelled")
+    return bool(cancelled)
+
+
+def delete_task_jobs(db: Session, task_id: int):
+    """
+    删除任务的所有导出作业（删除任务前调用，随删除任务一起提交）
+    附加在这些作业上的其他任务改为独立排队；正在执行的作业在下一次检查取消时停止（任务已不存在视为已取消）
+    """
+    job_ids = [job_id for job_id, in db.query(ExportJob.id).filter(ExportJob.task_id == task_id).all()]
+    if not job_ids:
+        return
+    db.query(ExportJob).filter(
+        ExportJob.parent_job_id.in_(job_ids),
+        ExportJob.status == ATTACHED_STATUS
+    ).update({
+        ExportJob.status: "queued",
+        ExportJob.parent_job_id: None,
+    }, synchronize_session=False)
+    db.query(ExportJob).filter(ExportJob.task_id == task_id).delete(synchronize_session=False)
+    logger.info("已删除任务 %d 的 %d 个导出作业", task_id, len(job_ids))
+
+
+def _finish_job(db: Session, job_id: int, worker_id: str, status: str, error: Optional[str] = None):
+    """结束作业（租约已被其他工作进程接管时不覆盖）"""
+    db.query(ExportJob).filter(
+        ExportJob.id == job_id,
+        ExportJob.lease_owner == worker_id
+    ).update({
+        ExportJob.status: status,
+        ExportJob.error: error,
+        ExportJob.finished_at: datetime.now(),
+        ExportJob.lease_expires_at: None,
+    }, synchronize_session=False)
+    db.commit()
+    _settle_attached_jobs(db, job_id, status)
+
+
+def _update_task(db: Session, task_id: int, values: dict) -> bool:
+    """更新任务记录，返回任务是否仍存在（执行期间任务可能已被删除）"""
+    updated = db.query(Task).filter(Task.id == task_id).update(values, synchronize_session=False)
+    db.commit()
+    return bool(updated)
+
+
+def run_job(db: Session, job: ExportJob, worker_id: str):
+    """执行一个已领取的导出作业，并更新任务状态"""
+    from app.services.export_service import batch_export, create_empty_export
+
+    job_id, task_id = job.id, job.task_id
+    task = db.query(Task).filter(Task.id == task_id).first()
+    if task is None:
+        _finish_job(db, job_id, worker_id, "failed", "任务不存在")
+        return
+
+    if job.kind == RETRY_KIND:
+        _run_retry_job(db, job_id, task, worker_id)
+        return
+
+    logger.info("开始执行导出作业 %d：任务 %d（%s）", job_id, task_id, task.name)
+    try:
+        if job.teacher_ids:
+            export_path = batch_export(
+                template_id=task.template_id,
+                teacher_ids=job.teacher_ids,
+                db=db,
+                task_name=task.name,
+                task_id=task_id,
+                incremental=config.EXPORT_INCREMENTAL,
+                output_format=task.output_format or "zip"
+            )
+        else:
+            # 没有教师完成填写时生成只有说明文件的ZIP
+            export_path = create_empty_export(task.name)
+        if not _update_task(db, task_id, {
+            Task.export_path: export_path,
+            Task.status: "completed",
+            Task.completed_at: datetime.now(),
+        }):
+            # 导出期间任务被删除，生成的文件不再需要
+            Path(export_path).unlink(missing_ok=True)
+            _finish_job(db, job_id, worker_id, "cancelled", "任务已删除")
+            logger.info("导出作业 %d 的任务已删除，丢弃导出文件", job_id)
+            return
+        _finish_job(db, job_id, worker_id, "done")
+        logger.info("导出作业 %d 完成，文件路径: %s", job_id, export_path)
+    except ExportCancelled:
+        db.rollback()
+        _update_task(db, task_id, {Task.status: "cancelled", Task.completed_at: None})
+        _finish_job(db, job_id, worker_id, "cancelled")
+        logger.info("导出作业 %d 已取消", job_id)
+    except Exception as e:
+        logger.exception("导出作业 %d 失败: %s", job_id, e)
+        db.rollback()
+        _update_task(db, task_id, {Task.status: "failed"})
+        _finish_job(db, job_id, worker_id, "failed", f"{e}\n{traceback.format_exc()}")
+
+
+def _run_retry_job(db: Session, job_id: int, task: Task, worker_id: str):
+    """执行重试作业（任务状态不变，失败时原导出文件保持不变）"""
+    from app.services.export_service import retry_failed_teachers
+
+    logger.info("开始执行重试作业 %d：任务 %d（%s）", job_id, task.id, task.name)
+    try:
+        result = retry_failed_teachers(task, db)
+        _finish_job(db, job_id, worker_id, "done")
+        logger.info("重试作业 %d 完成：重试 %d 位，成功 %d 位，仍失败 %d 位",
+                    job_id, result["retried"], result["succeeded"], result["failed"])
+    except Exception as e:
+        logger.exception("重试作业 %d 失败: %s", job_id, e)
+        db.rollback()
+        _finish_job(db, job_id, worker_id, "failed", f"{e}\n{traceback.format_exc()}")
+
+
+class _Heartbeat(threading.Thread):
+    """执行作业期间定期续租（使用独立的数据库会话）"""
+
+    def __init__(self, job_id: int, worker_id: str):
+        super().__init__(name=f"export-heartbeat-{job_id}", daemon=True)
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(config.EXPORT_JOB_HEARTBEAT_SECONDS):
+            db = SessionLocal()
+            try:
+                if not renew_lease(db, self.job_id, self.worker_id):
+                    logger.warning("导出作业 %d 的租约已失效", self.job_id)
+                    return
+            except Exception as e:
+                logger.warning("导出作业 %d 心跳失败: %s", self.job_id, e)
+            finally:
+                db.close()
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class ExportWorker:
+    """
+    导出工作者：concurrency 个线程循环领取并执行作业
+    渲染本身由 batch_export 分发到进程池，线程数只决定同时执行的导出作业数；
+    执行前还需要获得本进程导出调度的名额（名额按进程计算，见 export_scheduler）
+    """
+
+    def __init__(self, concurrency: Optional[int] = None, poll_interval: Optional[float] = None):
+        self.concurrency = max(1, concurrency or config.EXPORT_JOB_CONCURRENCY)
+        self.poll_interval = poll_interval or config.EXPORT_JOB_POLL_SECONDS
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop_event = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        """启动工作线程（先把遗留的作业重新排队）"""
+        db = SessionLocal()
+        try:
+            requeued = requeue_expired_jobs(db)
+            if requeued:
+                logger.info("已重新排队 %d 个中断的导出作业", requeued)
+        finally:
+            db.close()
+
+        for index in range(self.concurrency):
+            thread = threading.Thread(target=self._run_loop, name=f"export-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info("导出工作者 %s 已启动，并发作业数: %d", self.worker_id, self.concurrency)
+
+    def stop(self, timeout: Optional[float] = None):
+        """停止领取新作业，等待正在执行的作业结束"""
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def wait(self):
+        """阻塞直到所有工作线程退出"""
+        for thread in self._threads:
+            while thread.is_alive():
+                thread.join(1.0)
+
+    def _run_loop(self):
+        while not self._stop_event.is_set():
+            db = SessionLocal()
+            try:
+                requeue_expired_jobs(db)
+                job = claim_next_job(db, self.worker_id)
+                if job is None:
+                    db.close()
+                    self._stop_event.wait(self.poll_interval)
+                    continue
+                priority = job.priority if job.priority is not None else job_priority(len(job.teacher_ids or []))
+                heartbeat = _Heartbeat(job.id, self.worker_id)
+                heartbeat.start()
+                try:
+                    with ExitStack() as stack:
+                        # 与同一进程内的单个教师下载等请求共用调度名额，批量作业不会占满全部名额
+                        try:
+                            stack.enter_context(export_scheduler.slot(priority))
+                        except ExportBusy as e:
+                            # 交互式请求过多时把作业放回队列，稍后重新领取（不计入重试次数）
+                            release_job(db, job.id, self.worker_id)
+                            logger.info("导出繁忙，作业 %d 放回队列: %s", job.id, e)
+                            self._stop_event.wait(self.poll_interval)
+                            continue
+                        run_job(db, job, self.worker_id)
+                finally:
+                    heartbeat.stop()
+            except Exception as e:
+                logger.exception("导出工作线程出错: %s", e)
+                self._stop_event.wait(self.poll_interval)
+            finally:
+                db.close()
@@ -0,0 +1,232 @@
+"""
+任务/问卷成员关联
+tasks.teacher_ids、questionnaires.teacher_ids 是JSON数组，按教师查找任务、检查教师是否在问卷中都需要逐个解析。
+task_teachers、questionnaire_teachers 关联表按 (教师ID, 任务/问卷ID) 建索引，这些查询只需一次索引查询。
+过渡期间 teacher_ids 仍然保存（导出等按任务读取教师列表的地方继续使用），写入任务/问卷时同时写入关联表。
+问卷分享链接（share_token）解析结果在进程内缓存，教师身份验证和确认不再每次按token查询问卷
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple, Any, NamedTuple
+from sqlalchemy import or_
+from sqlalchemy.orm import Session, Query
+from app.models import Task, TaskTeacher, Questionnaire, QuestionnaireTeacher, QuestionnaireResponse
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+import config
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_teacher_ids(teacher_ids: Iterable) -> List[int]:
+    """JSON中的教师ID转换为整数并去重（保持原顺序，忽略None）"""
+    result = []
+    seen = set()
+    for tid in teacher_ids or []:
+        if tid is None:
+            continue
+        tid = int(tid)
+        if tid not in seen:
+            seen.add(tid)
+            result.append(tid)
+    return result
+
+
+def set_task_teachers(task: Task, teacher_ids: Iterable):
+    """设置任务的教师列表：同时写入 teacher_ids 和关联表（随任务一起提交）"""
+    task.teacher_ids = list(teacher_ids or [])
+    task.teacher_links = [TaskTeacher(teacher_id=tid) for tid in normalize_teacher_ids(task.teacher_ids)]
+
+
+def teacher_tasks_query(db: Session, teacher_id: int) -> Query:
+    """包含该教师的任务（按创建时间倒序）"""
+    return db.query(Task).join(TaskTeacher, TaskTeacher.task_id == Task.id).filter(
+        TaskTeacher.teacher_id == teacher_id
+    ).order_by(Task.created_at.desc())
+
+
+def is_task_teacher(db: Session, task_id: int, teacher_id: int) -> bool:
+    """教师是否在任务的教师列表中"""
+    return db.query(TaskTeacher.task_id).filter(
+        TaskTeacher.task_id == task_id,
+        TaskTeacher.teacher_id == teacher_id
+    ).first() is not None
+
+
+def set_questionnaire_teachers(questionnaire: Questionnaire, teacher_ids: Iterable):
+    """设置问卷的教师列表：同时写入 teacher_ids 和关联表（随问卷一起提交）"""
+    questionnaire.teacher_ids = list(teacher_ids or [])
+    questionnaire.teacher_links = [
+        QuestionnaireTeacher(teacher_id=tid) for tid in normalize_teacher_ids(questionnaire.teacher_ids)
+    ]
+
+
+def is_questionnaire_teacher(db: Session, questionnaire_id: int, teacher_id: int) -> bool:
+    """教师是否在问卷的教师列表中"""
+    return db.query(QuestionnaireTeacher.questionnaire_id).filter(
+        QuestionnaireTeacher.questionnaire_id == questionnaire_id,
+        QuestionnaireTeacher.teacher_id == teacher_id
+    ).first() is not None
+
+
+def task_questionnaire(db: Session, task_id: int) -> Optional[Questionnaire]:
+    """与任务关联的问卷：第一个（按ID）与任务有共同教师的问卷"""
+    questionnaire_id = db.query(QuestionnaireTeacher.questionnaire_id).join(
+        TaskTeacher, TaskTeacher.teacher_id == QuestionnaireTeacher.teacher_id
+    ).filter(
+        TaskTeacher.task_id == task_id
+    ).order_by(QuestionnaireTeacher.questionnaire_id).limit(1).scalar()
+    if questionnaire_id is None:
+        return None
+    return db.query(Questionnaire).filter(Questionnaire.id == questionnaire_id).first()
+
+
+def _completed_response():
+    """已提交或已确认的回答"""
+    return or_(QuestionnaireResponse.submitted_at.isnot(None), QuestionnaireResponse.confirmed_status == "confirmed")
+
+
+def completed_task_teacher_ids(db: Session, questionnaire_id: int, task_id: int) -> List[int]:
+    """任务中已提交或已确认问卷的教师ID（按ID排序）"""
+    rows = db.query(TaskTeacher.teacher_id).join(
+        QuestionnaireResponse,
+        (QuestionnaireResponse.teacher_id == TaskTeacher.teacher_id)
+        & (QuestionnaireResponse.questionnaire_id == questionnaire_id)
+    ).filter(
+        TaskTeacher.task_id == task_id,
+        _completed_response()
+    ).distinct().order_by(TaskTeacher.teacher_id).all()
+    return [teacher_id for teacher_id, in rows]
+
+
+def pending_teacher_ids(db: Session, questionnaire_id: int) -> List[int]:
+    """催填名单：问卷中还没有提交或确认的教师ID（按ID排序）"""
+    completed = db.query(QuestionnaireResponse.teacher_id).filter(
+        QuestionnaireResponse.questionnaire_id == questionnaire_id,
+        _completed_response()
+    )
+    rows = db.query(QuestionnaireTeacher.teacher_id).filter(
+        QuestionnaireTeacher.questionnaire_id == questionnaire_id,
+        ~QuestionnaireTeacher.teacher_id.in_(completed)
+    ).order_by(QuestionnaireTeacher.teacher_id).all()
+    return [teacher_id for teacher_id, in rows]
+
+
+class SharedQuestionnaire(NamedTuple):
+    """分享链接对应的问卷（缓存的只读快照）"""
+    id: int
+    title: str
+    fields: Any
+
+
+class ShareTokenCache:
+    """
+    share_token → 问卷 的LRU缓存（带有效期）
+    问卷只有标题和字段定义会被缓存，状态变化或token变化时调用 invalidate；
+    多个进程各自缓存，有效期限制了其他进程中旧数据的存在时间。找不到的token不缓存
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, SharedQuestionnaire]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve(self, db: Session, share_token: str) -> Optional[SharedQuestionnaire]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(share_token)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(share_token)
+                    return entry[1]
+                del self._entries[share_token]
+
+        row = db.query(Questionnaire.id, Questionnaire.title, Questionnaire.fields).filter(
+            Questionnaire.share_token == share_token
+        ).first()
+        if row is None:
+            return None
+        questionnaire = SharedQuestionnaire(*row)
+
+        with self._lock:
+            self._entries[share_token] = (now + self.ttl, questionnaire)
+            self._entries.move_to_end(share_token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return questionnaire
+
+    def invalidate(self, share_token: Optional[str]):
+        if not share_token:
+            return
+        with self._lock:
+            self._entries.pop(share_token, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+share_token_cache = ShareTokenCache(config.SHARE_TOKEN_CACHE_SIZE, config.SHARE_TOKEN_CACHE_TTL)
+
+
+def resolve_share_token(db: Session, share_token: str) -> Optional[SharedQuestionnaire]:
+    """按分享链接token查找问卷（带缓存），不存在时返回None"""
+    return share_token_cache.resolve(db, share_token)
+
+
+def _insert_ignore(db: Session, table):
+    """忽略主键冲突的插入语句（多个进程同时回填时，其他进程已写入的关联记录直接跳过）"""
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+        return insert(table).on_conflict_do_nothing()
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+        return insert(table).on_conflict_do_nothing()
+    from sqlalchemy import insert
+    statement = insert(table)
+    if dialect == "mysql":
+        statement = statement.prefix_with("IGNORE")
+    return statement
+
+
+def _backfill(db: Session, owner_model, link_model, owner_column: str) -> int:
+    """由 owner_model.teacher_ids 回填 link_model（只处理还没有关联记录的记录），返回回填的记录数"""
+    link_owner_id = getattr(link_model, owner_column)
+    linked = db.query(link_owner_id).distinct()
+    rows = db.query(owner_model.id, owner_model.teacher_ids).filter(~owner_model.id.in_(linked)).all()
+    links = []
+    count = 0
+    for owner_id, teacher_ids in rows:
+        owner_links = [{owner_column: owner_id, "teacher_id": tid} for tid in normalize_teacher_ids(teacher_ids)]
+        if owner_links:
+            links.extend(owner_links)
+            count += 1
+    if links:
+        db.execute(_insert_ignore(db, link_model.__table__), links)
+    db.commit()
+    return count
+
+
+def backfill_task_teachers(db: Session) -> int:
+    """
+    由 tasks.teacher_ids 回填关联表（只处理还没有关联记录的任务，可重复执行），返回回填的任务数
+    """
+    count = _backfill(db, Task, TaskTeacher, "task_id")
+    if count:
+        logger.info("已回填 %d 个任务的教师关联", count)
+    return count
+
+
+def backfill_questionnaire_teachers(db: Session) -> int:
+    """
+    由 questionnaires.teacher_ids 回填关联表（只处理还没有关联记录的问卷，可重复执行），返回回填的问卷数
+    """
+    count = _backfill(db, Questionnaire, QuestionnaireTeacher, "questionnaire_id")
+    if count:
+        logger.info("已回填 %d 个问卷的教师关联", count)
+    return count
@@ -0,0 +1,120 @@
+"""
+合并PDF输出
+把所有教师的页面写成一个可直接打印的PDF：
+模板页面转换为表单XObject只写一次，所有教师的页面共同引用（背景内容、字体和图片不重复）；
+对象写出后即释放，内存中只保留交叉引用偏移量和页面对象号，教师数量再多内存占用也基本不变
+"""
+from typing import Dict, Optional, Tuple, BinaryIO, NamedTuple
+from app.services.pdf_object_writer import PdfObjectWriter, flate_stream
+
+try:
+    from PyPDF2 import PageObject
+    from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject
+    PDF_LIBRARIES_AVAILABLE = True
+except ImportError:
+    PDF_LIBRARIES_AVAILABLE = False
+
+# 页面内容流中引用模板背景的资源名
+BACKGROUND_NAME = "/TplBg"
+
+
+class Background(NamedTuple):
+    """已写出的模板页面背景"""
+    ref: "IndirectObject"
+    mediabox: "ArrayObject"
+    rotation: int
+
+
+class MergedPdfWriter(PdfObjectWriter):
+    """
+    流式PDF写入器
+    用法：先用 add_background 把每个模板页面写成共用的背景，再逐页 add_page，最后 close 写出页面树和交叉引用表
+    """
+
+    def __init__(self, stream: BinaryIO):
+        super().__init__(stream)
+        self._page_ids = []
+        self._write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        self._pages_id = self._reserve()
+
+    @property
+    def page_count(self) -> int:
+        return len(self._page_ids)
+
+    def add_background(self, page: "PageObject", memo: Dict[Tuple[int, int, int], int]) -> Background:
+        """
+        把模板页面写成表单XObject（页面内容和资源只写一次）
+        来源为缓存的模板时需在持有模板锁时调用
+        """
+        mediabox = ArrayObject(page.mediabox)
+        contents = page.get_contents()
+        entries = {
+            "/Type": NameObject("/XObject"),
+            "/Subtype": NameObject("/Form"),
+            "/BBox": mediabox,
+        }
+        resources = page.get("/Resources")
+        if resources is not None:
+            entries["/Resources"] = self.import_object(resources, memo)
+        form = flate_stream(contents.get_data() if contents is not None else b"", entries)
+        return Background(self.add_object(form), mediabox, page.rotation)
+
+    def add_page(self, background: Background, overlay: Optional["PageObject"] = None,
+                 overlay_memo: Optional[Dict[Tuple[int, int, int], int]] = None):
+        """
+        写出一个页面：先绘制共用的模板背景，再绘制该教师的覆盖层
+        同一批覆盖层（同一个来源PDF）应传入同一个 overlay_memo，共用的字体只写一次
+        """
+        content = b"q " + BACKGROUND_NAME.encode() + b" Do Q\n"
+        resources = DictionaryObject()
+        xobjects = DictionaryObject()
+        if overlay is not None:
+            memo = overlay_memo if overlay_memo is not None else {}
+            overlay_contents = overlay.get_contents()
+            if overlay_contents is not None:
+                content += overlay_contents.get_data()
+            overlay_resources = overlay.get("/Resources")
+            overlay_resources = overlay_resources.get_object() if overlay_resources is not None else {}
+            for key, value in overlay_resources.items():
+                if key == "/XObject":
+                    # 覆盖层自己的XObject（如签名图片）与背景放在同一个资源字典中
+                    for name, xobject in value.get_object().items():
+                        xobjects[NameObject(name)] = self.import_object(xobject, memo)
+                else:
+                    resources[NameObject(key)] = self.import_object(value, memo)
+        xobjects[NameObject(BACKGROUND_NAME)] = background.ref
+        resources[NameObject("/XObject")] = xobjects
+
+        page = DictionaryObject()
+        page[NameObject("/Type")] = NameObject("/Page")
+        page[NameObject("/Parent")] = self._ref(self._pages_id)
+        page[NameObject("/MediaBox")] = background.mediabox
+        page[NameObject("/Resources")] = resources
+        page[NameObject("/Contents")] = self.add_object(flate_stream(content))
+        if background.rotation:
+            page[NameObject("/Rotate")] = NumberObject(background.rotation)
+        self._page_ids.append(self.add_object(page).idnum)
+
+    def remove_pages_after(self, page_count: int):
+        """
+        撤销 page_count 之后添加的页面（如某位教师的页面只写了一部分时）
+        已写出的对象留在文件中，但不再被页面树引用
+        """
+        del self._page_ids[page_count:]
+
+    def close(self):
+        """写出页面树、目录、交叉引用表和文件尾"""
+        pages = DictionaryObject()
+        pages[NameObject("/Type")] = NameObject("/Pages")
+        pages[NameObject("/Kids")] = ArrayObject(self._ref(page_id) for page_id in self._page_ids)
+        pages[NameObject("/Count")] = NumberObject(len(self._page_ids))
+        self._write_object(self._pages_id, pages)
+
+        catalog = DictionaryObject()
+        catalog[NameObject("/Type")] = NameObject("/Catalog")
+        catalog[NameObject("/Pages")] = self._ref(self._pages_id)
+        catalog_ref = self.add_object(catalog)
+
+        trailer = DictionaryObject()
+        trailer[NameObject("/Root")] = catalog_ref
+        self.write_xref(trailer)
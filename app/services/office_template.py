@@ -0,0 +1,288 @@
+"""
+Word/Excel模板缓存
+docx/xlsx都是ZIP包：模板只解析一次，找出包含 {{字段}} 的XML节点
+（Word正文段落和表格单元格；Excel共享字符串、内联字符串和公式），其余XML预先序列化为字节片段。
+每位教师只复制并替换这些节点，与包内其他未改动的文件一起直接写入输出流，不再逐个重新解析和序列化整个模板
+"""
+import re
+import copy
+import threading
+import zipfile
+from collections import OrderedDict
+from io import BytesIO
+from typing import Dict, Any, List, Tuple, Callable, Union, BinaryIO, NamedTuple, Sequence
+from lxml import etree
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+import config
+from app.utils.hashing import file_content_hash
+from app.services.placeholder_plan import PLACEHOLDER_PATTERN, SubstitutionPlan
+
+# 序列化时替代占位节点的处理指令，分割出前后的字节片段
+_SLOT_TARGET = "tf-slot"
+_SLOT_SPLIT = re.compile(rb"<\?" + _SLOT_TARGET.encode() + rb" (\d+)\?>")
+
+_SPREADSHEET_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_CONTENT_TYPES_NS = "http://schemas.openxmlformats.org/package/2006/content-types"
+_XML_SPACE = "{http://www.w3.org/XML/1998/namespace}space"
+_SHARED_STRINGS_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"
+_WORKSHEET_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"
+
+
+def _tag(name: str) -> str:
+    return f"{{{_SPREADSHEET_NS}}}{name}"
+
+
+class Slot(NamedTuple):
+    """包含占位符的节点：原节点（不修改，每次复制后填写）、原文本、填写新文本的函数"""
+    node: Any
+    text: str
+    fill: Callable[[Any, str], None]
+
+
+class SlottedPart:
+    """包含占位符的XML部件：占位节点之间的字节片段已预先序列化"""
+
+    def __init__(self, root, slots: List[Slot]):
+        # 在树中复制节点再移除原节点，复制的节点保留原有的命名空间前缀（包括默认命名空间）
+        originals = [slot.node for slot in slots]
+        slots = [slot._replace(node=copy.deepcopy(slot.node)) for slot in slots]
+        for index, node in enumerate(originals):
+            node.getparent().replace(node, etree.ProcessingInstruction(_SLOT_TARGET, str(index)))
+        pieces = _SLOT_SPLIT.split(etree.tostring(root, encoding="UTF-8", standalone=True))
+        # 片段与占位节点交替出现（按文档顺序）
+        self.segments: List[bytes] = pieces[0::2]
+        self.slots: List[Slot] = [slots[int(index)] for index in pieces[1::2]]
+
+    def render(self, texts: Sequence[str]) -> bytes:
+        """texts 为各占位节点替换后的文本（与 slots 顺序一致）"""
+        chunks = [self.segments[0]]
+        for slot, text, segment in zip(self.slots, texts, self.segments[1:]):
+            node = copy.deepcopy(slot.node)
+            slot.fill(node, text)
+            chunks.append(etree.tostring(node, encoding="UTF-8", xml_declaration=False))
+            chunks.append(segment)
+        return b"".join(chunks)
+
+
+class OfficeTemplate:
+    """已解析的docx/xlsx模板：包内文件按原顺序保存，包含占位符的部件为 SlottedPart"""
+
+    def __init__(self, entries: List[Tuple[zipfile.ZipInfo, Union[bytes, SlottedPart]]]):
+        self.entries = [(info.filename, info.date_time, content) for info, content in entries]
+        self._parts = [(name, content) for name, _, content in self.entries if isinstance(content, SlottedPart)]
+        # 所有占位节点的文本编译为一个替换计划（按部件、节点顺序排列）
+        self.plan = SubstitutionPlan([slot.text for _, part in self._parts for slot in part.slots])
+
+    @property
+    def slot_count(self) -> int:
+        return len(self.plan.texts)
+
+    def _render(self, texts: List[str]) -> Dict[str, bytes]:
+        parts = {}
+        start = 0
+        for name, part in self._parts:
+            parts[name] = part.render(texts[start:start + len(part.slots)])
+            start += len(part.slots)
+        return parts
+
+    def render_parts(self, data: Dict[str, Any]) -> Dict[str, bytes]:
+        """生成一位教师的各个替换后的部件，返回 {包内文件名: 内容}"""
+        return self._render(self.plan.render(data))
+
+    def render_parts_batch(self, data_list: Sequence[Dict[str, Any]]) -> List[Dict[str, bytes]]:
+        """批量生成多位教师的替换后部件（与 data_list 顺序一致）"""
+        return [self._render(texts) for texts in self.plan.render_batch(data_list)]
+
+    def write(self, parts: Dict[str, bytes], output_path: Union[str, BinaryIO]):
+        """写出ZIP包：替换后的部件用 parts 中的内容，其余文件原样写入"""
+        with zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED) as package:
+            for name, date_time, content in self.entries:
+                info = zipfile.ZipInfo(name, date_time)
+                info.compress_type = zipfile.ZIP_DEFLATED
+                package.writestr(info, parts[name] if name in parts else content)
+
+
+def _read_entries(data: bytes) -> List[Tuple[zipfile.ZipInfo, bytes]]:
+    with zipfile.ZipFile(BytesIO(data)) as package:
+        return [(info, package.read(info)) for info in package.infolist()]
+
+
+def _fill_paragraph(node, text: str):
+    from docx.text.paragraph import Paragraph
+    Paragraph(node, None).text = text
+
+
+def _fill_cell(node, text: str):
+    from docx.table import _Cell
+    _Cell(node, None).text = text
+
+
+def build_docx_template(data: bytes) -> OfficeTemplate:
+    """
+    解析Word模板：正文段落和正文表格单元格中包含占位符的节点
+    （与逐个填充时的范围一致；合并单元格只处理一次）
+    """
+    from docx import Document
+    doc = Document(BytesIO(data))
+    slots = []
+    for paragraph in doc.paragraphs:
+        if PLACEHOLDER_PATTERN.search(paragraph.text):
+            slots.append(Slot(paragraph._p, paragraph.text, _fill_paragraph))
+    seen = set()
+    for table in doc.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                if cell._tc in seen:
+                    continue
+                seen.add(cell._tc)
+                if PLACEHOLDER_PATTERN.search(cell.text):
+                    slots.append(Slot(cell._tc, cell.text, _fill_cell))
+
+    part_name = str(doc.part.partname).lstrip("/")
+    entries = []
+    for info, content in _read_entries(data):
+        if info.filename == part_name and slots:
+            content = SlottedPart(doc.element, slots)
+        entries.append((info, content))
+    return OfficeTemplate(entries)
+
+
+def _rich_text(node) -> str:
+    """共享字符串/内联字符串的文本（<t> 及各格式段 <r><t> 的文本，不含注音）"""
+    texts = [t.text or "" for t in node.iterchildren(_tag("t"))]
+    for run in node.iterchildren(_tag("r")):
+        t = run.find(_tag("t"))
+        if t is not None:
+            texts.append(t.text or "")
+    return "".join(texts)
+
+
+def _fill_rich_text(node, text: str):
+    """写为单个纯文本（与 openpyxl 保存字符串的结果一致）"""
+    for child in list(node):
+        node.remove(child)
+    t = etree.SubElement(node, _tag("t"))
+    t.set(_XML_SPACE, "preserve")
+    t.text = text
+
+
+def _fill_value(node, text: str):
+    node.text = text
+
+
+def _fill_formula(node, text: str):
+    """替换公式文本，并移除缓存的计算结果"""
+    node.find(_tag("f")).text = text[1:] if text.startswith("=") else text
+    for value in node.findall(_tag("v")):
+        node.remove(value)
+
+
+def _worksheet_slots(root) -> List[Slot]:
+    slots = []
+    for cell in root.iter(_tag("c")):
+        formula = cell.find(_tag("f"))
+        if formula is not None:
+            # openpyxl 中公式单元格的值为 "=公式"
+            if formula.text and PLACEHOLDER_PATTERN.search(formula.text):
+                slots.append(Slot(cell, "=" + formula.text, _fill_formula))
+            continue
+        cell_type = cell.get("t")
+        if cell_type == "inlineStr":
+            node = cell.find(_tag("is"))
+            if node is not None and PLACEHOLDER_PATTERN.search(_rich_text(node)):
+                slots.append(Slot(node, _rich_text(node), _fill_rich_text))
+        elif cell_type == "str":
+            node = cell.find(_tag("v"))
+            if node is not None and node.text and PLACEHOLDER_PATTERN.search(node.text):
+                slots.append(Slot(node, node.text, _fill_value))
+    return slots
+
+
+def build_xlsx_template(data: bytes) -> OfficeTemplate:
+    """解析Excel模板：共享字符串、工作表中的内联字符串和公式中包含占位符的节点"""
+    entries = _read_entries(data)
+    content_types = {}
+    for info, content in entries:
+        if info.filename == "[Content_Types].xml":
+            for override in etree.fromstring(content).iter(f"{{{_CONTENT_TYPES_NS}}}Override"):
+                content_types[override.get("PartName", "").lstrip("/")] = override.get("ContentType")
+
+    result = []
+    for info, content in entries:
+        content_type = content_types.get(info.filename)
+        if content_type in (_SHARED_STRINGS_TYPE, _WORKSHEET_TYPE):
+            root = etree.fromstring(content)
+            if content_type == _SHARED_STRINGS_TYPE:
+                slots = [
+                    Slot(item, _rich_text(item), _fill_rich_text)
+                    for item in root.iterchildren(_tag("si"))
+                    if PLACEHOLDER_PATTERN.search(_rich_text(item))
+                ]
+            else:
+                slots = _worksheet_slots(root)
+            if slots:
+                content = SlottedPart(root, slots)
+        result.append((info, content))
+    return OfficeTemplate(result)
+
+
+_BUILDERS = {
+    ".docx": build_docx_template,
+    ".doc": build_docx_template,
+    ".xlsx": build_xlsx_template,
+    ".xls": build_xlsx_template,
+}
+
+
+class OfficeTemplateCache:
+    """LRU模板缓存，键为 (模板路径, 文件内容哈希)"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Tuple[str, str], OfficeTemplate]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, template_path: str) -> OfficeTemplate:
+        """获取已解析的模板，不存在或文件已变化时重新解析"""
+        template_key = str(template_path)
+        key = (template_key, file_content_hash(template_path))
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+        # 在锁外解析模板，避免阻塞其他模板的读取
+        with open(template_path, 'rb') as f:
+            data = f.read()
+        entry = _BUILDERS[Path(template_path).suffix.lower()](data)
+
+        with self._lock:
+            # 同一模板的旧版本（文件内容已变化）直接移除
+            for old_key in [k for k in self._entries if k[0] == template_key and k != key]:
+                del self._entries[old_key]
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, template_path: str):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == str(template_path)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+office_template_cache = OfficeTemplateCache(config.OFFICE_TEMPLATE_CACHE_SIZE)
+
+
+def get_office_template(template_path: str) -> OfficeTemplate:
+    """获取已解析的Word/Excel模板"""
+    return office_template_cache.get(template_path)
@@ -0,0 +1,239 @@
+"""
+PDF处理引擎
+PDF模板的填充分为三步：打开模板、生成各页覆盖层、写出输出文件。
+默认引擎基于 PyPDF2 + reportlab（见 pdf_handler）；安装了 pikepdf（qpdf）时可选用 pikepdf 引擎，
+由 PDF_ENGINE 配置选择。两种引擎共用模板缓存和绘制计划，覆盖层都由 reportlab 绘制
+"""
+import logging
+import threading
+from abc import ABC, abstractmethod
+from io import BytesIO
+from typing import Dict, Any, List, Union, BinaryIO, Optional
+from app.services.draw_plan import render_overlay_document
+from app.utils.stage_timer import stage
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+import config
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pikepdf
+    PIKEPDF_AVAILABLE = True
+except ImportError:
+    PIKEPDF_AVAILABLE = False
+
+
+class PdfEngine(ABC):
+    """PDF处理引擎接口（三个步骤都必须实现，缺少实现的引擎在创建时就会报错）"""
+
+    name = ""
+
+    @abstractmethod
+    def open_template(self, template_path: str, text_positions: List[Dict[str, Any]], template_id: int = None):
+        """打开模板，返回之后各步骤使用的模板对象"""
+
+    @abstractmethod
+    def build_overlays(self, template, data: Dict[str, Any]) -> Dict[int, Any]:
+        """生成一位教师各页的覆盖层，返回 {页码: 覆盖层}"""
+
+    @abstractmethod
+    def write_output(self, template, overlays: Dict[int, Any], output_path: Union[str, BinaryIO]):
+        """把覆盖层叠加到模板页面上并写出"""
+
+    def fill(self, template_path: str, output_path: Union[str, BinaryIO], text_positions: List[Dict[str, Any]],
+             data: Dict[str, Any], template_id: int = None):
+        """填充一位教师的PDF（参数同 pdf_handler.add_text_to_pdf）"""
+        try:
+            template = self.open_template(template_path, text_positions, template_id)
+            overlays = self.build_overlays(template, data)
+            self.write_output(template, overlays, output_path)
+        except Exception as e:
+            logger.exception("PDF处理失败 (引擎: %s): %s", self.name, e)
+            raise Exception(f"处理PDF失败: {str(e)}")
+
+    def fill_batch(self, template_path: str, text_positions: List[Dict[str, Any]],
+                   data_list: List[Dict[str, Any]], template_id: int = None) -> List[bytes]:
+        """批量填充，返回每位教师的PDF内容（与 data_list 顺序一致）"""
+        template = self.open_template(template_path, text_positions, template_id)
+        results = []
+        for data in data_list:
+            output = BytesIO()
+            self.write_output(template, self.build_overlays(template, data), output)
+            results.append(output.getvalue())
+        return results
+
+
+class PyPdf2Engine(PdfEngine):
+    """PyPDF2 + reportlab（默认引擎）：增量更新输出、纯文本直接写入内容流"""
+
+    name = "pypdf2"
+
+    def open_template(self, template_path, text_positions, template_id=None):
+        from app.services.pdf_handler import open_pdf_template
+        return open_pdf_template(template_path, text_positions, template_id)
+
+    def build_overlays(self, template, data):
+        from app.services.pdf_handler import build_overlays
+        return build_overlays(template, data)
+
+    def write_output(self, template, overlays, output_path):
+        from app.services.pdf_handler import write_pdf
+        write_pdf(template, overlays, output_path)
+
+    def fill(self, template_path, output_path, text_positions, data, template_id=None):
+        from app.services.pdf_handler import add_text_to_pdf
+        add_text_to_pdf(template_path, output_path, text_positions, data, template_id=template_id)
+
+    def fill_batch(self, template_path, text_positions, data_list, template_id=None):
+        from app.services.pdf_handler import add_text_to_pdf_batch
+        return add_text_to_pdf_batch(template_path, text_positions, data_list, template_id=template_id)
+
+
+class _OverlayPages(dict):
+    """
+    一位教师各页的覆盖层 {页码: pikepdf.Page}
+    同时引用覆盖层页面所在的 pikepdf.Pdf：该Pdf被回收后页面失效，写出前必须保持引用
+    """
+
+    def __init__(self, pages: Dict[int, Any], source: "pikepdf.Pdf"):
+        super().__init__(pages)
+        self.source = source
+
+
+def _detached_resources(resources: "pikepdf.Dictionary") -> "pikepdf.Dictionary":
+    """资源字典及其 /XObject 子字典的浅拷贝；add_overlay 只修改拷贝，不影响模板中可能被多个页面共用的资源"""
+    copy = pikepdf.Dictionary({key: value for key, value in resources.items()})
+    if "/XObject" in copy:
+        copy.XObject = pikepdf.Dictionary({key: value for key, value in copy.XObject.items()})
+    return copy
+
+
+class PikePdfEngine(PdfEngine):
+    """
+    pikepdf（qpdf）：模板原始字节由qpdf解析，覆盖层作为表单XObject叠加到页面上，写出由qpdf完成
+    模板页面不修改，常量字段也绘制在覆盖层中；批量填充时模板只解析一次，每位教师写出后恢复被叠加的页面
+    """
+
+    name = "pikepdf"
+
+    def open_template(self, template_path, text_positions, template_id=None):
+        from app.services.pdf_handler import PdfTemplate
+        from app.services.template_cache import get_pdf_template
+        from app.services.font_registry import get_default_font_name
+        with stage("template_load"):
+            cached_template = get_pdf_template(template_path, text_positions, template_id)
+        with stage("font_setup"):
+            default_font_name = get_default_font_name()
+        with stage("draw_plan"), cached_template.lock:
+            draw_plan = cached_template.get_draw_plan(default_font_name, merge_constants=False)
+        return PdfTemplate(cached_template, draw_plan, False)
+
+    def build_overlays(self, template, data):
+        return self._build_overlays_batch(template, [data])[0]
+
+    def _build_overlays_batch(self, template, data_list: List[Dict[str, Any]]) -> List[Dict[int, Any]]:
+        """一批教师的覆盖层绘制为一个PDF，由qpdf解析一次"""
+        with stage("overlay_draw"):
+            document, page_nums = render_overlay_document(template.draw_plan, data_list)
+            if document is None:
+                return [{} for _ in data_list]
+            source = pikepdf.open(BytesIO(document))
+            pages = iter(source.pages)
+            return [
+                _OverlayPages({page_num: next(pages) for page_num in teacher_pages}, source)
+                for teacher_pages in page_nums
+            ]
+
+    def _open_pdf(self, cached_template) -> "pikepdf.Pdf":
+        with stage("merge"):
+            return pikepdf.open(BytesIO(cached_template.data))
+
+    def _save_with_overlays(self, pdf: "pikepdf.Pdf", cached_template, overlays: Dict[int, Any],
+                            output_path: Union[str, BinaryIO]):
+        """把覆盖层叠加到已打开的模板上并写出，写出后恢复被修改的页面，同一个模板可以继续给下一位教师使用"""
+        originals = []
+        try:
+            with stage("merge"):
+                for page_num, overlay in overlays.items():
+                    page = pdf.pages[page_num]
+                    originals.append((page, page.obj.get("/Contents"), page.obj.get("/Resources")))
+                    if "/Resources" in page.obj:
+                        page.obj.Resources = _detached_resources(page.obj.Resources)
+                    # 覆盖层页面与模板页面尺寸相同，从原点开始叠加，不缩放
+                    width, height = cached_template.page_sizes[page_num]
+                    page.add_overlay(overlay, pikepdf.Rectangle(0, 0, width, height))
+            with stage("write"):
+                pdf.save(output_path)
+        finally:
+            for page, contents, resources in originals:
+                for key, value in (("/Contents", contents), ("/Resources", resources)):
+                    if value is None:
+                        if key in page.obj:
+                            del page.obj[key]
+                    else:
+                        page.obj[key] = value
+
+    def write_output(self, template, overlays, output_path):
+        pdf = self._open_pdf(template.cached_template)
+        try:
+            self._save_with_overlays(pdf, template.cached_template, overlays, output_path)
+        finally:
+            pdf.close()
+
+    def fill_batch(self, template_path, text_positions, data_list, template_id=None):
+        template = self.open_template(template_path, text_positions, template_id)
+        overlays_list = self._build_overlays_batch(template, data_list)
+        pdf = self._open_pdf(template.cached_template)
+        try:
+            results = []
+            for overlays in overlays_list:
+                output = BytesIO()
+                self._save_with_overlays(pdf, template.cached_template, overlays, output)
+                results.append(output.getvalue())
+        finally:
+            pdf.close()
+        return results
+
+
+ENGINES = {
+    PyPdf2Engine.name: PyPdf2Engine,
+    PikePdfEngine.name: PikePdfEngine,
+}
+
+_lock = threading.Lock()
+_engine: Optional[PdfEngine] = None
+
+
+def available_engines() -> List[str]:
+    """当前环境可用的引擎名"""
+    return [name for name in ENGINES if name != PikePdfEngine.name or PIKEPDF_AVAILABLE]
+
+
+def create_engine(name: str) -> PdfEngine:
+    """
+    按名称创建引擎：pypdf2、pikepdf，或 auto（安装了pikepdf时使用pikepdf）
+    名称无效或pikepdf未安装时使用默认引擎
+    """
+    name = (name or PyPdf2Engine.name).lower()
+    if name == "auto":
+        name = PikePdfEngine.name if PIKEPDF_AVAILABLE else PyPdf2Engine.name
+    if name not in ENGINES:
+        logger.warning("未知的PDF引擎 %s，使用默认引擎 %s", name, PyPdf2Engine.name)
+        name = PyPdf2Engine.name
+    if name == PikePdfEngine.name and not PIKEPDF_AVAILABLE:
+        logger.warning("pikepdf未安装（pip install pikepdf），使用默认引擎 %s", PyPdf2Engine.name)
+        name = PyPdf2Engine.name
+    return ENGINES[name]()
+
+
+def get_pdf_engine() -> PdfEngine:
+    """按 PDF_ENGINE 配置获取引擎（进程内只创建一次）"""
+    global _engine
+    if _engine is None:
+        with _lock:
+            if _engine is None:
+                _engine = create_engine(config.PDF_ENGINE)
+                logger.info("PDF处理引擎: %s", _engine.name)
+    return _engine
@@ -0,0 +1,140 @@
+"""
+PDF对象写出
+按对象流式写出PDF：分配对象号、写出对象、从其他PDF复制对象（及其引用的对象），最后写出交叉引用表。
+合并PDF输出和增量更新输出共用
+"""
+from io import BytesIO
+from typing import Dict, Optional, Tuple, BinaryIO
+
+try:
+    from PyPDF2.generic import (
+        ArrayObject, DecodedStreamObject, DictionaryObject, IndirectObject,
+        NameObject, NullObject, NumberObject, StreamObject
+    )
+    PDF_LIBRARIES_AVAILABLE = True
+except ImportError:
+    PDF_LIBRARIES_AVAILABLE = False
+
+
+def flate_stream(data: bytes, entries: Optional[Dict[str, object]] = None) -> "StreamObject":
+    """生成压缩的流对象（flate_encode 不保留字典中的其他条目，这里重新加上）"""
+    stream = DecodedStreamObject()
+    stream.set_data(data)
+    encoded = stream.flate_encode()
+    for key, value in (entries or {}).items():
+        encoded[NameObject(key)] = value
+    return encoded
+
+
+class PdfObjectWriter:
+    """
+    流式写出PDF对象，对象写出后即释放，只保留交叉引用表需要的偏移量
+    position 为流中已有的字节数（增量更新时为原文件长度），next_id 为第一个新对象号
+    """
+
+    def __init__(self, stream: BinaryIO, position: int = 0, next_id: int = 1):
+        self.stream = stream
+        self._position = position
+        self._next_id = next_id
+        # 对象号 -> (偏移量, 代数)，偏移量为None表示已分配但尚未写出
+        self._offsets: Dict[int, Tuple[Optional[int], int]] = {}
+
+    @property
+    def next_id(self) -> int:
+        """下一个新对象号（即交叉引用表的 /Size）"""
+        return self._next_id
+
+    def _write(self, data: bytes):
+        self.stream.write(data)
+        self._position += len(data)
+
+    def _reserve(self) -> int:
+        obj_id = self._next_id
+        self._next_id += 1
+        self._offsets[obj_id] = (None, 0)
+        return obj_id
+
+    def _ref(self, obj_id: int, generation: int = 0) -> "IndirectObject":
+        return IndirectObject(obj_id, generation, self)
+
+    def _write_object(self, obj_id: int, obj, generation: int = 0):
+        buffer = BytesIO()
+        buffer.write(f"{obj_id} {generation} obj\n".encode())
+        obj.write_to_stream(buffer, None)
+        buffer.write(b"\nendobj\n")
+        self._offsets[obj_id] = (self._position, generation)
+        self._write(buffer.getvalue())
+
+    def add_object(self, obj) -> "IndirectObject":
+        """立即写出一个对象，返回它的引用"""
+        obj_id = self._reserve()
+        self._write_object(obj_id, obj)
+        return self._ref(obj_id)
+
+    def replace_object(self, obj_id: int, generation: int, obj):
+        """用新内容写出已有的对象（增量更新中修改的对象沿用原对象号）"""
+        self._write_object(obj_id, obj, generation)
+
+    def import_object(self, obj, memo: Dict[Tuple[int, int, int], int]):
+        """
+        把来源PDF中的对象（及其引用的所有对象）复制到输出中，返回可放入新对象的值
+        memo 记录来源对象到输出对象号的映射，同一来源的对象只写一次
+        （合并了常量的模板页面同时引用模板和常量覆盖层两个来源PDF，键中包含来源PDF）
+        """
+        if isinstance(obj, IndirectObject):
+            key = (id(obj.pdf), obj.idnum, obj.generation)
+            if key not in memo:
+                # 先登记对象号再复制内容，循环引用时直接返回已登记的引用
+                obj_id = self._reserve()
+                memo[key] = obj_id
+                self._write_object(obj_id, self.import_object(obj.get_object(), memo))
+            return self._ref(memo[key])
+        if isinstance(obj, StreamObject):
+            copy = obj.__class__()
+            copy._data = obj._data
+            for key, value in obj.items():
+                if key != "/Length":
+                    copy[NameObject(key)] = self.import_object(value, memo)
+            return copy
+        if isinstance(obj, DictionaryObject):
+            copy = DictionaryObject()
+            for key, value in obj.items():
+                copy[NameObject(key)] = self.import_object(value, memo)
+            return copy
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self.import_object(value, memo) for value in obj)
+        return obj
+
+    def write_xref(self, trailer: "DictionaryObject"):
+        """
+        写出交叉引用表和文件尾（trailer 中的 /Size 由这里填写）
+        增量更新的交叉引用表同样从0号空闲对象开始（部分阅读器要求第一个子节从0开始）
+        """
+        # 复制失败时可能留下已分配但未写出的对象号，写为空对象保持交叉引用表完整
+        for obj_id, (offset, _) in list(self._offsets.items()):
+            if offset is None:
+                self._write_object(obj_id, NullObject())
+
+        entries = {obj_id: f"{offset:010d} {generation:05d} n \n"
+                   for obj_id, (offset, generation) in self._offsets.items()}
+        entries[0] = "0000000000 65535 f \n"
+
+        # 对象号连续的条目写为一个子节
+        lines = ["xref\n"]
+        ids = sorted(entries)
+        start = 0
+        while start < len(ids):
+            end = start
+            while end + 1 < len(ids) and ids[end + 1] == ids[end] + 1:
+                end += 1
+            lines.append(f"{ids[start]} {end - start + 1}\n")
+            lines.extend(entries[obj_id] for obj_id in ids[start:end + 1])
+            start = end + 1
+
+        trailer[NameObject("/Size")] = NumberObject(self._next_id)
+        trailer_buffer = BytesIO()
+        trailer.write_to_stream(trailer_buffer, None)
+        xref_position = self._position
+        lines.append(f"trailer\n{trailer_buffer.getvalue().decode('latin-1')}\n")
+        lines.append(f"startxref\n{xref_position}\n%%EOF\n")
+        self._write("".join(lines).encode("latin-1"))
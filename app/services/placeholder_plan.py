@@ -0,0 +1,87 @@
+"""
+占位符替换计划
+把模板中的文本预先拆分为字面片段和字段位置（编译为格式字符串），模板用到的字段整理为一个字段列表。
+渲染时每位教师的字段值只解析一次得到值向量，每段文本只需一次格式化；不含占位符的文本不重新生成
+"""
+import re
+from functools import lru_cache
+from typing import Dict, Any, List, Tuple, Optional, Sequence
+
+PLACEHOLDER_PATTERN = re.compile(r'\{\{(\w+)\}\}')
+
+
+def resolve_field_value(data: Dict[str, Any], field_name: str) -> str:
+    """
+    字段值：先从主字段查找，再从extra_data查找，找不到或为None时为空字符串
+    """
+    if field_name in data:
+        value = data[field_name]
+    elif 'extra_data' in data and isinstance(data['extra_data'], dict):
+        value = data['extra_data'].get(field_name, '')
+    else:
+        value = ''
+
+    # 处理None值
+    if value is None:
+        value = ''
+
+    return str(value)
+
+
+def _compile(text: str, field_index: Dict[str, int]) -> Optional[str]:
+    """
+    把文本编译为格式字符串（字面片段中的花括号转义，字段位置为 {序号}），不含占位符时返回None
+    field_index 为字段名到值向量下标的映射，新字段追加到末尾
+    """
+    pieces = PLACEHOLDER_PATTERN.split(text)
+    if len(pieces) == 1:
+        return None
+    parts = []
+    for index, piece in enumerate(pieces):
+        if index % 2 == 0:
+            parts.append(piece.replace("{", "{{").replace("}", "}}"))
+        else:
+            slot = field_index.setdefault(piece, len(field_index))
+            parts.append(f"{{{slot}}}")
+    return "".join(parts)
+
+
+class SubstitutionPlan:
+    """一组文本（如一个模板中所有包含占位符的文本）的替换计划"""
+
+    def __init__(self, texts: Sequence[str]):
+        field_index: Dict[str, int] = {}
+        self.texts: Tuple[str, ...] = tuple(texts)
+        self.formats: Tuple[Optional[str], ...] = tuple(_compile(text, field_index) for text in self.texts)
+        # 值向量中各位置对应的字段名
+        self.fields: Tuple[str, ...] = tuple(field_index)
+
+    def resolve(self, data: Dict[str, Any]) -> List[str]:
+        """解析一位教师的值向量"""
+        return [resolve_field_value(data, field_name) for field_name in self.fields]
+
+    def render(self, data: Dict[str, Any]) -> List[str]:
+        """返回替换后的各段文本（与 texts 顺序一致）"""
+        values = self.resolve(data)
+        return [
+            text if fmt is None else fmt.format(*values)
+            for text, fmt in zip(self.texts, self.formats)
+        ]
+
+    def render_batch(self, data_list: Sequence[Dict[str, Any]]) -> List[List[str]]:
+        """批量渲染多位教师，返回每位教师替换后的各段文本（与 data_list 顺序一致）"""
+        compiled = [(index, fmt) for index, fmt in enumerate(self.formats) if fmt is not None]
+        results = []
+        for data in data_list:
+            values = self.resolve(data)
+            texts = list(self.texts)
+            for index, fmt in compiled:
+                texts[index] = fmt.format(*values)
+            results.append(texts)
+        return results
+
+
+@lru_cache(maxsize=4096)
+def compile_text(text: str) -> SubstitutionPlan:
+    """单段文本的替换计划（按文本缓存）"""
+    return SubstitutionPlan((text,))
@@ -0,0 +1,103 @@
+"""
+PDF预览图片缓存
+按模板内容哈希、页码和DPI把预览PNG缓存到磁盘，总大小超出上限时按最近使用时间淘汰
+"""
+import os
+import threading
+from typing import Dict, Tuple
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+import config
+from app.utils.hashing import file_content_hash
+
+
+class PreviewCache:
+    """磁盘上的LRU预览缓存，同一张预览图同时只会生成一次"""
+
+    def __init__(self, cache_dir: Path, max_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # 正在生成的预览：{缓存键: 锁}
+        self._inflight: Dict[str, threading.Lock] = {}
+
+    @staticmethod
+    def make_key(pdf_path: str, page_num: int, dpi: int) -> str:
+        """缓存键（同时用作ETag）"""
+        return f"{file_content_hash(pdf_path)[:32]}_{page_num}_{dpi}"
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.png"
+
+    def _read(self, path: Path):
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        # 更新修改时间，作为LRU淘汰依据
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return data
+
+    def get_or_create(self, pdf_path: str, page_num: int, dpi: int) -> Tuple[bytes, str]:
+        """
+        获取预览图片，缓存中没有时生成
+        返回 (PNG字节, 缓存键)
+        """
+        key = self.make_key(pdf_path, page_num, dpi)
+        path = self._path(key)
+        data = self._read(path)
+        if data is not None:
+            return data, key
+
+        with self._lock:
+            key_lock = self._inflight.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                # 其他请求可能已经生成完毕
+                data = self._read(path)
+                if data is not None:
+                    return data, key
+
+                from app.services.pdf_handler import render_pdf_preview
+                data = render_pdf_preview(pdf_path, page_num, dpi)
+                tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+                tmp_path.write_bytes(data)
+                os.replace(tmp_path, path)
+        finally:
+            with self._lock:
+                if self._inflight.get(key) is key_lock and not key_lock.locked():
+                    del self._inflight[key]
+
+        self.evict()
+        return data, key
+
+    def evict(self):
+        """总大小超过上限时，删除最久未使用的预览图片"""
+        entries = []
+        total = 0
+        for path in self.cache_dir.glob("*.png"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+                total -= size
+            except FileNotFoundError:
+                pass
+
+
+preview_cache = PreviewCache(config.PREVIEW_CACHE_DIR, config.PREVIEW_CACHE_MAX_BYTES)
@@ -0,0 +1,75 @@
+"""
+渲染指纹
+模板内容、占位符位置和实际填入的字段值都不变时，渲染结果也不变，可以直接复用之前的文件
+"""
+from typing import Dict, Any, List, Optional
+from app.utils.hashing import file_content_hash, json_hash
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+import config
+
+# 渲染逻辑有变化（字体、排版等）时递增，使之前的指纹全部失效
+RENDER_VERSION = 2
+
+
+def resolve_field_values(placeholder_positions: Optional[List[Dict[str, Any]]], data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    解析模板实际会用到的字段值
+    PDF模板按占位符位置解析（与 add_text_to_pdf 的取值规则一致）；
+    Word/Excel模板没有位置信息，使用全部教师数据
+    """
+    if not placeholder_positions:
+        return data
+
+    extra_data = data.get("extra_data") if isinstance(data.get("extra_data"), dict) else {}
+    values = {}
+    for pos in placeholder_positions:
+        field_name = pos.get("field_name", "")
+        if pos.get("is_constant") and pos.get("constant_value"):
+            values[f"const:{field_name}"] = pos.get("constant_value")
+            continue
+        value = data.get(field_name, "")
+        if not value:
+            value = extra_data.get(field_name, "")
+        values[field_name] = value
+    return values
+
+
+def render_settings(template_path: str) -> Dict[str, Any]:
+    """
+    影响输出文件的渲染配置：PDF模板为实际使用的PDF引擎和输出方式（增量更新、直接写入文本）
+    这些配置改变后，之前渲染的文件不再复用
+    """
+    if Path(template_path).suffix.lower() != ".pdf":
+        return {}
+    from app.services.pdf_engine import get_pdf_engine
+    return {
+        "engine": get_pdf_engine().name,
+        "incremental_update": config.PDF_INCREMENTAL_UPDATE,
+        "direct_text": config.PDF_DIRECT_TEXT,
+    }
+
+
+def template_version(template_path: str, placeholder_positions: Optional[List[Dict[str, Any]]]) -> str:
+    """模板版本：模板文件内容哈希 + 占位符位置哈希 + 渲染配置"""
+    return json_hash({
+        "render_version": RENDER_VERSION,
+        "template": file_content_hash(template_path),
+        "positions": json_hash(placeholder_positions or []),
+        "settings": render_settings(template_path),
+    })
+
+
+def render_fingerprint(template_path: str, placeholder_positions: Optional[List[Dict[str, Any]]],
+                       data: Dict[str, Any], version: Optional[str] = None) -> str:
+    """
+    单个教师文件的渲染指纹
+    version 可传入预先计算的 template_version，批量计算时避免重复哈希
+    """
+    if version is None:
+        version = template_version(template_path, placeholder_positions)
+    return json_hash({
+        "template_version": version,
+        "values": json_hash(resolve_field_values(placeholder_positions, data)),
+    })
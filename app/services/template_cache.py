@@ -0,0 +1,196 @@
+"""
+PDF模板缓存
+按模板ID和文件内容哈希缓存已解析的模板，批量导出时不再为每位教师复制并重新解析模板PDF
+"""
+import re
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from typing import Dict, Any, List, Tuple, Optional, Union
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+import config
+from app.utils.hashing import file_content_hash, json_hash
+
+try:
+    from PyPDF2 import PdfReader, PageObject
+    PDF_LIBRARIES_AVAILABLE = True
+except ImportError:
+    PDF_LIBRARIES_AVAILABLE = False
+
+
+def group_positions_by_page(text_positions: List[Dict[str, Any]]) -> Dict[int, List[Dict[str, Any]]]:
+    """按页码分组占位符位置"""
+    positions_by_page = {}
+    for pos in text_positions:
+        page_num = pos.get("page", 0)
+        if page_num not in positions_by_page:
+            positions_by_page[page_num] = []
+        positions_by_page[page_num].append(pos)
+    return positions_by_page
+
+
+def _find_startxref(data: bytes) -> Optional[int]:
+    """读取文件末尾 startxref 后的偏移量，找不到时返回None"""
+    tail = data[-1024:]
+    index = tail.rfind(b"startxref")
+    if index < 0:
+        return None
+    try:
+        return int(tail[index + len(b"startxref"):].split()[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def _xref_size(reader: "PdfReader", data: bytes, startxref: Optional[int]) -> int:
+    """
+    原文件交叉引用中的对象数（/Size），增量更新中新对象的编号从这里开始；无法确定时返回0
+    交叉引用流（PDF 1.5+）的 /Size 不在 reader.trailer 中，从 startxref 处交叉引用流的字典读取；
+    同时不小于已知的最大对象号+1，/Size 写错的文件不会覆盖已有对象
+    """
+    size = int(reader.trailer.get("/Size", 0))
+    if not size and startxref is not None:
+        match = re.match(rb"\s*\d+\s+\d+\s+obj\s*<<(.*?)stream", data[startxref:startxref + 4096], re.S)
+        if match:
+            size_match = re.search(rb"/Size\s+(\d+)", match.group(1))
+            if size_match:
+                size = int(size_match.group(1))
+    object_ids = [idnum for entries in reader.xref.values() for idnum in entries]
+    object_ids.extend(reader.xref_objStm)
+    if object_ids:
+        size = max(size, max(object_ids) + 1)
+    return size
+
+
+class CachedPdfTemplate:
+    """已解析的PDF模板（页面树、页面尺寸、按页分组的占位符）"""
+
+    def __init__(self, template_key: Union[int, str], content_hash: str, data: bytes,
+                 text_positions: List[Dict[str, Any]]):
+        self.template_key = template_key
+        self.content_hash = content_hash
+        self.data = data
+        self.reader = PdfReader(BytesIO(data))
+        self.page_sizes: List[Tuple[float, float]] = [
+            (float(page.mediabox.width), float(page.mediabox.height))
+            for page in self.reader.pages
+        ]
+        self.text_positions = text_positions
+        self.positions_hash = json_hash(text_positions)
+        self.positions_by_page = group_positions_by_page(text_positions)
+        # PdfReader按需从同一个流中读取对象，不能被多个线程同时访问
+        self.lock = threading.Lock()
+        # 编译好的绘制计划，按 (默认字体, 是否合并常量) 缓存（占位符位置变化时整个缓存条目重建）
+        self._draw_plans: Dict[Tuple[str, bool], Any] = {}
+        # 原文件的交叉引用位置和文件尾，用于在原文件后追加增量更新；加密的模板不能追加未加密的对象
+        self.startxref = _find_startxref(data)
+        self.xref_size = _xref_size(self.reader, data, self.startxref)
+        self.supports_incremental = (
+            self.startxref is not None and self.xref_size > 0 and not self.reader.is_encrypted
+        )
+        self.trailer_entries = {
+            key: self.reader.trailer.raw_get(key) for key in ("/Root", "/Info", "/ID") if key in self.reader.trailer
+        }
+        self._page_patches: Dict[int, Any] = {}
+
+    @property
+    def num_pages(self) -> int:
+        return len(self.page_sizes)
+
+    def copy_page(self, page_num: int) -> "PageObject":
+        """
+        返回模板页面的浅拷贝（需在持有 self.lock 时调用）
+        merge_page 只替换拷贝上的内容和资源，不会修改缓存中的页面
+        """
+        return self.copy_of(self.reader.pages[page_num])
+
+    def copy_of(self, original: "PageObject") -> "PageObject":
+        """返回任意属于该模板的页面（如绘制计划中合并了常量的页面）的浅拷贝（需在持有 self.lock 时调用）"""
+        page = PageObject(self.reader, original.indirect_reference)
+        page.update(original)
+        return page
+
+    def get_page_patch(self, page_num: int):
+        """获取增量更新修改该页所需的信息（需在持有 self.lock 时调用），首次使用时读取"""
+        patch = self._page_patches.get(page_num)
+        if patch is None:
+            from app.services.incremental_pdf import build_page_patch
+            patch = build_page_patch(self, page_num)
+            self._page_patches[page_num] = patch
+        return patch
+
+    def get_draw_plan(self, default_font_name: str, merge_constants: bool = True):
+        """获取编译好的绘制计划（需在持有 self.lock 时调用），首次使用时编译"""
+        key = (default_font_name, merge_constants)
+        plan = self._draw_plans.get(key)
+        if plan is None:
+            from app.services.draw_plan import compile_draw_plan
+            plan = compile_draw_plan(self, self.text_positions, default_font_name, merge_constants)
+            self._draw_plans[key] = plan
+        return plan
+
+
+class TemplateCache:
+    """LRU模板缓存，键为 (模板ID, 文件内容哈希)"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Tuple[Union[int, str], str], CachedPdfTemplate]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, template_path: str, text_positions: List[Dict[str, Any]],
+            template_id: Optional[int] = None) -> CachedPdfTemplate:
+        """获取已解析的模板，不存在或已过期时重新解析"""
+        template_key = template_id if template_id is not None else str(template_path)
+        content_hash = file_content_hash(template_path)
+        key = (template_key, content_hash)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.positions_hash == json_hash(text_positions):
+                self._entries.move_to_end(key)
+                return entry
+
+        # 在锁外解析模板，避免阻塞其他模板的读取
+        with open(template_path, 'rb') as f:
+            data = f.read()
+        entry = CachedPdfTemplate(template_key, content_hash, data, text_positions)
+
+        with self._lock:
+            # 同一模板的旧版本（文件内容已变化）直接移除
+            for old_key in [k for k in self._entries if k[0] == template_key and k != key]:
+                del self._entries[old_key]
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, template_key: Union[int, str]):
+        """移除某个模板的所有缓存（模板文件或占位符位置修改后调用）"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == template_key]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+template_cache = TemplateCache(config.TEMPLATE_CACHE_SIZE)
+
+
+def get_pdf_template(template_path: str, text_positions: List[Dict[str, Any]],
+                     template_id: Optional[int] = None) -> CachedPdfTemplate:
+    """获取已解析的PDF模板"""
+    return template_cache.get(template_path, text_positions, template_id)
+
+
+def invalidate_template(template_id: int, template_path: Optional[str] = None):
+    """模板修改后清除缓存"""
+    template_cache.invalidate(template_id)
+    if template_path:
+        template_cache.invalidate(str(template_path))
+        from app.services.office_template import office_template_cache
+        office_template_cache.invalidate(str(template_path))
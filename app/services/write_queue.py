@@ -0,0 +1,148 @@
+"""
+数据库写队列
+SQLite同一时间只允许一个写事务。问卷集中提交、导出进度更新等短写事务较多时，
+可以交给进程内的单个写线程按提交顺序执行，排队中的多个写操作合并为一个事务提交，
+各请求线程不再争抢写锁（DB_WRITE_QUEUE_ENABLED 开启）
+"""
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Tuple, TypeVar
+from sqlalchemy.orm import Session
+from app.database import SessionLocal
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+import config
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_STOP = object()
+
+
+class WriteQueue:
+    """
+    单线程写队列
+    写操作为 fn(session)：只查询和修改，不要提交；返回值应为普通数据（会话关闭后ORM对象不能再访问）。
+    合并提交失败时逐个重新执行，出错的写操作单独报错，不影响同一批的其他写操作
+    （因此写操作不应有数据库以外的副作用，也不能在写操作中再向写队列提交）
+    """
+
+    def __init__(self, session_factory: Callable[[], Session] = SessionLocal, batch_size: Optional[int] = None):
+        self.session_factory = session_factory
+        self.batch_size = max(1, batch_size or config.DB_WRITE_QUEUE_BATCH_SIZE)
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable[[Session], T]) -> "Future[T]":
+        """提交一个写操作，返回其结果的 Future"""
+        future: "Future[T]" = Future()
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="db-write-queue", daemon=True)
+                self._thread.start()
+            self._queue.put((fn, future))
+        return future
+
+    def run(self, fn: Callable[[Session], T], timeout: Optional[float] = None) -> T:
+        """提交一个写操作并等待其提交完成"""
+        return self.submit(fn).result(timeout)
+
+    def stop(self, timeout: Optional[float] = None):
+        """执行完已排队的写操作后停止写线程"""
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                return
+            self._queue.put(_STOP)
+            self._thread = None
+        thread.join(timeout)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stopping = False
+            # 取出已在排队的写操作（不等待），合并为一个事务
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._execute_batch(batch)
+            if stopping:
+                return
+
+    def _execute_batch(self, batch: List[Tuple[Callable[[Session], object], Future]]):
+        # 跳过已被调用方取消的写操作
+        batch = [(fn, future) for fn, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        if len(batch) == 1:
+            self._execute_one(*batch[0])
+            return
+
+        db = self.session_factory()
+        try:
+            results = [fn(db) for fn, _ in batch]
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.debug("合并写入 %d 个操作失败，逐个重新执行: %s", len(batch), e)
+            results = None
+        finally:
+            db.close()
+
+        if results is None:
+            for fn, future in batch:
+                self._execute_one(fn, future)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def _execute_one(self, fn: Callable[[Session], object], future: Future):
+        db = self.session_factory()
+        try:
+            result = fn(db)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+        finally:
+            db.close()
+
+
+write_queue = WriteQueue()
+
+
+def run_write(fn: Callable[[Session], T], db: Optional[Session] = None) -> T:
+    """
+    执行一个短写事务 fn(session)（fn 中不要提交）
+    启用写队列时交给写线程执行；否则在 db（未提供时新建会话）中执行并提交
+    """
+    if config.DB_WRITE_QUEUE_ENABLED:
+        return write_queue.run(fn)
+
+    session = db if db is not None else SessionLocal()
+    try:
+        result = fn(session)
+        session.commit()
+        return result
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        if db is None:
+            session.close()
@@ -0,0 +1,41 @@
+"""
+哈希工具函数
+"""
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, Tuple
+
+# 文件内容哈希缓存：{路径: (修改时间, 文件大小, 哈希值)}
+_file_hash_cache: Dict[str, Tuple[int, int, str]] = {}
+_file_hash_lock = threading.Lock()
+
+
+def file_content_hash(file_path: str) -> str:
+    """
+    计算文件内容的SHA-256哈希
+    文件的修改时间和大小不变时直接返回缓存结果，不重复读取文件
+    """
+    file_path = str(file_path)
+    stat = os.stat(file_path)
+    with _file_hash_lock:
+        cached = _file_hash_cache.get(file_path)
+    if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+
+    with _file_hash_lock:
+        _file_hash_cache[file_path] = (stat.st_mtime_ns, stat.st_size, digest)
+    return digest
+
+
+def json_hash(value: Any) -> str:
+    """计算JSON可序列化数据的稳定哈希（字典按键排序）"""
+    payload = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
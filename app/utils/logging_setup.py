@@ -0,0 +1,41 @@
+"""
+日志配置
+应用日志统一写入 "app" 日志器，通过队列交给后台线程输出，渲染循环中记录日志不会阻塞在标准输出上
+"""
+import atexit
+import logging
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+import config
+
+LOGGER_NAME = "app"
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(name)s] %(message)s"
+
+_lock = threading.Lock()
+_listener = None
+
+
+def setup_logging():
+    """
+    配置 "app" 日志器（每个进程调用一次，重复调用无影响）
+    日志级别由 config.LOG_LEVEL 控制，逐个占位符、逐页的详细日志只在DEBUG级别输出
+    """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+        log_queue = queue.SimpleQueue()
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        _listener = QueueListener(log_queue, handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+        logger = logging.getLogger(LOGGER_NAME)
+        logger.setLevel(getattr(logging, config.LOG_LEVEL, logging.INFO))
+        logger.addHandler(QueueHandler(log_queue))
+        logger.propagate = False
@@ -0,0 +1,60 @@
+"""
+分阶段计时
+在一次导出中累计各阶段（数据库读取、字体、绘制、合并、写入、打包等）的耗时，
+汇总后保存到任务记录，用来查看时间花在哪里
+"""
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+_current_timer: ContextVar[Optional["StageTimer"]] = ContextVar("stage_timer", default=None)
+
+
+class StageTimer:
+    """累计每个阶段的耗时（秒）和次数"""
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.counts = defaultdict(int)
+
+    def add(self, stage_name: str, seconds: float, count: int = 1):
+        self.seconds[stage_name] += seconds
+        self.counts[stage_name] += count
+
+    def merge(self, timings: Dict[str, Dict[str, float]]):
+        """合并另一份计时结果（如工作进程返回的 as_dict()）"""
+        for stage_name, item in timings.items():
+            self.add(stage_name, item["seconds"], item["count"])
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        return {
+            stage_name: {"seconds": round(self.seconds[stage_name], 4), "count": self.counts[stage_name]}
+            for stage_name in self.seconds
+        }
+
+
+@contextmanager
+def collect_stages(timer: Optional[StageTimer] = None):
+    """在代码块内收集 stage() 的计时，返回使用的 StageTimer"""
+    timer = timer if timer is not None else StageTimer()
+    token = _current_timer.set(timer)
+    try:
+        yield timer
+    finally:
+        _current_timer.reset(token)
+
+
+@contextmanager
+def stage(stage_name: str):
+    """记录代码块耗时到当前的 StageTimer（没有在收集时不做任何事）"""
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(stage_name, time.perf_counter() - start)
@@ -0,0 +1,45 @@
+"""
+导出工作进程
+从数据库的导出作业队列领取作业并执行批量导出，与Web进程分开运行：
+
+    python -m app.worker [--concurrency N]
+
+单独运行工作进程时，请设置环境变量 EXPORT_EMBEDDED_WORKER=false，关闭Web进程内嵌的工作线程
+"""
+import argparse
+import signal
+import config
+from app.database import init_db
+from app.utils.logging_setup import setup_logging
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导出工作进程")
+    parser.add_argument("--concurrency", type=int, default=config.EXPORT_JOB_CONCURRENCY,
+                        help="同时执行的导出作业数")
+    parser.add_argument("--poll-interval", type=float, default=config.EXPORT_JOB_POLL_SECONDS,
+                        help="没有作业时的轮询间隔（秒）")
+    args = parser.parse_args()
+
+    setup_logging()
+    init_db()
+    if config.PDF_FONT_WARMUP:
+        from app.services.font_registry import warm_up
+        warm_up()
+
+    from app.services.job_queue import ExportWorker
+    worker = ExportWorker(concurrency=args.concurrency, poll_interval=args.poll_interval)
+
+    def handle_signal(signum, frame):
+        # 不再领取新作业；正在执行的作业结束后退出（强制退出时租约到期后会重新排队）
+        worker.stop(timeout=0)
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+    worker.start()
+    worker.wait()
+
+
+if __name__ == "__main__":
+    main()
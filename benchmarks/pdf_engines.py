@@ -0,0 +1,88 @@
+"""
+PDF处理引擎基准测试
+在同一组模板上比较各引擎（见 app/services/pdf_engine.py）的单份和批量填充耗时、输出文件大小。
+未安装的引擎跳过。
+
+用法：python benchmarks/pdf_engines.py [教师数] [模板PDF ...]
+不指定模板时使用生成的 1 页、20 页、100 页模板；指定的模板在第1页左上角区域放置占位符
+"""
+import os
+import sys
+import time
+import tempfile
+import warnings
+from io import BytesIO
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from app.services.pdf_engine import ENGINES, available_engines, create_engine
+
+warnings.simplefilter("ignore")
+
+GENERATED_PAGES = (1, 20, 100)
+
+TEXT_POSITIONS = [
+    {"field_name": "name", "page": 0, "x": 100, "y": 700, "font_size": 14},
+    {"field_name": "department", "page": 0, "x": 100, "y": 670},
+    {"field_name": "title", "page": 0, "x": 100, "y": 640},
+    {"field_name": "school", "page": 0, "x": 100, "y": 610, "is_constant": True, "constant_value": "示例学校"},
+]
+
+
+def make_template(path: str, num_pages: int):
+    """生成一个每页有较多正文的模板"""
+    from reportlab.pdfgen import canvas
+    can = canvas.Canvas(path, pagesize=(595, 842))
+    for page in range(num_pages):
+        for line in range(60):
+            can.drawString(40, 800 - line * 12, f"Page {page} line {line} " + "lorem ipsum " * 6)
+        can.showPage()
+    can.save()
+
+
+def teacher_data(index: int) -> dict:
+    return {"name": f"教师{index}", "department": f"第{index % 7}教研室", "title": "讲师"}
+
+
+def bench_template(label: str, template_path: str, num_teachers: int):
+    print(f"\n模板 {label}，{num_teachers} 位教师")
+    print(f"{'引擎':<10}{'单份(ms)':>10}{'批量(ms)':>10}{'文件大小':>10}")
+    data_list = [teacher_data(index) for index in range(num_teachers)]
+    for name in ENGINES:
+        if name not in available_engines():
+            print(f"{name:<10}{'未安装':>10}")
+            continue
+        engine = create_engine(name)
+        template_id = f"bench:{name}:{label}"
+        # 预热：加载模板、字体和绘制计划
+        engine.fill(template_path, BytesIO(), TEXT_POSITIONS, data_list[0], template_id=template_id)
+
+        start = time.perf_counter()
+        for data in data_list:
+            output = BytesIO()
+            engine.fill(template_path, output, TEXT_POSITIONS, data, template_id=template_id)
+        single = (time.perf_counter() - start) / num_teachers * 1000
+
+        start = time.perf_counter()
+        engine.fill_batch(template_path, TEXT_POSITIONS, data_list, template_id=template_id)
+        batch = (time.perf_counter() - start) / num_teachers * 1000
+
+        print(f"{name:<10}{single:>10.2f}{batch:>10.2f}{len(output.getvalue()):>10}")
+
+
+def main():
+    num_teachers = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    template_paths = sys.argv[2:]
+    if template_paths:
+        for template_path in template_paths:
+            bench_template(os.path.basename(template_path), template_path, num_teachers)
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        for num_pages in GENERATED_PAGES:
+            template_path = os.path.join(tmp, f"template_{num_pages}.pdf")
+            make_template(template_path, num_pages)
+            bench_template(f"{num_pages}页", template_path, num_teachers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+SQLite并发写入基准测试
+模拟截止日期前集中提交问卷：多个写线程同时保存问卷回答并合并教师扩展数据，另有读线程持续查询（如进度轮询、列表页），
+比较以下配置的 database is locked 错误数和写入延迟（p50/p99）：
+  default      - SQLite默认设置（回滚日志）
+  tuned        - WAL、synchronous=NORMAL、busy_timeout 等（SQLITE_PROFILE=tuned）
+  tuned+queue  - tuned 并通过进程内写队列合并写事务（DB_WRITE_QUEUE_ENABLED=true）
+
+用法：python benchmarks/sqlite_concurrent_writes.py [写线程数] [每线程写入次数] [读线程数]
+"""
+import os
+import sys
+import time
+import tempfile
+import threading
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from app.database import Base, sqlite_pragmas
+from app.models import Teacher, Questionnaire, QuestionnaireResponse
+from app.services.write_queue import WriteQueue
+
+NUM_TEACHERS = 500
+
+
+def make_engine(db_path: str, tuned: bool, pool_size: int):
+    engine = create_engine(
+        f"sqlite:///{db_path}",
+        connect_args={"check_same_thread": False},
+        pool_size=pool_size,
+        max_overflow=0,
+    )
+    if tuned:
+        def apply_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in sqlite_pragmas().items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+            cursor.close()
+        event.listen(engine, "connect", apply_pragmas)
+    return engine
+
+
+def seed(session_factory) -> int:
+    db = session_factory()
+    try:
+        db.add_all([Teacher(name=f"教师{i}", extra_data={}) for i in range(NUM_TEACHERS)])
+        questionnaire = Questionnaire(title="基准测试", fields=[], teacher_ids=list(range(1, NUM_TEACHERS + 1)),
+                                      status="active")
+        db.add(questionnaire)
+        db.commit()
+        return questionnaire.id
+    finally:
+        db.close()
+
+
+def submit(session, questionnaire_id: int, teacher_id: int, answers: dict):
+    """与问卷提交相同的写操作：保存回答并合并到教师扩展数据（不提交）"""
+    existing = session.query(QuestionnaireResponse).filter(
+        QuestionnaireResponse.questionnaire_id == questionnaire_id,
+        QuestionnaireResponse.teacher_id == teacher_id
+    ).first()
+    if existing:
+        existing.answers = answers
+        existing.submitted_at = datetime.now()
+    else:
+        session.add(QuestionnaireResponse(questionnaire_id=questionnaire_id, teacher_id=teacher_id,
+                                          answers=answers, status="pending"))
+    teacher = session.query(Teacher).filter(Teacher.id == teacher_id).first()
+    teacher.extra_data = dict(teacher.extra_data or {}, **answers)
+    teacher.updated_at = datetime.now()
+
+
+def run_scenario(name: str, writers: int, writes_per_thread: int, readers: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        tuned = name != "default"
+        engine = make_engine(os.path.join(tmp, "bench.db"), tuned, writers + readers + 1)
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        questionnaire_id = seed(session_factory)
+        queue = WriteQueue(session_factory) if name == "tuned+queue" else None
+
+        latencies = []
+        errors = {"locked": 0, "other": 0}
+        lock = threading.Lock()
+        stop_readers = threading.Event()
+
+        def writer(index: int):
+            for n in range(writes_per_thread):
+                teacher_id = (index * writes_per_thread + n) % NUM_TEACHERS + 1
+                answers = {"phone": f"138{index:04d}{n:04d}", "office": f"A{n}"}
+                start = time.perf_counter()
+                try:
+                    if queue is not None:
+                        queue.run(lambda session: submit(session, questionnaire_id, teacher_id, answers))
+                    else:
+                        db = session_factory()
+                        try:
+                            submit(db, questionnaire_id, teacher_id, answers)
+                            db.commit()
+                        except Exception:
+                            db.rollback()
+                            raise
+                        finally:
+                            db.close()
+                except OperationalError as e:
+                    with lock:
+                        errors["locked" if "locked" in str(e) else "other"] += 1
+                    continue
+                except Exception:
+                    with lock:
+                        errors["other"] += 1
+                    continue
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+
+        def reader():
+            while not stop_readers.is_set():
+                db = session_factory()
+                try:
+                    db.query(QuestionnaireResponse).filter(
+                        QuestionnaireResponse.questionnaire_id == questionnaire_id
+                    ).count()
+                    db.query(Teacher).all()
+                except OperationalError:
+                    pass
+                finally:
+                    db.close()
+
+        reader_threads = [threading.Thread(target=reader) for _ in range(readers)]
+        writer_threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+        for thread in reader_threads:
+            thread.start()
+        start = time.perf_counter()
+        for thread in writer_threads:
+            thread.start()
+        for thread in writer_threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        stop_readers.set()
+        for thread in reader_threads:
+            thread.join()
+        if queue is not None:
+            queue.stop()
+        engine.dispose()
+
+    latencies.sort()
+
+    def percentile(p: float) -> float:
+        if not latencies:
+            return float("nan")
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    print(f"{name:<13}{len(latencies):>8}{errors['locked']:>8}{errors['other']:>8}"
+          f"{percentile(0.5):>10.1f}{percentile(0.99):>10.1f}{len(latencies) / elapsed:>10.0f}")
+
+
+def main():
+    writers = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    writes_per_thread = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    readers = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    print(f"{writers} 个写线程 x {writes_per_thread} 次写入，{readers} 个读线程")
+    print(f"{'配置':<11}{'成功':>6}{'锁错误':>5}{'其他错误':>4}{'p50(ms)':>10}{'p99(ms)':>10}{'写入/秒':>7}")
+    for name in ("default", "tuned", "tuned+queue"):
+        run_scenario(name, writers, writes_per_thread, readers)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,19 @@ BASE_DIR = Path(__file__).parent
 
 # 数据库配置
 DATABASE_URL = "sqlite:///./teacher_data.db"
+# SQLite连接配置：tuned 在每个连接上启用WAL日志、synchronous=NORMAL、忙等待等（读写互不阻塞，适合集中提交和后台导出同时写入），
+# default 保持SQLite默认设置
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "tuned").lower()
+# 等待其他连接释放写锁的最长时间（毫秒），超时后才报 database is locked
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "10000"))
+# 每个连接的页缓存大小（KB）
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+# 内存映射读取的大小上限（字节，0表示不使用）
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+# 进程内写队列：问卷提交、导出进度等短写事务交给单个写线程按顺序执行，排队中的写操作合并为一个事务提交
+DB_WRITE_QUEUE_ENABLED = os.getenv("DB_WRITE_QUEUE_ENABLED", "false").lower() == "true"
+# 写队列每个事务最多合并的写操作数
+DB_WRITE_QUEUE_BATCH_SIZE = int(os.getenv("DB_WRITE_QUEUE_BATCH_SIZE", "32"))
 
 # 文件上传配置
 UPLOAD_DIR = BASE_DIR / "static" / "uploads"
@@ -17,6 +30,11 @@ TEMPLATE_DIR = UPLOAD_DIR / "templates"
 TEMPLATE_DIR.mkdir(parents=True, exist_ok=True)
 EXPORT_DIR = UPLOAD_DIR / "exports"
 EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+PREVIEW_CACHE_DIR = UPLOAD_DIR / "previews"
+PREVIEW_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+# 按内容寻址的渲染结果存储（每位教师的文件只保存一份）
+ARTIFACT_DIR = EXPORT_DIR / "artifacts"
+ARTIFACT_DIR.mkdir(parents=True, exist_ok=True)
 
 # 允许的文件类型（现在只支持PDF）
 ALLOWED_EXTENSIONS = {'.pdf'}
@@ -24,6 +42,93 @@ ALLOWED_EXTENSIONS = {'.pdf'}
 # 最大文件大小（MB）
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
 
+# PDF中文字体配置
+# 指定字体文件路径（可通过环境变量 PDF_FONT_PATH 设置），设置后优先使用，不再依赖系统字体扫描结果
+PDF_FONT_PATH = os.getenv("PDF_FONT_PATH", "")
+# 额外的字体搜索目录（环境变量 PDF_FONT_DIRS，多个目录用系统路径分隔符分隔），优先于系统字体目录
+PDF_FONT_DIRS = [d for d in os.getenv("PDF_FONT_DIRS", "").split(os.pathsep) if d]
+# Linux/macOS 下按文件名关键字匹配中文字体
+PDF_FONT_KEYWORDS = ["song", "simsun", "simhei", "noto", "pingfang"]
+# Windows 下按顺序查找的中文字体文件
+PDF_WINDOWS_FONT_FILES = ["simsun.ttc", "simsun.ttf", "simhei.ttf", "msyh.ttf", "msyhbd.ttf"]
+# 启动时预热字体（扫描并解析字体文件），避免第一次导出时才加载
+PDF_FONT_WARMUP = os.getenv("PDF_FONT_WARMUP", "true").lower() == "true"
+
+# 已解析PDF模板的缓存数量（LRU）
+TEMPLATE_CACHE_SIZE = int(os.getenv("TEMPLATE_CACHE_SIZE", "8"))
+# 已解析Word/Excel模板的缓存数量（LRU）
+OFFICE_TEMPLATE_CACHE_SIZE = int(os.getenv("OFFICE_TEMPLATE_CACHE_SIZE", "8"))
+# 问卷分享链接解析缓存（share_token → 问卷）的数量和有效期（秒）
+SHARE_TOKEN_CACHE_SIZE = int(os.getenv("SHARE_TOKEN_CACHE_SIZE", "256"))
+SHARE_TOKEN_CACHE_TTL = int(os.getenv("SHARE_TOKEN_CACHE_TTL", "300"))
+
+# 批量导出进程数（1为串行导出，0表示使用全部CPU核心）
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "1"))
+# 教师数量达到该值时才启用多进程导出（进程启动本身有开销）
+EXPORT_PARALLEL_MIN_TEACHERS = int(os.getenv("EXPORT_PARALLEL_MIN_TEACHERS", "20"))
+# 每批渲染的教师数：PDF模板同一批教师的覆盖层绘制在同一个canvas中，Word/Excel模板同一批共用替换计划（1表示逐个渲染）
+EXPORT_RENDER_BATCH_SIZE = int(os.getenv("EXPORT_RENDER_BATCH_SIZE", "16"))
+# PDF输出方式：true 时保留模板原始字节，只以增量更新追加有占位符的页面（加密的模板自动改为完整重写）
+# 默认关闭（完整重写），确认模板输出正常后再开启
+PDF_INCREMENTAL_UPDATE = os.getenv("PDF_INCREMENTAL_UPDATE", "false").lower() == "true"
+# 增量更新输出时，纯文本占位符直接写入页面内容流，不经过reportlab canvas（仅支持不嵌入字形的字体，默认关闭）
+PDF_DIRECT_TEXT = os.getenv("PDF_DIRECT_TEXT", "false").lower() == "true"
+# PDF处理引擎：pypdf2（默认）、pikepdf（需 pip install pikepdf，未安装时使用pypdf2）、auto（已安装pikepdf时使用pikepdf）
+# 上面两项增量更新/直接写入文本的选项只对pypdf2引擎有效
+PDF_ENGINE = os.getenv("PDF_ENGINE", "pypdf2").lower()
+
+# 渲染结果存储：导出和单个下载前先查找已渲染的相同文件
+ARTIFACT_STORE_ENABLED = os.getenv("ARTIFACT_STORE_ENABLED", "true").lower() == "true"
+# 渲染结果存储的总大小上限（字节，0表示不限制），超出后淘汰最久未使用的文件
+ARTIFACT_STORE_MAX_BYTES = int(os.getenv("ARTIFACT_STORE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+# 增量导出：模板和教师数据都没有变化时，直接复用之前导出的文件
+EXPORT_INCREMENTAL = os.getenv("EXPORT_INCREMENTAL", "true").lower() == "true"
+# 增量导出时查找同一模板最近几次的导出
+EXPORT_INCREMENTAL_LOOKBACK = int(os.getenv("EXPORT_INCREMENTAL_LOOKBACK", "5"))
+
+# 导出作业队列：同时执行的导出作业数（每个工作进程）
+EXPORT_JOB_CONCURRENCY = int(os.getenv("EXPORT_JOB_CONCURRENCY", "1"))
+# 作业租约时长（秒），工作进程每隔 EXPORT_JOB_HEARTBEAT_SECONDS 秒续期一次，崩溃后租约到期即重新排队
+EXPORT_JOB_LEASE_SECONDS = int(os.getenv("EXPORT_JOB_LEASE_SECONDS", "60"))
+EXPORT_JOB_HEARTBEAT_SECONDS = int(os.getenv("EXPORT_JOB_HEARTBEAT_SECONDS", "15"))
+# 没有作业时的轮询间隔（秒）
+EXPORT_JOB_POLL_SECONDS = float(os.getenv("EXPORT_JOB_POLL_SECONDS", "2"))
+# 作业因工作进程中断被重新排队的最大次数，超过后标记为失败
+EXPORT_JOB_MAX_ATTEMPTS = int(os.getenv("EXPORT_JOB_MAX_ATTEMPTS", "3"))
+# 在Web进程内启动导出工作线程（单独运行 python -m app.worker 时设为false）
+EXPORT_EMBEDDED_WORKER = os.getenv("EXPORT_EMBEDDED_WORKER", "true").lower() == "true"
+
+# 导出调度：同一进程内同时进行的导出/渲染数，其中 EXPORT_INTERACTIVE_RESERVED 个名额只留给单个教师下载等交互式请求
+# 名额按进程计算：独立运行的导出工作进程（python -m app.worker）有自己的名额，不与Web进程共享；
+# 所有进程合计同时执行的导出作业数由 EXPORT_JOB_CONCURRENCY × 工作进程数 决定
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "3"))
+EXPORT_INTERACTIVE_RESERVED = int(os.getenv("EXPORT_INTERACTIVE_RESERVED", "1"))
+# 等待名额的请求数上限，超出后直接返回429
+EXPORT_MAX_WAITING = int(os.getenv("EXPORT_MAX_WAITING", "20"))
+# 交互式请求最多等待名额的秒数，超时返回429
+EXPORT_INTERACTIVE_WAIT_SECONDS = float(os.getenv("EXPORT_INTERACTIVE_WAIT_SECONDS", "15"))
+# 教师数不超过该值的导出作业按交互式优先级排队
+EXPORT_SMALL_JOB_TEACHERS = int(os.getenv("EXPORT_SMALL_JOB_TEACHERS", "20"))
+# 排队中和执行中的导出作业数上限，超出后新的导出请求返回429
+EXPORT_MAX_QUEUED_JOBS = int(os.getenv("EXPORT_MAX_QUEUED_JOBS", "20"))
+
+# 导出进度写回任务记录（并检查是否取消）的最小间隔（秒）
+EXPORT_PROGRESS_INTERVAL = float(os.getenv("EXPORT_PROGRESS_INTERVAL", "1.0"))
+
+# 任务教师数不超过该值时，未完成的任务也可以直接流式下载（边渲染边下载）
+STREAM_DOWNLOAD_MAX_TEACHERS = int(os.getenv("STREAM_DOWNLOAD_MAX_TEACHERS", "200"))
+
+# PDF预览图片配置
+PREVIEW_DPI = int(os.getenv("PREVIEW_DPI", "200"))
+# 预览图片磁盘缓存的总大小上限（字节），超出后淘汰最久未使用的图片
+PREVIEW_CACHE_MAX_BYTES = int(os.getenv("PREVIEW_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+# 浏览器缓存预览图片的秒数（过期后通过ETag重新验证）
+PREVIEW_HTTP_MAX_AGE = int(os.getenv("PREVIEW_HTTP_MAX_AGE", "300"))
+
+# 日志级别（DEBUG时输出逐个占位符、逐页的详细处理日志）
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
 # 管理员密码（可以通过环境变量 ADMIN_PASSWORD 设置，默认密码为 admin123）
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "linmy")
 
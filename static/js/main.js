@@ -689,8 +689,11 @@ async function loadTasks() {
                             <div class="d-flex gap-2">
                         ${task.status === 'completed' ? `
                                     <a href="${API_BASE}/tasks/${task.id}/download" class="btn btn-sm btn-primary">下载</a>
+                                    ${task.progress_failed && task.output_format !== 'pdf' ? `<button class="btn btn-sm btn-outline-warning retry-failed-btn" data-task-id="${task.id}">重试失败的 ${task.progress_failed} 位教师</button>` : ''}
                         ` : task.status === 'processing' ? `
                                     <span class="text-info">正在处理中...</span>
+                                    <a href="${API_BASE}/tasks/${task.id}/download?stream=true" class="btn btn-sm btn-outline-primary">立即下载</a>
+                                    <button class="btn btn-sm btn-outline-danger cancel-task-btn" data-task-id="${task.id}">取消导出</button>
                         ` : ''}
                                 <button class="btn btn-sm btn-info show-task-detail-btn" data-task-id="${task.id}">查看详情</button>
                                 <button class="btn btn-sm btn-danger delete-task-btn" data-task-id="${task.id}" data-task-name="${escapeHtml(task.name)}">删除</button>
@@ -1409,6 +1412,28 @@ async function editResponseForTeacher(responseId, teacherId, questionnaireId) {
 
 // 处理任务列表按钮点击（事件委托）
 function handleTaskListClick(e) {
+    // 处理重试失败教师按钮
+    if (e.target.classList.contains('retry-failed-btn') || e.target.closest('.retry-failed-btn')) {
+        const btn = e.target.classList.contains('retry-failed-btn') ? e.target : e.target.closest('.retry-failed-btn');
+        const taskId = parseInt(btn.getAttribute('data-task-id'));
+        if (taskId) {
+            retryFailedTeachers(taskId, btn);
+        }
+        e.stopPropagation();
+        return;
+    }
+    
+    // 处理取消导出按钮
+    if (e.target.classList.contains('cancel-task-btn') || e.target.closest('.cancel-task-btn')) {
+        const btn = e.target.classList.contains('cancel-task-btn') ? e.target : e.target.closest('.cancel-task-btn');
+        const taskId = parseInt(btn.getAttribute('data-task-id'));
+        if (taskId) {
+            cancelTaskExport(taskId);
+        }
+        e.stopPropagation();
+        return;
+    }
+    
     // 处理删除按钮
     if (e.target.classList.contains('delete-task-btn') || e.target.closest('.delete-task-btn')) {
         const btn = e.target.classList.contains('delete-task-btn') ? e.target : e.target.closest('.delete-task-btn');
@@ -1446,6 +1471,41 @@ function handleTaskListClick(e) {
 }
 
 // 删除任务（设置为全局函数）
+// 只重新导出失败的教师
+async function retryFailedTeachers(taskId, btn) {
+    btn.disabled = true;
+    try {
+        const response = await fetch(`${API_BASE}/tasks/${taskId}/retry-failed`, { method: 'POST' });
+        const result = await response.json();
+        if (!response.ok) {
+            throw new Error(result.detail || '重试失败');
+        }
+        alert(result.message);
+        loadTasks();
+    } catch (error) {
+        alert('重试失败: ' + error.message);
+        btn.disabled = false;
+    }
+}
+
+// 取消正在进行的导出
+async function cancelTaskExport(taskId) {
+    if (!confirm('确定要取消该任务的导出吗？已生成的部分文件将被删除。')) {
+        return;
+    }
+    try {
+        const response = await fetch(`${API_BASE}/tasks/${taskId}/cancel`, { method: 'POST' });
+        const result = await response.json();
+        if (!response.ok) {
+            throw new Error(result.detail || '取消失败');
+        }
+        alert(result.message);
+        loadTasks();
+    } catch (error) {
+        alert('取消导出失败: ' + error.message);
+    }
+}
+
 window.deleteTask = async function(id, name) {
     // 安全地处理任务名称，避免特殊字符导致语法错误
     const safeName = String(name || '').replace(/"/g, '&quot;').replace(/\n/g, ' ');
@@ -1514,6 +1574,13 @@ function showCreateTaskModal() {
                         ${templates.length > 0 ? templates.map((t, index) => `<option value="${t.id}" ${index === 0 ? 'selected' : ''}>${t.name}</option>`).join('') : '<option value="">请选择</option>'}
                     </select>
                 </div>
+                <div class="mb-3">
+                    <label class="form-label">导出格式</label>
+                    <select class="form-select" name="output_format">
+                        <option value="zip" selected>ZIP（每位教师一个文件）</option>
+                        <option value="pdf">合并PDF（按教师顺序合成一个文件，便于打印，仅PDF模板）</option>
+                    </select>
+                </div>
                 <div class="mb-3">
                     <label class="form-label">选择教师 *</label>
                     <div class="mb-2">
@@ -1576,7 +1643,8 @@ function showCreateTaskModal() {
             const data = {
                 name: form.name.value.trim(),
                 template_id: templateId,
-                teacher_ids: teacherIds
+                teacher_ids: teacherIds,
+                output_format: form.output_format.value
             };
             
             // 验证数据
@@ -2793,6 +2861,7 @@ function getStatusBadge(status) {
         'processing': '<span class="badge bg-info">处理中</span>',
         'completed': '<span class="badge bg-success">已完成</span>',
         'failed': '<span class="badge bg-danger">失败</span>',
+        'cancelled': '<span class="badge bg-secondary">已取消</span>',
         'active': '<span class="badge bg-success">进行中</span>',
         'closed': '<span class="badge bg-secondary">已关闭</span>',
         'approved': '<span class="badge bg-success">已通过</span>',
@@ -3137,7 +3206,7 @@ async function completeTaskExport(taskId) {
                         const task = await taskRes.json();
                         console.log(`[导出任务] 检查任务状态 (${refreshCount}/${maxRefreshes}):`, task.status);
                         
-                        if (task.status === 'completed' || task.status === 'failed') {
+                        if (task.status === 'completed' || task.status === 'failed' || task.status === 'cancelled') {
                             clearInterval(refreshInterval);
                             console.log('[导出任务] 任务已完成或失败，停止自动刷新');
                             
@@ -3147,6 +3216,8 @@ async function completeTaskExport(taskId) {
                             
                             if (task.status === 'completed') {
                                 alert('导出任务已完成！您可以下载导出文件了。');
+                            } else if (task.status === 'cancelled') {
+                                alert('导出任务已取消。');
                             } else {
                                 // 尝试获取更详细的错误信息
                                 console.error('[导出任务] 任务失败详情:', task);
@@ -3159,7 +3230,16 @@ async function completeTaskExport(taskId) {
                                 // 只更新状态显示，不重新加载整个详情
                                 const statusBadge = document.querySelector('.modal.show .badge');
                                 if (statusBadge) {
-                                    statusBadge.textContent = '处理中';
+                                    let statusText = '处理中';
+                                    const progressRes = await fetch(`${API_BASE}/tasks/${taskId}/progress`);
+                                    if (progressRes.ok) {
+                                        const progress = await progressRes.json();
+                                        statusText = `处理中 ${progress.percent}%`;
+                                        if (progress.eta_seconds !== null) {
+                                            statusText += `（预计剩余 ${Math.ceil(progress.eta_seconds)} 秒）`;
+                                        }
+                                    }
+                                    statusBadge.textContent = statusText;
                                     statusBadge.className = 'badge bg-warning';
                                 }
                             }
@@ -0,0 +1,101 @@
+"""
+PDF增量更新输出：模板原始字节保留，追加的对象编号不能与模板已有对象冲突
+"""
+import zlib
+from io import BytesIO
+
+import pytest
+
+PyPDF2 = pytest.importorskip("PyPDF2")
+pytest.importorskip("reportlab")
+
+import config
+from app.services.pdf_handler import add_text_to_pdf
+from app.services.template_cache import get_pdf_template
+
+TEXT_POSITIONS = [
+    {"field_name": "name", "page": 0, "x": 100, "y": 700, "font_size": 14},
+    {"field_name": "title", "page": 0, "x": 100, "y": 670},
+]
+DATA = {"name": "Alice", "title": "Lecturer"}
+
+
+def make_xref_stream_pdf() -> bytes:
+    """生成使用交叉引用流（PDF 1.5+，没有传统的 trailer）的单页模板"""
+    content = b"BT /F1 12 Tf 72 760 Td (Template body) Tj ET"
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents 4 0 R"
+        b" /Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length " + str(len(content)).encode() + b" >>\nstream\n" + content + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    output = BytesIO()
+    output.write(b"%PDF-1.5\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(output.tell())
+        output.write(f"{number} 0 obj\n".encode() + body + b"\nendobj\n")
+
+    xref_number = len(objects) + 1
+    xref_position = output.tell()
+    rows = [b"\x00\x00\x00\x00\x00\xff\xff"]
+    rows.extend(b"\x01" + offset.to_bytes(4, "big") + b"\x00\x00" for offset in offsets)
+    rows.append(b"\x01" + xref_position.to_bytes(4, "big") + b"\x00\x00")
+    xref_data = zlib.compress(b"".join(rows))
+    output.write(
+        f"{xref_number} 0 obj\n<< /Type /XRef /Size {xref_number + 1} /W [1 4 2] /Root 1 0 R"
+        f" /Filter /FlateDecode /Length {len(xref_data)} >>\nstream\n".encode()
+        + xref_data + b"\nendstream\nendobj\n"
+    )
+    output.write(f"startxref\n{xref_position}\n%%EOF\n".encode())
+    return output.getvalue()
+
+
+def page_text(page) -> str:
+    """页面文本（默认的中文字体为UCS-2编码，PyPDF2解码后每个字符前多一个\\x00）"""
+    return page.extract_text().replace("\x00", "")
+
+
+@pytest.fixture
+def incremental(monkeypatch):
+    monkeypatch.setattr(config, "PDF_INCREMENTAL_UPDATE", True)
+
+
+@pytest.mark.parametrize("direct_text", [False, True])
+def test_xref_stream_template(tmp_path, monkeypatch, incremental, direct_text):
+    monkeypatch.setattr(config, "PDF_DIRECT_TEXT", direct_text)
+    template_path = tmp_path / "xref_stream.pdf"
+    template_path.write_bytes(make_xref_stream_pdf())
+
+    cached_template = get_pdf_template(str(template_path), TEXT_POSITIONS, f"xref-stream-{direct_text}")
+    assert cached_template.xref_size == 7
+    assert cached_template.supports_incremental
+
+    output = BytesIO()
+    add_text_to_pdf(str(template_path), output, TEXT_POSITIONS, DATA, template_id=f"xref-stream-{direct_text}")
+    data = output.getvalue()
+    assert data.startswith(template_path.read_bytes())
+
+    reader = PyPDF2.PdfReader(BytesIO(data), strict=True)
+    assert int(reader.trailer["/Size"]) > 7
+    assert len(reader.pages) == 1
+    text = page_text(reader.pages[0])
+    assert "Template body" in text
+    assert "Alice" in text and "Lecturer" in text
+
+
+def test_classic_xref_template(tmp_path, incremental):
+    from reportlab.pdfgen import canvas
+    template_path = tmp_path / "classic.pdf"
+    can = canvas.Canvas(str(template_path), pagesize=(595, 842))
+    can.drawString(72, 760, "Template body")
+    can.showPage()
+    can.save()
+
+    output = BytesIO()
+    add_text_to_pdf(str(template_path), output, TEXT_POSITIONS, DATA, template_id="classic")
+    reader = PyPDF2.PdfReader(BytesIO(output.getvalue()), strict=True)
+    text = page_text(reader.pages[0])
+    assert "Template body" in text and "Alice" in text
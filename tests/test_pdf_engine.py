@@ -0,0 +1,85 @@
+"""
+PDF处理引擎：接口检查，以及pikepdf引擎（未安装时跳过）的单份和批量填充
+"""
+import gc
+from io import BytesIO
+
+import pytest
+
+pytest.importorskip("PyPDF2")
+pytest.importorskip("reportlab")
+
+from app.services.pdf_engine import PdfEngine, PikePdfEngine, PyPdf2Engine, PIKEPDF_AVAILABLE
+
+TEXT_POSITIONS = [
+    {"field_name": "name", "page": 0, "x": 100, "y": 700, "font_size": 14},
+    {"field_name": "title", "page": 1, "x": 100, "y": 670},
+]
+
+requires_pikepdf = pytest.mark.skipif(not PIKEPDF_AVAILABLE, reason="pikepdf未安装")
+
+
+def page_texts(content: bytes):
+    """各页文本（默认的中文字体为UCS-2编码，PyPDF2解码后每个字符前多一个\\x00）"""
+    from PyPDF2 import PdfReader
+    return [page.extract_text().replace("\x00", "") for page in PdfReader(BytesIO(content)).pages]
+
+
+@pytest.fixture
+def template_path(tmp_path):
+    from reportlab.pdfgen import canvas
+    path = tmp_path / "template.pdf"
+    can = canvas.Canvas(str(path), pagesize=(595, 842))
+    for page in range(2):
+        can.drawString(72, 760, f"Template page {page}")
+        can.showPage()
+    can.save()
+    return str(path)
+
+
+def test_incomplete_engine_cannot_be_created():
+    class IncompleteEngine(PdfEngine):
+        name = "incomplete"
+
+        def open_template(self, template_path, text_positions, template_id=None):
+            return None
+
+    with pytest.raises(TypeError):
+        IncompleteEngine()
+    assert PyPdf2Engine().name == "pypdf2"
+
+
+@requires_pikepdf
+def test_pikepdf_fill_keeps_overlay_source(template_path):
+    engine = PikePdfEngine()
+    template = engine.open_template(template_path, TEXT_POSITIONS, "pikepdf-fill")
+    overlays = engine.build_overlays(template, {"name": "Alice", "title": "Lecturer"})
+    # 覆盖层所在的临时Pdf只由覆盖层引用，回收后仍能写出
+    gc.collect()
+    output = BytesIO()
+    engine.write_output(template, overlays, output)
+    texts = page_texts(output.getvalue())
+    assert "Template page 0" in texts[0] and "Alice" in texts[0]
+    assert "Template page 1" in texts[1] and "Lecturer" in texts[1]
+
+
+@requires_pikepdf
+def test_pikepdf_fill_batch_does_not_leak_between_teachers(template_path):
+    import pikepdf
+    engine = PikePdfEngine()
+    data_list = [{"name": f"Teacher{index}", "title": f"Title{index}"} for index in range(3)]
+    results = engine.fill_batch(template_path, TEXT_POSITIONS, data_list, template_id="pikepdf-batch")
+    assert len(results) == 3
+    for index, content in enumerate(results):
+        texts = page_texts(content)
+        assert f"Teacher{index}" in texts[0] and f"Title{index}" in texts[1]
+        for other in range(3):
+            if other != index:
+                assert f"Teacher{other}" not in texts[0] and f"Title{other}" not in texts[1]
+        with pikepdf.open(BytesIO(content)) as pdf:
+            for page in pdf.pages:
+                assert len(page.Resources.get("/XObject", {})) == 1
+
+    single = BytesIO()
+    engine.fill(template_path, single, TEXT_POSITIONS, data_list[0], template_id="pikepdf-batch")
+    assert page_texts(single.getvalue()) == page_texts(results[0])